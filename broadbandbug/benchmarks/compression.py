@@ -0,0 +1,66 @@
+""" Benchmarks compressing recording files (as shards.compact does to old shards): how much disk space each compression
+saves, how long compressing takes, and how much slower reading the compressed file is than the uncompressed one.
+
+Uses the same synthetic recording files as the read/plot benchmark (see read_plot), in both storage formats.
+
+Run with: python -m broadbandbug.benchmarks.compression [--rows 100000 1000000 ...] [--data-dir DIR]
+"""
+import argparse
+from pathlib import Path
+from time import perf_counter
+
+from broadbandbug.benchmarks import read_plot
+from broadbandbug.library import classes
+from broadbandbug.library import constants
+from broadbandbug.library import shards
+from broadbandbug.library import storage
+
+DEFAULT_ROWS = (100_000, 1_000_000)
+REPEAT = 3  # Reads are timed at best of this many runs
+
+
+def time_read(path: Path) -> float:
+    """ Returns how long it takes to read the recording file at the path provided into a ReadingBatch, in seconds. """
+    recording = storage.open_storage(path)
+    return read_plot.measure(lambda: classes.ReadingBatch.from_records(recording.read_arrays()), track_memory=False,
+                             repeat=REPEAT)[0]
+
+
+def run(rows_list: list[int], data_dir: Path) -> list[dict]:
+    """ Prints and returns the size, compression time and read time of each recording file, with each compression. """
+    results = []
+    print(f"{'file':<34}{'compression':<13}{'size (MB)':>10}{'ratio':>8}{'compress (s)':>14}{'read (s)':>10}"
+          f"{'overhead':>10}")
+    for rows in rows_list:
+        for file_format in ("csv", "binary"):
+            path = read_plot.get_recording(rows, file_format, data_dir)
+            size = path.stat().st_size
+            read_seconds = time_read(path)
+            results.append({"rows": rows, "format": file_format, "compression": None, "size": size,
+                            "compress_seconds": 0, "read_seconds": read_seconds})
+            print(f"{path.name:<34}{'none':<13}{size / 1e6:>10.1f}{1:>8.1f}{'':>14}{read_seconds:>10.3f}{'':>10}")
+
+            for compression in constants.Compression:
+                compressed_path = path.with_name(path.name + compression.value)
+                start = perf_counter()
+                shards.compress_file(path, compressed_path, compression)
+                compress_seconds = perf_counter() - start
+                compressed_size = compressed_path.stat().st_size
+                compressed_read_seconds = time_read(compressed_path)
+                compressed_path.unlink()  # Only the uncompressed files are kept, since they take a while to generate
+
+                results.append({"rows": rows, "format": file_format, "compression": compression.name.lower(),
+                                "size": compressed_size, "compress_seconds": compress_seconds,
+                                "read_seconds": compressed_read_seconds})
+                print(f"{'':<34}{compression.name.lower():<13}{compressed_size / 1e6:>10.1f}"
+                      f"{size / compressed_size:>8.1f}{compress_seconds:>14.2f}{compressed_read_seconds:>10.3f}"
+                      f"{compressed_read_seconds / read_seconds:>9.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks compressing recording files.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--data-dir", type=Path, default=read_plot.DATA_DIR)
+    args = parser.parse_args()
+    run(args.rows, args.data_dir)
@@ -0,0 +1,291 @@
+""" Benchmarks the read/plot pipeline (parsing, with and without memory mapping, filtering, sorting, grouping,
+files.read_results and building graph windows) on synthetic recording files, from 10 thousand to 10 million readings.
+
+Each stage is timed, then run again with tracemalloc to find its peak memory use (NumPy's allocations are included).
+Results are appended to a JSON lines file along with the git revision, so runs from different versions can be compared
+with --compare.
+
+Run with: python -m broadbandbug.benchmarks.read_plot [--rows 10000 100000 ...] [--format csv|binary] [--compare]
+Generated recording files are cached in the directory given by --data-dir, since large ones take a while to write.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter
+from typing import Callable
+
+import numpy as np
+
+from broadbandbug.library import classes
+from broadbandbug.library import constants
+from broadbandbug.library import files
+from broadbandbug.library import mapped
+from broadbandbug.library import storage
+from broadbandbug.library import timeparse
+
+DEFAULT_ROWS = (10_000, 100_000, 1_000_000, 10_000_000)
+# What fraction of readings each method makes up: latency probes take a sample every few seconds, while speed tests are
+# far less frequent
+METHOD_MIX = {
+    constants.RecordingMethod.LATENCY: 0.85,
+    constants.RecordingMethod.SPEEDTEST_CLI: 0.10,
+    constants.RecordingMethod.WHICH_WEBSITE: 0.03,
+    constants.RecordingMethod.BSC: 0.02,
+}
+MEAN_INTERVAL = 5  # Mean seconds between readings
+FAILURE_RATE = 0.005  # Fraction of speed test readings that are 0, as if the connection was down
+REPEAT_MAX_ROWS = 100_000  # Stages are timed at best of 3 for files up to this size, since short timings vary more
+LIST_MAX_ROWS = 1_000_000  # Stages building lists of Reading objects are skipped for larger files, to save memory
+RESULTS_PATH = Path("./benchmark_results.jsonl")
+DATA_DIR = Path("./benchmark_data")
+REGRESSION_THRESHOLD = 1.2  # --compare flags stages this many times slower (or more memory hungry) than before
+
+
+def make_records(rows: int, seed: int = 0, method_mix: dict = METHOD_MIX) -> np.ndarray:
+    """ Makes synthetic readings as a structured array in the format of storage.RECORD_DTYPE.
+    Readings come from several recorders, so timestamps are mostly, but not entirely, in order. Speeds follow a daily
+    pattern, with occasional failed tests. """
+    rng = np.random.default_rng(seed)
+    methods = list(method_mix.keys())
+    chosen = rng.choice(len(methods), rows, p=np.array(list(method_mix.values())) / sum(method_mix.values()))
+    codes = np.array([constants.METHOD_CODES[method] for method in methods], dtype=np.uint8)[chosen]
+    is_latency = np.isin(codes, [constants.METHOD_CODES[method] for method in constants.LATENCY_METHODS])
+
+    start = datetime(2023, 1, 1).timestamp()
+    timestamps = start + np.cumsum(rng.exponential(MEAN_INTERVAL, rows)) + rng.normal(0, MEAN_INTERVAL, rows)
+    # The precision stored in CSV files: milliseconds for latency readings, and whole seconds for the others
+    timestamps = np.where(is_latency, np.round(timestamps, 3), np.floor(timestamps))
+
+    # Speeds dip in the evening, when the connection is busiest
+    time_of_day = (timestamps % 86400) / 86400
+    busyness = 0.5 + 0.5 * np.cos(2 * np.pi * (time_of_day - 0.85))
+    downloads = np.maximum(rng.normal(70, 8, rows) * (1 - 0.4 * busyness), 0.1)
+    uploads = np.maximum(rng.normal(18, 2, rows) * (1 - 0.2 * busyness), 0.1)
+    failed = ~is_latency & (rng.random(rows) < FAILURE_RATE)
+    downloads[failed] = uploads[failed] = 0
+
+    # Latency methods store latency and jitter in milliseconds instead
+    downloads[is_latency] = rng.gamma(4, 5, is_latency.sum()) * (1 + busyness[is_latency])
+    uploads[is_latency] = rng.gamma(2, 1.5, is_latency.sum())
+
+    records = np.zeros(rows, dtype=storage.RECORD_DTYPE)
+    records["timestamp"] = timestamps
+    records["download"] = np.round(downloads, 2)
+    records["upload"] = np.round(uploads, 2)
+    records["method"] = codes
+    records["streams"] = np.where(codes == constants.METHOD_CODES[constants.RecordingMethod.SPEEDTEST_CLI],
+                                  rng.choice([1, 4, 8], rows), 0)
+    records["loss"] = np.where(is_latency, rng.binomial(constants.LATENCY_PROBES, 0.01, rows)
+                               / constants.LATENCY_PROBES, np.nan)
+    return records
+
+
+def write_recording(path: Path, records: np.ndarray, chunk_size: int = 100_000):
+    """ Writes records from make_records to a recording file, in the format chosen by its suffix. """
+    if path.suffix == constants.BINARY_RECORDING_SUFFIX:
+        with open(path, "wb") as file:
+            file.write(storage.HEADER_STRUCT.pack(storage.BINARY_MAGIC, storage.BINARY_VERSION,
+                                                  storage.RECORD_DTYPE.itemsize))
+            records.tofile(file)
+        return
+
+    method_values = {code: method.value for method, code in constants.METHOD_CODES.items()}
+    latency_codes = {constants.METHOD_CODES[method] for method in constants.LATENCY_METHODS}
+    with open(path, "w", newline="") as file:
+        file.write(",".join(classes.Reading.attributes) + "\r\n")
+        # Formatted a chunk at a time, since building every row at once would need a lot of memory
+        for chunk_start in range(0, len(records), chunk_size):
+            chunk = records[chunk_start:chunk_start + chunk_size]
+            file.writelines(
+                f"{download:g},{upload:g},"
+                f"{timeparse.format_timestamp(datetime.fromtimestamp(timestamp), method in latency_codes)},"
+                f"{method_values[method]},{streams or ''},{'' if loss != loss else f'{loss:g}'}\r\n"
+                for timestamp, download, upload, method, streams, loss in zip(
+                    chunk["timestamp"].tolist(), chunk["download"].tolist(), chunk["upload"].tolist(),
+                    chunk["method"].tolist(), chunk["streams"].tolist(), chunk["loss"].tolist()))
+
+
+def get_recording(rows: int, file_format: str, data_dir: Path = DATA_DIR, seed: int = 0) -> Path:
+    """ Returns the path of a synthetic recording file with the number of rows and format provided, generating it if it
+    isn't cached in data_dir. """
+    suffix = constants.BINARY_RECORDING_SUFFIX if file_format == "binary" else ".csv"
+    path = data_dir / f"synthetic_{rows}_{seed}{suffix}"
+    if not path.exists():
+        data_dir.mkdir(parents=True, exist_ok=True)
+        print(f"Generating {path}...")
+        temporary_path = path.with_name(path.name + ".tmp" + suffix)
+        write_recording(temporary_path, make_records(rows, seed))
+        temporary_path.replace(path)
+    return path
+
+
+def measure(function: Callable, track_memory: bool = True, repeat: int = 1) -> tuple[float, int | None, object]:
+    """ Runs function, returning how long it took in seconds (the best of repeat runs), its peak memory use in bytes
+    (found by running it again with tracemalloc, which slows it down too much to time at the same time), and what it
+    returned. """
+    seconds = float("inf")
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        start = perf_counter()
+        result = function()
+        seconds = min(seconds, perf_counter() - start)
+
+    peak = None
+    if track_memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak, result
+
+
+def get_stages(path: Path, rows: int, plot: bool) -> list[tuple[str, Callable]]:
+    """ Returns the stages to benchmark as (name, function) tuples. Each function is given the results of the stages
+    before it, by name. """
+    recording = storage.open_storage(path)
+
+    def middle_half(results) -> tuple[datetime, datetime]:
+        timestamps = results["parse"].timestamps
+        earliest, latest = timestamps.min(), timestamps.max()
+        quarter = (latest - earliest) / 4
+        return datetime.fromtimestamp(earliest + quarter), datetime.fromtimestamp(latest - quarter)
+
+    def sort(results):
+        batch = results["parse"][:]  # Sorting replaces the arrays rather than changing them, so this doesn't copy
+        batch.sort_by_timestamp()
+        return batch
+
+    stages = [
+        ("parse", lambda results: classes.ReadingBatch.from_records(recording.read_arrays())),
+        ("parse mapped", lambda results: classes.ReadingBatch.from_records(mapped.read_arrays(recording))),
+        ("filter", lambda results: results["parse"].filter_by_time(middle_half(results))),
+        ("sort", sort),
+        ("group", lambda results: results["sort"].group_by_method()),
+        ("read_results merged", lambda results: files.read_results(path, None, True, as_batch=True)),
+        ("read_results unmerged", lambda results: files.read_results(path, None, False, as_batch=True)),
+    ]
+    if rows <= LIST_MAX_ROWS:
+        stages += [
+            ("read_results lists unmerged", lambda results: files.read_results(path, None, False)),
+            ("prune_unused_groups", lambda results: files.prune_unused_groups(
+                {method: list(group) for method, group in results["read_results lists unmerged"].items()}
+                | {method: [] for method in constants.RecordingMethod
+                   if method not in results["read_results lists unmerged"]})),
+        ]
+    if plot:
+        from broadbandbug.gui.graph_windows import MergedGraphWindow, UnmergedGraphWindow
+
+        def build(window_type, readings):
+            window = window_type(readings, None)
+            window.close()
+            return window
+
+        stages += [
+            ("plot merged", lambda results: build(MergedGraphWindow, results["read_results merged"])),
+            ("plot unmerged", lambda results: build(UnmergedGraphWindow, results["read_results unmerged"])),
+        ]
+    return stages
+
+
+def get_revision() -> str:
+    """ Returns the git revision of the working tree (marked if it has uncommitted changes), or 'unknown'. """
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True,
+                              cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(rows_list=DEFAULT_ROWS, file_format: str = "csv", plot: bool = True, track_memory: bool = True,
+        results_path: Path | None = RESULTS_PATH, data_dir: Path = DATA_DIR, label: str | None = None) -> list[dict]:
+    """ Runs every stage on a recording file of each size, printing and returning the results. The results are appended
+    to results_path, unless it is None. """
+    if plot:
+        # Graph windows need an application, but don't need to be shown
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt6.QtWidgets import QApplication
+        app = QApplication.instance() or QApplication([])  # Kept in a variable, so it isn't deleted
+
+    run_info = {"run": datetime.now().isoformat(timespec="seconds"), "revision": get_revision(), "label": label,
+                "python": platform.python_version(), "numpy": np.__version__, "format": file_format}
+    results = []
+    for rows in rows_list:
+        path = get_recording(rows, file_format, data_dir)
+        print(f"{rows:,} readings ({file_format}, {path.stat().st_size / 2 ** 20:,.1f} MiB):")
+        outputs = {}
+        for name, function in get_stages(path, rows, plot):
+            seconds, peak, outputs[name] = measure(lambda: function(outputs), track_memory,
+                                                  3 if rows <= REPEAT_MAX_ROWS else 1)
+            peak_text = "" if peak is None else f"{peak / 2 ** 20:10.1f} MiB peak"
+            print(f"  {name:<30}{seconds * 1000:10.1f} ms {peak_text}")
+            results.append(run_info | {"rows": rows, "stage": name, "seconds": seconds, "peak_bytes": peak})
+        del outputs
+
+    if results_path is not None:
+        with open(results_path, "a") as results_file:
+            results_file.writelines(json.dumps(result) + "\n" for result in results)
+    return results
+
+
+def load_results(results_path: Path = RESULTS_PATH) -> list[dict]:
+    if not results_path.exists():
+        return []
+    with open(results_path, "r") as results_file:
+        return [json.loads(line) for line in results_file if line.strip()]
+
+
+def compare(results: list[dict], previous_results: list[dict], threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """ Compares results with the most recent earlier result for the same stage, format and number of rows, returning a
+    line describing each change (marked REGRESSION if it is at least threshold times worse). """
+    latest = {}
+    for result in previous_results:
+        latest[result["format"], result["rows"], result["stage"]] = result
+
+    lines = []
+    for result in results:
+        before = latest.get((result["format"], result["rows"], result["stage"]))
+        if before is None:
+            continue
+        changes = []
+        for key, unit, scale in (("seconds", "ms", 1000), ("peak_bytes", "MiB", 1 / 2 ** 20)):
+            if result[key] is None or not before[key]:
+                continue
+            ratio = result[key] / before[key]
+            marker = " REGRESSION" if ratio >= threshold else ""
+            changes.append(f"{before[key] * scale:.1f} -> {result[key] * scale:.1f} {unit} ({ratio:.2f}x){marker}")
+        if changes:
+            lines.append(f"{result['rows']:>10,} {result['stage']:<30} " + ", ".join(changes)
+                         + f" (vs {before['revision']})")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the read/plot pipeline on synthetic recording files.")
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS, help="sizes of recording file to test")
+    parser.add_argument("--format", choices=("csv", "binary"), default="csv", dest="file_format")
+    parser.add_argument("--no-plot", action="store_false", dest="plot", help="skip building graph windows")
+    parser.add_argument("--no-memory", action="store_false", dest="track_memory",
+                        help="skip measuring peak memory, which runs each stage a second time")
+    parser.add_argument("--results", type=Path, default=RESULTS_PATH, help="file the results are appended to")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR, help="where generated recording files are cached")
+    parser.add_argument("--label", help="a note stored with the results, e.g. what changed")
+    parser.add_argument("--compare", action="store_true", help="compare with the previous results in the results file")
+    args = parser.parse_args()
+
+    previous = load_results(args.results)
+    new_results = run(args.rows, args.file_format, args.plot, args.track_memory, args.results, args.data_dir,
+                      args.label)
+    if args.compare:
+        print("Compared with previous results:")
+        print("\n".join(compare(new_results, previous)) or "  No previous results to compare with")
@@ -0,0 +1,59 @@
+""" Measures how long the headless daemon (and the GUI, for comparison) take to start from cold, and checks that the
+daemon doesn't import heavy modules it doesn't need (Qt, pyqtgraph, selenium, speedtest).
+Each measurement starts a new Python process, so it includes starting the interpreter; the best of several runs is
+used, since the first run after installing (or after the disk cache is cleared) compiles and reads everything.
+Exits with code 1 if the daemon takes longer than constants.DAEMON_STARTUP_TARGET to import, or imports a heavy module.
+
+Run with: python -m broadbandbug.benchmarks.startup [runs]
+"""
+import subprocess
+import sys
+from time import perf_counter
+
+from broadbandbug.library import constants
+
+HEAVY_MODULES = ("PyQt6", "pyqtgraph", "selenium", "speedtest")
+# Code run in each new process: what is timed, then printing which heavy modules it imported
+IMPORTS = {
+    "python": "pass",
+    "daemon": "import broadbandbug.daemon",
+    "daemon + latency recorder": "import broadbandbug.daemon, broadbandbug.recorders.latency",
+    "gui": "import broadbandbug.gui.main_window",
+}
+REPORT_MODULES = f"import sys; print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))"
+
+
+def time_import(code: str) -> tuple[float, list[str]]:
+    """ Runs code in a new Python process, returning how long the process took, and which heavy modules it imported.
+        Raises CalledProcessError if the code fails (e.g. a module isn't installed). """
+    start = perf_counter()
+    result = subprocess.run([sys.executable, "-c", f"{code}; {REPORT_MODULES}"], capture_output=True, text=True,
+                            check=True)
+    seconds = perf_counter() - start
+    return seconds, [name for name in result.stdout.strip().split(",") if name]
+
+
+def run(runs: int = 5) -> bool:
+    """ Prints the best startup time of each entry point, returning True if the daemon meets its target. """
+    passed = True
+    for name, code in IMPORTS.items():
+        try:
+            times, heavy = zip(*(time_import(code) for _ in range(runs)))
+        except subprocess.CalledProcessError as e:
+            print(f"{name:<30}failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{name:<30}{min(times) * 1000:8.0f} ms (best of {runs}), "
+              f"imports: {', '.join(heavy[0]) or 'nothing heavy'}")
+
+        if name.startswith("daemon"):
+            if heavy[0]:
+                print(f"  The daemon shouldn't import {', '.join(heavy[0])}")
+                passed = False
+            if min(times) > constants.DAEMON_STARTUP_TARGET:
+                print(f"  Slower than the target of {constants.DAEMON_STARTUP_TARGET * 1000:.0f} ms")
+                passed = False
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else 5) else 1)
@@ -0,0 +1,49 @@
+""" Benchmarks the timestamp parsers in the timeparse module against datetime.strptime.
+Run with: python -m broadbandbug.benchmarks.timestamps [number of timestamps] """
+import sys
+from datetime import datetime, timedelta
+from random import Random
+from timeit import timeit
+
+from broadbandbug.library import constants
+from broadbandbug.library import timeparse
+
+
+def make_timestamps(count: int) -> list[str]:
+    """ Makes timestamps spread over roughly a year, formatted like they are in recording files. """
+    random = Random(0)
+    start = datetime(2023, 1, 1)
+    return [(start + timedelta(seconds=random.randrange(365 * 24 * 60 * 60))).strftime(constants.TIME_FORMAT)
+            for _ in range(count)]
+
+
+def run(count: int):
+    timestamps = make_timestamps(count)
+
+    def strptime():
+        return [datetime.strptime(string, constants.TIME_FORMAT) for string in timestamps]
+
+    def strptime_to_epoch():
+        return [datetime.strptime(string, constants.TIME_FORMAT).timestamp() for string in timestamps]
+
+    def scalar():
+        return [timeparse.parse_timestamp(string) for string in timestamps]
+
+    def vectorised():
+        return timeparse.parse_timestamps(timestamps)
+
+    # Check the parsers agree before timing them
+    assert scalar() == strptime()
+    assert vectorised().tolist() == strptime_to_epoch()
+
+    print(f"Parsing {count:,} timestamps (best of 3):")
+    baseline = None
+    for name, function in (("strptime", strptime), ("strptime + timestamp()", strptime_to_epoch),
+                           ("parse_timestamp", scalar), ("parse_timestamps", vectorised)):
+        seconds = min(timeit(function, number=1) for _ in range(3))
+        baseline = baseline or seconds
+        print(f"  {name:<24}{seconds * 1000:10.1f} ms {baseline / seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,129 @@
+""" Runs recorders without the GUI, e.g. on a server with no display, until it is interrupted (Ctrl+C or SIGTERM).
+
+Nothing from Qt is imported, and each recorder's dependencies (speedtest, selenium) are only imported if it is used, so
+the daemon starts quickly on small computers. The recorders share the results writer and bandwidth lease, the same as
+in the GUI, and the metrics exporter can be enabled to monitor them.
+
+Run with: python -m broadbandbug.daemon [--method "Speedtest CLI" --method "Latency probe" ...] [--recording PATH]
+                                        [--exporter] [--check-startup]
+--check-startup starts the recorders, prints how long it took for them all to start, then stops, which is useful to
+check startup time (see also benchmarks.startup).
+"""
+from time import perf_counter
+
+IMPORT_START = perf_counter()  # Before anything else is imported, so the startup time includes importing
+
+import argparse
+import signal
+import sys
+from pathlib import Path
+from threading import Event
+
+from broadbandbug import recorders
+from broadbandbug.library import classes
+from broadbandbug.library import constants
+from broadbandbug.library import engine
+from broadbandbug.library import scheduler
+
+STARTUP_CHECK_INTERVAL = 0.05  # How often the daemon checks whether every recorder has started, in seconds
+STOP_CHECK_INTERVAL = 0.5  # How often the daemon checks whether every recorder has failed, in seconds
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m broadbandbug.daemon",
+                                     description="Runs recorders without the GUI, until interrupted.")
+    parser.add_argument("--method", action="append", dest="methods", type=constants.RecordingMethod,
+                        metavar="METHOD", help="a recording method to run a recorder for; can be given more than once. "
+                        f"One of: {', '.join(repr(method.value) for method in recorders.RECORDER_TYPES)}. "
+                        f"Defaults to {constants.RecordingMethod.SPEEDTEST_CLI.value!r}.")
+    parser.add_argument("--browser", type=constants.Browser, default=constants.Browser.EDGE,
+                        help="the browser used by browser based recorders")
+    parser.add_argument("--recording", type=Path, default=constants.RECORDING_DEFAULT_PATH,
+                        help="the recording file readings are added to")
+    parser.add_argument("--exporter", action="store_true", default=constants.EXPORTER_ENABLED,
+                        help="serve metrics for monitoring tools to scrape (see the exporter module)")
+    parser.add_argument("--exporter-host", default=constants.EXPORTER_HOST)
+    parser.add_argument("--exporter-port", type=int, default=constants.EXPORTER_PORT)
+    parser.add_argument("--check-startup", action="store_true",
+                        help="print how long it took for every recorder to start, then stop")
+    args = parser.parse_args(argv)
+    args.methods = args.methods or [constants.RecordingMethod.SPEEDTEST_CLI]
+    for method in args.methods:
+        if method not in recorders.RECORDER_TYPES:
+            parser.error(f"argument --method: {method.value!r} can't be recorded with yet")
+    return args
+
+
+def make_recorders(methods: list[constants.RecordingMethod], browser: constants.Browser) -> list:
+    """ Creates a recorder for each method, importing each recorder's module as it is needed. Recorders are identified
+    by their method, numbered if a method is used more than once.
+        May raise ImportError if a recorder's dependencies aren't installed. """
+    created = []
+    counts = {}  # How many recorders have been created for each method so far
+    for method in methods:
+        counts[method] = counts.get(method, 0) + 1
+        identifier = method.value if methods.count(method) == 1 else f"{method.value} {counts[method]}"
+        created.append(recorders.get_recorder_type(method)(identifier,
+                                                           **recorders.get_recorder_kwargs(method, browser)))
+    return created
+
+
+def wait_for_startup(runner: engine.RecorderRunner, stop_event: Event) -> bool:
+    """ Waits until every recorder in the runner has started, returning False if one failed or stop_event was set
+    first. """
+    while not all(recorder.recorder_running for recorder in runner.recorders):
+        if runner.errors() or stop_event.wait(STARTUP_CHECK_INTERVAL):
+            return False
+    return True
+
+
+def main(argv: list[str] | None = None) -> int:
+    """ Runs the daemon with the command line arguments provided, returning the exit code. """
+    args = parse_args(argv)
+    classes.BaseRecorder.csv_path = args.recording
+
+    try:
+        recorders_used = make_recorders(args.methods, args.browser)
+    except ImportError as e:
+        classes.BaseRecorder.get_logger().error(f"Missing dependency: {e.name} isn't installed.")
+        return 1
+
+    # Stop when interrupted, putting the previous handlers back afterwards (in case main was called from other code)
+    stop_event = Event()
+    previous_handlers = {signum: signal.signal(signum, lambda *_: stop_event.set())
+                         for signum in (signal.SIGINT, signal.SIGTERM)}
+
+    runner = engine.RecorderRunner(recorders_used, bandwidth_lease=scheduler.BandwidthLease())
+    metrics_exporter = None
+    if args.exporter:
+        from broadbandbug.library import exporter  # Only imported if it is used, like the recorders
+        metrics_exporter = exporter.MetricsExporter(args.exporter_host, args.exporter_port,
+                                                    get_recorders=lambda: runner.recorders)
+        metrics_exporter.start()
+
+    runner.start()
+    try:
+        started = wait_for_startup(runner, stop_event)
+        if started:
+            classes.BaseRecorder.get_logger().info(f"Started in {perf_counter() - IMPORT_START:.2f}s.")
+        if args.check_startup:
+            if started:
+                print(f"Startup time: {perf_counter() - IMPORT_START:.3f}s")
+            stop_event.set()
+
+        # Wait until interrupted, or until every recorder has failed
+        while not stop_event.wait(STOP_CHECK_INTERVAL):
+            if len(runner.errors()) == len(runner.recorders):
+                break
+    finally:
+        runner.stop()
+        if metrics_exporter is not None:
+            metrics_exporter.stop()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    return 1 if runner.errors() else 0  # The runner logs why each recorder failed
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,125 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
+import numpy as np
 from PyQt6 import QtCore
 import pyqtgraph as pg
-from PyQt6.QtWidgets import QVBoxLayout, QWidget
+from PyQt6.QtWidgets import QHBoxLayout, QProgressBar, QPushButton, QVBoxLayout, QWidget
 
 from broadbandbug.library import constants
-from broadbandbug.library.classes import Reading
+from broadbandbug.library import files
+from broadbandbug.library.classes import Reading, ReadingBatch
 from broadbandbug.library.classes import BaseRecorder
 from broadbandbug.library.constants import RecordingMethod
+from broadbandbug.library.lod import LODPyramid
+
+
+def get_plot_data(readings: list[Reading] | ReadingBatch) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Returns arrays of the timestamps (in seconds since the epoch), download speeds and upload speeds of the readings
+    provided, which is the format needed for plotting. """
+    if isinstance(readings, ReadingBatch):
+        # Use the arrays directly, rather than going through a Reading for each reading
+        return readings.timestamps, readings.downloads, readings.uploads
+
+    return (np.fromiter((reading.timestamp.timestamp() for reading in readings), np.float64, len(readings)),
+            np.fromiter((reading.download for reading in readings), np.float64, len(readings)),
+            np.fromiter((reading.upload for reading in readings), np.float64, len(readings)))
+
+
+def split_latency_readings(readings: list[Reading] | ReadingBatch) -> tuple:
+    """ Splits readings into those from throughput methods and those from latency methods (constants.LATENCY_METHODS),
+    which are plotted against different axes. Both parts are the same type as the readings provided. """
+    if isinstance(readings, ReadingBatch):
+        codes = [constants.METHOD_CODES[method] for method in constants.LATENCY_METHODS]
+        is_latency = np.isin(readings.methods, codes)
+        return readings[~is_latency], readings[is_latency]
+
+    throughput, latency = [], []
+    for reading in readings:
+        (latency if reading.method in constants.LATENCY_METHODS else throughput).append(reading)
+    return throughput, latency
+
+
+class LODLine:
+    """ A line on a graph which is drawn at a level of detail suited to the visible range, so that lines with lots of
+    points can be panned and zoomed quickly (see the lod module). Symbols are only drawn at full detail.
+    The line's points are only stored in its pyramid, which grows in place as points are added. """
+    def __init__(self, graph: pg.PlotWidget, timestamps, values, view_box: pg.ViewBox | None = None, **plot_kwargs):
+        """ :param view_box: the view box to draw the line in, if not the graph's own (e.g. for a second y axis). """
+        self.symbol = plot_kwargs.get("symbol")
+        self.pyramid = LODPyramid(timestamps, values)
+        self.level = 0
+        if view_box is None:
+            self.item = graph.plot([], [], **plot_kwargs)
+        else:
+            self.item = pg.PlotDataItem([], [], **plot_kwargs)
+            view_box.addItem(self.item)
+            graph.getPlotItem().legend.addItem(self.item, plot_kwargs.get("name", ""))
+
+    def extend(self, timestamps, values):
+        """ Adds points to the line. It is not redrawn until refresh is called.
+        Points are added to the end of the pyramid in place, unless some are before the end of the line, in which case
+        the pyramid is rebuilt with every point in order, which is much slower. """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(timestamps) and len(self.pyramid) and timestamps.min() < self.pyramid.timestamps[-1]:
+            timestamps = np.concatenate([self.pyramid.timestamps, timestamps])
+            values = np.concatenate([self.pyramid.values, values])
+            order = np.argsort(timestamps, kind="stable")
+            self.pyramid.clear()
+            timestamps, values = timestamps[order], values[order]
+        self.pyramid.extend(timestamps, values)
+
+    def drop_before(self, timestamp: float):
+        """ Removes the points before the timestamp provided. It is not redrawn until refresh is called. """
+        self.pyramid.drop_before(timestamp)
+
+    def refresh(self, x_min: float, x_max: float, pixel_width: int):
+        """ Redraws the line for the visible range of x values provided. """
+        timestamps, values, level = self.pyramid.select(x_min, x_max, pixel_width)
+        if level != self.level:
+            self.item.setSymbol(self.symbol if level == 0 else None)
+            self.level = level
+        self.item.setData(timestamps, values)
 
 
 # TODO bug: plotting graphs does not consider the time the reading was taken; as such, solstice/equinox times may be an hour inaccurate
 class BaseGraphWindow(QWidget):
     REFRESH_INTERVAL_MS = 1000 * 10
-
-    def __init__(self, time_constraints: tuple[datetime] | None):
+    PROGRESS_STEPS = 1000  # The range of the loading progress bar
+    cancel_requested = QtCore.pyqtSignal()  # Emitted when the cancel button is pressed while readings are loading
+
+    def __init__(self, time_constraints: tuple[datetime] | None,
+                 max_retention: timedelta | None = constants.GRAPH_MAX_RETENTION):
+        """ :param time_constraints: only readings between these times are shown, or None to show every reading.
+        :param max_retention: readings older than this (relative to the latest reading) are removed from the graph as
+        new readings arrive, which stops memory use growing when the window is left open; None keeps every reading.
+        """
         super().__init__()
         layout = QVBoxLayout()
         self.graph = pg.PlotWidget()
         layout.addWidget(self.graph)
         self.setLayout(layout)
 
+        # Shown while readings are loaded in the background (see start_loading)
+        self.loading_bar = QWidget()
+        loading_layout = QHBoxLayout()
+        loading_layout.setContentsMargins(0, 0, 0, 0)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat("Loading readings... %p%")
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.on_cancel_pressed)
+        loading_layout.addWidget(self.progress_bar)
+        loading_layout.addWidget(self.cancel_button)
+        self.loading_bar.setLayout(loading_layout)
+        self.loading_bar.hide()
+        layout.addWidget(self.loading_bar)
+
         self.time_constraints = time_constraints
+        self.max_retention = max_retention
+        self.loading = False
+        # The latest timestamp of the readings loaded in the background, since new readings that were published while
+        # they loaded may also have been loaded
+        self.loaded_until: float | None = None
 
         self.graph.setBackground("#ffffff")
         styles = {"color": "red", "font-size": "18px"}
@@ -38,21 +136,140 @@ class BaseGraphWindow(QWidget):
         x_axis = self.graph.getAxis('bottom')
         x_axis.setPen(black_pen)
 
+        # Lines are redrawn at a suitable level of detail whenever the visible range or width of the graph changes
+        self.lod_lines: list[LODLine] = []
+        self.latency_view: pg.ViewBox | None = None  # Created by get_latency_view when needed
+        self.graph.getViewBox().sigXRangeChanged.connect(self.update_level_of_detail)
+        self.graph.getViewBox().sigResized.connect(self.update_level_of_detail)
+
         # Timer to update new readings
         self.timer = QtCore.QTimer()
         self.timer.setInterval(BaseGraphWindow.REFRESH_INTERVAL_MS)
         self.timer.timeout.connect(self.update_plot)
         self.timer.start()
 
-        # Initialise BaseRecorder queue
-        BaseRecorder.initialise_new_readings_queue()
+        # Subscribe to new readings from recorders
+        self.subscription = BaseRecorder.get_readings_bus().subscribe()
 
     def update_plot(self):
+        """ Adds the readings published since the last update. New readings wait until loading has finished, since
+        lines can only be added to in timestamp order. """
+        if self.loading:
+            return
+        new_readings = self.get_new_readings()
+        if new_readings:  # Only redraw lines if there is a new reading
+            self.add_readings(new_readings)
+
+    def add_readings(self, readings: list[Reading] | ReadingBatch):
+        """ Adds readings to the lines. This is much faster if they are in timestamp order, and after those already
+        shown (see LODLine.extend). """
         print("WARNING: Using abstract base class - use a subclass instead")
 
+    def start_loading(self):
+        """ Shows the progress bar and cancel button, while readings are loaded in the background and added with
+        add_loaded_readings. """
+        self.loading = True
+        self.progress_bar.setRange(0, 0)  # Busy, until the first progress is known
+        self.cancel_button.setEnabled(True)
+        self.loading_bar.show()
+
+    def add_loaded_readings(self, readings: ReadingBatch):
+        """ Adds a chunk of the readings loaded in the background (see files.iter_result_batches). """
+        if not self.loading:  # Cancelled, so chunks that were already on their way are ignored
+            return
+        if len(readings):
+            self.add_readings(readings)
+            # The last chunk may be readings that were stored late, so are earlier than those before them
+            self.loaded_until = max(float(readings.timestamps.max()), self.loaded_until or float("-inf"))
+
+    def set_load_progress(self, loaded: float):
+        """ Shows how much has been loaded, as a fraction from 0 to 1. """
+        self.progress_bar.setRange(0, BaseGraphWindow.PROGRESS_STEPS)
+        self.progress_bar.setValue(round(loaded * BaseGraphWindow.PROGRESS_STEPS))
+
+    def finish_loading(self, cancelled: bool = False):
+        """ Hides the progress bar, and starts adding new readings. """
+        if cancelled and not self.windowTitle().endswith(" (partly loaded)"):
+            self.setWindowTitle(self.windowTitle() + " (partly loaded)")
+        self.loading = False
+        self.loading_bar.hide()
+        self.update_plot()
+
+    def on_cancel_pressed(self):
+        self.cancel_button.setEnabled(False)
+        self.cancel_requested.emit()
+        self.finish_loading(cancelled=True)
+
+    def add_lod_line(self, timestamps: list[float], values: list[float], latency: bool = False,
+                     **plot_kwargs) -> LODLine:
+        """ Plots a line that is drawn at a level of detail suited to the visible range. See LODLine.
+        :param latency: set to True to plot the line against the latency axis (see get_latency_view).
+        """
+        view_box = self.get_latency_view() if latency else None
+        line = LODLine(self.graph, timestamps, values, view_box, **plot_kwargs)
+        self.lod_lines.append(line)
+        self.update_level_of_detail()
+        return line
+
+    def get_latency_view(self) -> pg.ViewBox:
+        """ Returns the view box that latency and jitter lines are drawn in, which has its own y axis (in milliseconds)
+        on the right, and shares the time axis with the speeds. It is created the first time it is needed, so graphs
+        with no latency readings don't show the axis. """
+        if self.latency_view is not None:
+            return self.latency_view
+
+        plot_item = self.graph.getPlotItem()
+        self.latency_view = pg.ViewBox()
+        plot_item.scene().addItem(self.latency_view)
+        plot_item.showAxis("right")
+        right_axis = plot_item.getAxis("right")
+        right_axis.linkToView(self.latency_view)
+        right_axis.setLabel("Milliseconds", color="red", **{"font-size": "18px"})
+        right_axis.setPen(pg.mkPen(color=(0, 0, 0), width=3))
+        self.latency_view.setXLink(plot_item)
+
+        # Keep the latency view over the main one as the graph is resized
+        def match_geometry():
+            self.latency_view.setGeometry(plot_item.vb.sceneBoundingRect())
+        plot_item.vb.sigResized.connect(match_geometry)
+        match_geometry()
+        return self.latency_view
+
+    def get_new_readings(self) -> list[Reading]:
+        """ Returns the readings published since the last call that are within the time constraints, and weren't
+        already loaded. """
+        # Skip readings out of time constraints
+        return [reading for reading in self.subscription.get_many() if self.is_reading_within_time_constraints(reading)
+                and (self.loaded_until is None or reading.timestamp.timestamp() > self.loaded_until)]
+
+    def apply_retention(self):
+        """ Removes points older than max_retention from every line, relative to the latest point on any line. """
+        if self.max_retention is None:
+            return
+        latest = max((line.pyramid.full_range()[1] for line in self.lod_lines if len(line.pyramid)), default=None)
+        if latest is None:
+            return
+        for line in self.lod_lines:
+            line.drop_before(latest - self.max_retention.total_seconds())
+
+    def update_level_of_detail(self):
+        """ Redraws each line at the level of detail suited to the visible range. """
+        view_box = self.graph.getViewBox()
+        pixel_width = int(view_box.width())
+        for line in self.lod_lines:
+            if view_box.autoRangeEnabled()[0]:
+                # If the range will be set to fit the lines, draw the whole line so the range fits all of it
+                x_min, x_max = line.pyramid.full_range()
+            else:
+                x_min, x_max = view_box.viewRange()[0]
+            line.refresh(x_min, x_max, pixel_width)
+
     def closeEvent(self, event):
+        if self.loading:
+            self.cancel_requested.emit()
+            self.loading = False
         self.timer.stop()
-        BaseRecorder.delete_new_readings_queue()
+        self.subscription.close()
 
     @classmethod
     def run(cls, app, *args):
@@ -68,122 +285,111 @@ class BaseGraphWindow(QWidget):
 
 
 class MergedGraphWindow(BaseGraphWindow):
-    def __init__(self, readings: list[Reading], time_constraints: tuple[datetime] | None):
-        super().__init__(time_constraints)
+    def __init__(self, readings: list[Reading] | ReadingBatch, time_constraints: tuple[datetime] | None,
+                 max_retention: timedelta | None = constants.GRAPH_MAX_RETENTION):
+        super().__init__(time_constraints, max_retention)
         self.setWindowTitle("Merged Graph")
 
-        # Initialise lists to store all the data
-        self.timestamps = []
-        self.download_speeds = []
-        self.upload_speeds = []
-
-        # Go through each method's results and add the needed data to lists
-        for reading in readings:
-            # Get data needed for each graph
-            self.timestamps.append(reading.timestamp.timestamp())
-            self.download_speeds.append(reading.download)
-            self.upload_speeds.append(reading.upload)
-
-        # Get a line reference
-        self.download_line = self.graph.plot(
-            self.timestamps,
-            self.download_speeds,
+        # Latency readings aren't speeds, so they are merged into lines of their own
+        self.latency_line = self.jitter_line = None  # Created once there are latency readings
+
+        # Get a line reference. The readings are only stored in the lines, once they are added.
+        self.download_line = self.add_lod_line(
+            [],
+            [],
             name="Download",
             pen=pg.mkPen(color=(0, 0, 0), width=3),
             symbol="x",
             symbolSize=15,
             symbolBrush="black",
         )
-        self.upload_line = self.graph.plot(
-            self.timestamps,
-            self.upload_speeds,
+        self.upload_line = self.add_lod_line(
+            [],
+            [],
             name="Upload",
             pen=pg.mkPen(color=(255, 0, 0), width=2),
             symbol="+",
             symbolSize=15,
             symbolBrush="red",
         )
-
-    def update_plot(self):
-        updated = False  # Determines if it is necessary to redraw lines (which happens if there is a new reading)
-        new_readings_queue = BaseRecorder.get_new_readings_queue()
-        while not new_readings_queue.empty():
-            reading = new_readings_queue.get()
-            if not self.is_reading_within_time_constraints(reading):  # Skip if reading out of time constraints
-                continue
-            self.download_speeds.append(reading.download)
-            self.upload_speeds.append(reading.upload)
-            self.timestamps.append(reading.timestamp.timestamp())
-            updated = True
-
-        if updated:
-            self.download_line.setData(self.timestamps, self.download_speeds)
-            self.upload_line.setData(self.timestamps, self.upload_speeds)
+        self.add_readings(readings)
+
+    def initialise_latency_lines(self, timestamps, latencies, jitters):
+        color_scheme = constants.LINE_COLORS[RecordingMethod.LATENCY]
+        self.latency_line = self.add_lod_line(timestamps, latencies, latency=True, name="Latency",
+                                              pen=pg.mkPen(color=color_scheme[0], width=2))
+        self.jitter_line = self.add_lod_line(timestamps, jitters, latency=True, name="Jitter",
+                                             pen=pg.mkPen(color=color_scheme[1], width=1))
+
+    def add_readings(self, readings: list[Reading] | ReadingBatch):
+        new_readings, new_latency_readings = split_latency_readings(readings)
+        if len(new_readings):
+            timestamps, download_speeds, upload_speeds = get_plot_data(new_readings)
+            self.download_line.extend(timestamps, download_speeds)
+            self.upload_line.extend(timestamps, upload_speeds)
+        if len(new_latency_readings):
+            timestamps, latencies, jitters = get_plot_data(new_latency_readings)
+            if self.latency_line is None:
+                self.initialise_latency_lines(timestamps, latencies, jitters)
+            else:
+                self.latency_line.extend(timestamps, latencies)
+                self.jitter_line.extend(timestamps, jitters)
+        self.apply_retention()
+        self.update_level_of_detail()
 
 
 class UnmergedGraphWindow(BaseGraphWindow):
-    def __init__(self, readings: dict, time_constraints: tuple[datetime] | None):
-        super().__init__(time_constraints)
+    def __init__(self, readings: dict, time_constraints: tuple[datetime] | None,
+                 max_retention: timedelta | None = constants.GRAPH_MAX_RETENTION):
+        super().__init__(time_constraints, max_retention)
         self.setWindowTitle("Unmerged Graph")
 
-        # This structure stores
-        self.lines = {method: {"down_data": [], "up_data": [], "timestamps": [], "down_line": None, "up_line": None}
-                      for method in constants.RecordingMethod}
-
-        for recording_method in readings.keys():
-            # Get data needed for each recording method
-            timestamps = [reading.timestamp.timestamp() for reading in readings[recording_method]]
-            download_speeds = [reading.download for reading in readings[recording_method]]
-            upload_speeds = [reading.upload for reading in readings[recording_method]]
+        # This structure stores the download and upload lines of each recording method, which are None until the
+        # method has readings
+        self.lines = {method: {"down_line": None, "up_line": None} for method in constants.RecordingMethod}
 
-            recording_method_data = self.lines[recording_method]
-            recording_method_data["down_data"] = download_speeds
-            recording_method_data["up_data"] = upload_speeds
-            recording_method_data["timestamps"] = timestamps
+        self.add_readings(readings)
 
-            self.initialise_graphs(recording_method)
-
-    def initialise_graphs(self, recording_method: RecordingMethod):
+    def initialise_graphs(self, recording_method: RecordingMethod, timestamps, download_speeds, upload_speeds):
         recording_method_data = self.lines[recording_method]
         color_scheme = constants.LINE_COLORS[recording_method]
+        # Latency methods store the latency and jitter in place of the download and upload speeds
+        latency = recording_method in constants.LATENCY_METHODS
+        down_name, up_name = ("latency", "jitter") if latency else ("download", "upload")
 
         # Download line
-        recording_method_data["down_line"] = self.graph.plot(
-            recording_method_data["timestamps"],
-            recording_method_data["down_data"],
-            name=f"{recording_method.value} download",
+        recording_method_data["down_line"] = self.add_lod_line(
+            timestamps,
+            download_speeds,
+            latency=latency,
+            name=f"{recording_method.value} {down_name}",
             pen=pg.mkPen(color=color_scheme[0], width=3),
             symbol="x",
             symbolSize=15,
             symbolBrush=color_scheme[0],
         )
-        recording_method_data["up_line"] = self.graph.plot(
-            recording_method_data["timestamps"],
-            recording_method_data["up_data"],
-            name=f"{recording_method.value} upload",
+        recording_method_data["up_line"] = self.add_lod_line(
+            timestamps,
+            upload_speeds,
+            latency=latency,
+            name=f"{recording_method.value} {up_name}",
             pen=pg.mkPen(color=color_scheme[1], width=2),
             symbol="+",
             symbolSize=15,
             symbolBrush=color_scheme[1],
         )
 
-    def update_plot(self):
-        methods_with_new_readings = []
-        new_readings_queue = BaseRecorder.get_new_readings_queue()
-        while not new_readings_queue.empty():
-            reading = new_readings_queue.get()
-            if not self.is_reading_within_time_constraints(reading):  # Skip if reading out of time constraints
-                continue
-            line = self.lines[reading.method]
-            line["down_data"].append(reading.download)
-            line["up_data"].append(reading.upload)
-            line["timestamps"].append(reading.timestamp.timestamp())
-            methods_with_new_readings.append(reading.method)
-
-        for method in methods_with_new_readings:
+    def add_readings(self, readings: dict | list[Reading] | ReadingBatch):
+        """ Adds readings, which may be grouped by method already (as returned by files.read_results). """
+        readings_by_method = readings if isinstance(readings, dict) else files.group_readings_by_method(readings)
+        for method, readings in readings_by_method.items():
             line = self.lines[method]
+            timestamps, download_speeds, upload_speeds = get_plot_data(readings)
             if line["down_line"] is None:
-                self.initialise_graphs(method)
+                self.initialise_graphs(method, timestamps, download_speeds, upload_speeds)
             else:
-                line["down_line"].setData(line["timestamps"], line["down_data"])
-                line["up_line"].setData(line["timestamps"], line["up_data"])
+                line["down_line"].extend(timestamps, download_speeds)
+                line["up_line"].extend(timestamps, upload_speeds)
+
+        self.apply_retention()
+        self.update_level_of_detail()
@@ -1,3 +1,5 @@
+import threading
+
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QTabWidget, QWidget,
                              QVBoxLayout, QPushButton, QDateTimeEdit, QCheckBox,
                              QLabel, QFormLayout, QDialog, QMessageBox)
@@ -7,10 +9,12 @@ from PyQt6.QtGui import QFont
 import broadbandbug.library.classes as classes
 import broadbandbug.library.files as files
 import broadbandbug.library.constants as constants
+import broadbandbug.library.exporter as exporter
 from broadbandbug.gui.closing_window import ClosingDialog
-from broadbandbug.gui.graph_windows import MergedGraphWindow, UnmergedGraphWindow
 from broadbandbug.gui.recorder_selection import RecorderDialog
-from broadbandbug.recorders import speedtestcli, which_website
+# Recorders and graph windows are imported when they are used, since their dependencies (speedtest, selenium, pyqtgraph)
+# take a while to import
+from broadbandbug import recorders
 
 
 class RecorderWorker(QObject):
@@ -46,11 +50,54 @@ class RecorderWorker(QObject):
         # It is possible for recorder to be None if the user closes the window immediately after starting a recorder
 
 
+class GraphLoader(QObject):
+    """ Reads the readings for a graph window in chunks (see files.iter_result_batches), sending each to the window as
+    it is read, so large recordings don't freeze the application while they load. """
+    chunk_loaded = pyqtSignal(object)  # A ReadingBatch
+    progress = pyqtSignal(float)  # The fraction of the readings loaded so far
+    finished = pyqtSignal(bool)  # Whether loading was cancelled (or failed) before every reading was loaded
+    error = pyqtSignal(str)
+
+    def __init__(self, time_constraints: tuple | None):
+        super().__init__()
+        self.time_constraints = time_constraints
+        self.cancelled = threading.Event()  # Set from the GUI thread, so isn't waiting in this object's thread's queue
+
+    def run(self):
+        try:
+            # Long time ranges are summarised by hour or by day, if the recording file has rollups
+            for chunk, loaded in files.iter_result_batches(constants.RECORDING_DEFAULT_PATH, self.time_constraints,
+                                                           use_rollups=True):
+                if self.cancelled.is_set():
+                    break
+                self.chunk_loaded.emit(chunk)
+                self.progress.emit(loaded)
+        except Exception as e:
+            self.error.emit(f"Unable to load readings: "
+                            f"The readings couldn't be loaded from the recording file.\n\nDetails:\n{e}")
+            self.cancelled.set()
+        self.finished.emit(self.cancelled.is_set())
+
+    def cancel(self):
+        self.cancelled.set()
+
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Recording and Graphing Application")
         self.graph_dlg = self.recorder_dlg = self.recorder_worker = self.thread = None
+        self.graph_loads = []  # The loader and thread of each graph window whose readings are still loading
+
+        # Serve the latest readings for monitoring tools, if enabled
+        self.exporter = None
+        if constants.EXPORTER_ENABLED:
+            self.exporter = exporter.MetricsExporter(get_recorders=self.get_recorders)
+            try:
+                self.exporter.start()
+            except OSError as e:
+                classes.BaseRecorder.get_logger().warning(f"Couldn't start the metrics exporter: {e!r}")
+                self.exporter = None
 
         # Create a much larger font
         app_font = QFont()
@@ -165,16 +212,19 @@ class MainWindow(QMainWindow):
         method = constants.RecordingMethod(self.recorder_dlg.recording_combo.currentText())
         browser = constants.Browser(self.recorder_dlg.browser_combo.currentText())
 
-        # Get required recorder with match case
-        match method:
-            case constants.RecordingMethod.SPEEDTEST_CLI:
-                recorder = speedtestcli.SpeedtestCLIRecorder
-            case _:
-                recorder = None
+        # Get required recorder, importing it now it is needed
+        try:
+            recorder = recorders.get_recorder_type(method)
+        except ImportError as e:
+            self.on_error_received(f"Missing dependency: {method.value} can't be used, since {e.name} isn't "
+                                   f"installed.")
+            self.on_recorder_stopped()
+            return
+        kwargs = recorders.get_recorder_kwargs(method, browser)
 
         # Make the wrapper and pass it to a new thread
         self.thread = QThread()
-        self.recorder_worker = RecorderWorker(recorder)
+        self.recorder_worker = RecorderWorker(recorder, **kwargs)
         self.recorder_worker.moveToThread(self.thread)
 
         self.thread.started.connect(self.recorder_worker.run)
@@ -203,27 +253,53 @@ class MainWindow(QMainWindow):
         self.start_button.setText(self.start_button_default_text)
         self.stop_button.setText(self.stop_button_default_text)
 
+    def get_recorders(self) -> list[classes.BaseRecorder]:
+        """ Returns the recorder that has been started, if there is one. """
+        if self.recorder_worker is None or self.recorder_worker.recorder is None:
+            return []
+        return [self.recorder_worker.recorder]
+
     def update_times(self):
         checked = self.limit_by_time_checkbox.isChecked()
         self.start_datetime.setEnabled(checked)
         self.end_datetime.setEnabled(checked)
 
     def show_graph(self):
-        # TODO error handling
         merge_methods = self.merge_method_checkbox.isChecked()
         if self.limit_by_time_checkbox.isChecked():
             time_constraints = (self.start_datetime.dateTime().toPyDateTime(), self.end_datetime.dateTime().toPyDateTime())
         else:
             time_constraints = None
 
-        readings = files.read_results(constants.RECORDING_DEFAULT_PATH, time_constraints, merge_methods)
-
+        # The window is shown straight away, and filled in as the readings are loaded in the background
+        from broadbandbug.gui.graph_windows import MergedGraphWindow, UnmergedGraphWindow
         if merge_methods:
-            self.graph_dlg = MergedGraphWindow(readings, time_constraints)
+            self.graph_dlg = MergedGraphWindow(classes.ReadingBatch.empty(), time_constraints)
         else:
-            self.graph_dlg = UnmergedGraphWindow(readings, time_constraints)
-
+            self.graph_dlg = UnmergedGraphWindow({}, time_constraints)
         self.graph_dlg.show()
+        self.graph_dlg.start_loading()
+
+        thread = QThread()
+        loader = GraphLoader(time_constraints)
+        loader.moveToThread(thread)
+        load = (loader, thread)
+        self.graph_loads.append(load)
+
+        thread.started.connect(loader.run)
+        thread.finished.connect(thread.deleteLater)
+        # Connected directly, since the loader's thread is busy loading so wouldn't get to a queued call until it ends
+        self.graph_dlg.cancel_requested.connect(loader.cancel, Qt.ConnectionType.DirectConnection)
+        self.graph_dlg.destroyed.connect(loader.cancel, Qt.ConnectionType.DirectConnection)
+        loader.chunk_loaded.connect(self.graph_dlg.add_loaded_readings)
+        loader.progress.connect(self.graph_dlg.set_load_progress)
+        loader.finished.connect(self.graph_dlg.finish_loading)
+        loader.finished.connect(lambda: self.graph_loads.remove(load))
+        loader.finished.connect(thread.quit)
+        loader.finished.connect(loader.deleteLater)
+        loader.error.connect(self.on_error_received)
+
+        thread.start()
 
     def closeEvent(self, event):
         """ Ensures everything is closed as intended, particularly the recorder and its thread. """
@@ -239,10 +315,21 @@ class MainWindow(QMainWindow):
                 pass
             self.thread.wait()
 
+        # Stop loading readings for graph windows, which may not have been closed
+        for loader, thread in self.graph_loads:
+            loader.cancel()
+            try:
+                thread.quit()
+                thread.wait()
+            except RuntimeError:
+                pass
+
+        if self.exporter is not None:
+            self.exporter.stop()
         event.accept()
 
     def on_error_received(self, msg: str):
-        QMessageBox.critical(self, *msg.split(": "))
+        QMessageBox.critical(self, *msg.split(": ", 1))
 
 
 def main():
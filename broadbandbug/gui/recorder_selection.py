@@ -2,6 +2,7 @@ from PyQt6.QtWidgets import (
     QApplication, QHBoxLayout, QVBoxLayout, QComboBox, QLabel, QDialogButtonBox, QDialog
 )
 
+from broadbandbug import recorders
 from broadbandbug.library import constants
 
 
@@ -20,7 +21,8 @@ class RecorderDialog(QDialog):
         # Recording Method Combo Box
         self.recording_label = QLabel("Recording method:")
         self.recording_combo = QComboBox()
-        self.recording_combo.addItems([method.value for method in constants.RecordingMethod])
+        # Only methods with a recorder can be selected
+        self.recording_combo.addItems([method.value for method in recorders.RECORDER_TYPES])
         self.recording_combo.currentIndexChanged.connect(self.toggle_browser_combobox)
 
         # Add widgets to inline layout
@@ -52,7 +54,7 @@ class RecorderDialog(QDialog):
 
     def toggle_browser_combobox(self):
         """Show or hide the Browser combo box based on the selected recording method."""
-        is_visible = self.recording_combo.currentText() != constants.RecordingMethod.SPEEDTEST_CLI.value
+        is_visible = constants.RecordingMethod(self.recording_combo.currentText()) in constants.METHODS_USING_BROWSER
         self.browser_label.setVisible(is_visible)
         self.browser_combo.setVisible(is_visible)
         self.adjustSize()
@@ -0,0 +1,72 @@
+""" Contains buffers for data that is added to over time, like readings plotted on a live graph. """
+import numpy as np
+
+from . import constants
+
+
+class GrowableArray:
+    """ A 1D NumPy array that can be appended to, and removed from at the front, in place.
+    Space is allocated in advance and doubled when it runs out, so appending takes constant time on average rather than
+    copying everything each time. Space freed at the front is reused before growing, so a buffer used as a sliding
+    window (appending at the back and dropping from the front) stops growing once it is about twice the window size.
+    The items are always kept next to each other, so view gives them as a normal array without copying.
+    """
+    __slots__ = ("_data", "_start", "_end")
+
+    def __init__(self, dtype=np.float64, capacity: int = constants.BUFFER_INITIAL_CAPACITY):
+        self._data = np.empty(max(capacity, 1), dtype=dtype)
+        self._start = 0  # Index in _data of the first item
+        self._end = 0  # Index in _data after the last item
+
+    @property
+    def view(self) -> np.ndarray:
+        """ The items in the buffer, as an array that shares memory with the buffer. It should not be kept after the
+        buffer is changed, since its memory may be reused. """
+        return self._data[self._start:self._end]
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __getitem__(self, key):
+        return self.view[key]
+
+    def __setitem__(self, key, value):
+        self.view[key] = value
+
+    def extend(self, values):
+        """ Adds the values provided to the end of the buffer. """
+        values = np.asarray(values, dtype=self._data.dtype)
+        if self._end + len(values) > len(self._data):
+            self._make_room(len(values))
+        self._data[self._end:self._end + len(values)] = values
+        self._end += len(values)
+
+    def append(self, value):
+        self.extend((value,))
+
+    def truncate(self, length: int):
+        """ Removes items from the end of the buffer, so that it has the length provided. """
+        self._end = self._start + min(max(length, 0), len(self))
+
+    def drop_front(self, count: int):
+        """ Removes count items from the start of the buffer. """
+        self._start += min(max(count, 0), len(self))
+
+    def _make_room(self, extra: int):
+        """ Makes sure there is room for extra items at the end, moving the items to the start of the allocated space if
+        that leaves at least half of it free, otherwise allocating twice as much space. """
+        length = len(self)
+        if length + extra <= len(self._data) // 2:
+            self._data[:length] = self.view  # NumPy handles the overlap
+        else:
+            data = np.empty(max(len(self._data) * 2, length + extra), dtype=self._data.dtype)
+            data[:length] = self.view
+            self._data = data
+        self._start, self._end = 0, length
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.view!r})"
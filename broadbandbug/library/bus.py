@@ -0,0 +1,109 @@
+""" Contains the readings bus, which passes new readings from recorders to everything that shows or exports them live
+(graph windows, exporters, alerts, and so on).
+
+Each consumer subscribes to the bus, getting its own bounded queue, so any number of consumers can receive every
+reading without affecting each other. If a consumer falls behind and its queue fills up, its overflow policy (see
+constants.OverflowPolicy) decides which readings it loses, so a stalled consumer can't use more and more memory.
+"""
+from collections import deque
+from threading import Condition, Lock
+
+from . import constants
+
+
+class Subscription:
+    """ A consumer's queue of readings from a ReadingsBus. Use ReadingsBus.subscribe to create one.
+    Can be used as a context manager, which closes the subscription on exit. """
+    def __init__(self, bus: "ReadingsBus", maxsize: int, overflow: constants.OverflowPolicy):
+        if maxsize < 1:
+            raise ValueError("subscription maxsize must be at least 1")
+        self.bus = bus
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0  # How many readings have been dropped or coalesced because the queue was full
+
+        self._readings = deque()
+        self._condition = Condition()
+
+    def put(self, reading):
+        """ Adds a reading to the queue, applying the overflow policy if it is full. Used by ReadingsBus.publish. """
+        with self._condition:
+            if len(self._readings) >= self.maxsize:
+                self.dropped += 1
+                if self.overflow is constants.OverflowPolicy.COALESCE and self._coalesce(reading):
+                    return
+                self._readings.popleft()
+            self._readings.append(reading)
+            self._condition.notify()
+
+    def _coalesce(self, reading) -> bool:
+        """ Replaces the most recent queued reading from the same recording method as the reading provided with it.
+        Returns False if there isn't one. """
+        for i in range(len(self._readings) - 1, -1, -1):
+            if self._readings[i].method == reading.method:
+                self._readings[i] = reading
+                return True
+        return False
+
+    def get_many(self, max_count: int | None = None, timeout: float | None = 0) -> list:
+        """ Removes and returns up to max_count readings from the queue (or every reading, if max_count is None), oldest
+        first. If the queue is empty, waits up to timeout seconds for a reading to arrive (or forever, if timeout is
+        None), returning an empty list if none does. """
+        with self._condition:
+            if timeout is None:
+                self._condition.wait_for(lambda: self._readings)
+            elif timeout > 0:
+                self._condition.wait_for(lambda: self._readings, timeout)
+
+            count = len(self._readings) if max_count is None else min(max_count, len(self._readings))
+            return [self._readings.popleft() for _ in range(count)]
+
+    def empty(self) -> bool:
+        return not self._readings
+
+    def __len__(self) -> int:
+        return len(self._readings)
+
+    def close(self):
+        """ Stops receiving readings. """
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ReadingsBus:
+    """ Passes each published reading to every subscription. Thread-safe. """
+    def __init__(self):
+        self._subscriptions: list[Subscription] = []
+        self._lock = Lock()
+
+    def subscribe(self, maxsize: int = constants.READINGS_QUEUE_SIZE,
+                  overflow: constants.OverflowPolicy = constants.OverflowPolicy.DROP_OLDEST) -> Subscription:
+        """ Creates a subscription, which receives every reading published from now until it is closed.
+        :param maxsize: the most readings that are kept waiting in the subscription's queue.
+        :param overflow: what happens when a reading is published while the queue is full.
+        """
+        subscription = Subscription(self, maxsize, overflow)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, reading):
+        """ Adds a reading to the queue of every subscription. Never blocks on a slow subscriber. """
+        with self._lock:
+            subscriptions = tuple(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.put(reading)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
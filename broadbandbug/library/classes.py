@@ -1,43 +1,180 @@
-""" Defines most of the classes used throughout BroadbandBug: Reading, BaseRecorder. See individual documentation. """
+""" Defines most of the classes used throughout BroadbandBug: Reading, ReadingBatch, BaseRecorder.
+See individual documentation. """
 from dataclasses import dataclass
-from threading import Event
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
 from queue import Queue
 from datetime import datetime
+from time import perf_counter
 import logging
-from typing import ClassVar
-import csv
+from typing import ClassVar, Iterable, Iterator
 
+import numpy as np
+
+from . import bus
 from . import constants
+from . import outages
+from . import timeparse
+from . import timings
 
 
-@dataclass
+@dataclass(slots=True)  # Slots make each instance smaller, which matters when there are lots of them
 class Reading:
     """ Represents a single reading of the broadband speed at some point in time.
     :var download: float, the download speed (no specific unit)
     :var upload: float, the upload speed (no specific unit)
     :var timestamp: datetime, when the reading was obtained.
     :var method: RecordingMethod, the method by which this reading was obtained.
+    :var streams: int | None, how many parallel streams were used to measure the speeds, or None if unknown (readings
+    are only comparable if they used the same number of streams).
+    :var loss: float | None, the fraction of packets lost, for methods that measure it (see
+    constants.LATENCY_METHODS), otherwise None.
+    Readings from latency methods store the latency in download and the jitter in upload, both in milliseconds.
     """
     download: float
     upload: float
     timestamp: datetime
     method: constants.RecordingMethod
+    streams: int | None = None
+    loss: float | None = None
 
     # Used for making header in csv file
-    attributes: ClassVar[list[str]] = ["download", "upload", "timestamp", "method"]
+    attributes: ClassVar[list[str]] = ["download", "upload", "timestamp", "method", "streams", "loss"]
 
     def get_timestamp_as_str(self):
-        return self.timestamp.strftime(constants.TIME_FORMAT)
+        # Only latency readings are written with milliseconds, so other readings are written as they always have been
+        return timeparse.format_timestamp(self.timestamp, milliseconds=self.method in constants.LATENCY_METHODS)
 
     @staticmethod
-    # Converts date strings to a datetime
+    # Converts date strings to a datetime (using a parser specialised for TIME_FORMAT, as strptime is slow)
     def convert_string_to_datetime(string: str):
-        return datetime.strptime(string, constants.TIME_FORMAT)
+        return timeparse.parse_timestamp(string)
 
     def format_for_csv(self):
         """ Produces a dict in the format needed to save it to a csv file. """
         return {"download": self.download, "upload": self.upload,
-                "timestamp": self.get_timestamp_as_str(), "method": self.method.value}
+                "timestamp": self.get_timestamp_as_str(), "method": self.method.value,
+                "streams": "" if self.streams is None else self.streams,
+                "loss": "" if self.loss is None else self.loss}
+
+    @staticmethod
+    def from_csv_row(row: dict) -> "Reading":
+        """ Creates a Reading from a dict in the format produced by format_for_csv (all values may be strings).
+        Files recorded before streams and loss were recorded don't have them, so they may be missing. """
+        streams, loss = row.get("streams"), row.get("loss")
+        return Reading(float(row["download"]),
+                       float(row["upload"]),
+                       Reading.convert_string_to_datetime(row["timestamp"]),
+                       constants.RecordingMethod(row["method"]),
+                       int(streams) if streams else None,
+                       float(loss) if loss else None)
+
+
+class ReadingBatch:
+    """ Stores many readings as parallel NumPy arrays, which uses far less memory than a list of Reading objects, and
+    allows them to be sorted, filtered and plotted without going through Python objects.
+    Indexing with an integer gives a Reading; indexing with a slice, an index array or a boolean mask gives a new
+    ReadingBatch. Iterating gives a Reading for each reading, so a batch can be used in place of a list of Readings.
+    :var timestamps: float64 array of when each reading was obtained, in seconds since the epoch.
+    :var downloads: float64 array of the download speeds.
+    :var uploads: float64 array of the upload speeds.
+    :var methods: uint8 array of the recording methods, as codes from constants.METHOD_CODES.
+    :var streams: uint8 array of the number of streams used by each reading, where 0 means unknown (None).
+    :var losses: float64 array of the fraction of packets lost, where NaN means not measured (None).
+    """
+    __slots__ = ("timestamps", "downloads", "uploads", "methods", "streams", "losses")
+
+    def __init__(self, timestamps: np.ndarray, downloads: np.ndarray, uploads: np.ndarray, methods: np.ndarray,
+                 streams: np.ndarray | None = None, losses: np.ndarray | None = None):
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        self.downloads = np.asarray(downloads, dtype=np.float64)
+        self.uploads = np.asarray(uploads, dtype=np.float64)
+        self.methods = np.asarray(methods, dtype=np.uint8)
+        self.streams = np.zeros(len(self.timestamps), np.uint8) if streams is None else np.asarray(streams, np.uint8)
+        self.losses = (np.full(len(self.timestamps), np.nan) if losses is None
+                       else np.asarray(losses, dtype=np.float64))
+
+    @staticmethod
+    def empty() -> "ReadingBatch":
+        return ReadingBatch(np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0))
+
+    @staticmethod
+    def from_readings(readings: Iterable[Reading]) -> "ReadingBatch":
+        """ Creates a batch from Reading objects. """
+        readings = list(readings)
+        return ReadingBatch(np.fromiter((reading.timestamp.timestamp() for reading in readings), np.float64,
+                                        len(readings)),
+                            np.fromiter((reading.download for reading in readings), np.float64, len(readings)),
+                            np.fromiter((reading.upload for reading in readings), np.float64, len(readings)),
+                            np.fromiter((constants.METHOD_CODES[reading.method] for reading in readings), np.uint8,
+                                        len(readings)),
+                            np.fromiter((reading.streams or 0 for reading in readings), np.uint8, len(readings)),
+                            np.fromiter((np.nan if reading.loss is None else reading.loss for reading in readings),
+                                        np.float64, len(readings)))
+
+    @staticmethod
+    def from_records(records: np.ndarray) -> "ReadingBatch":
+        """ Creates a batch from a structured array, as returned by the read_arrays method of storage backends. """
+        return ReadingBatch(records["timestamp"], records["download"], records["upload"], records["method"],
+                            records["streams"], records["loss"])
+
+    @staticmethod
+    def concatenate(batches: Iterable["ReadingBatch"]) -> "ReadingBatch":
+        batches = list(batches)
+        if not batches:
+            return ReadingBatch.empty()
+        return ReadingBatch(np.concatenate([batch.timestamps for batch in batches]),
+                            np.concatenate([batch.downloads for batch in batches]),
+                            np.concatenate([batch.uploads for batch in batches]),
+                            np.concatenate([batch.methods for batch in batches]),
+                            np.concatenate([batch.streams for batch in batches]),
+                            np.concatenate([batch.losses for batch in batches]))
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            loss = float(self.losses[key])
+            return Reading(float(self.downloads[key]), float(self.uploads[key]),
+                           datetime.fromtimestamp(self.timestamps[key]),
+                           constants.METHODS_BY_CODE[int(self.methods[key])], int(self.streams[key]) or None,
+                           None if np.isnan(loss) else loss)
+        return ReadingBatch(self.timestamps[key], self.downloads[key], self.uploads[key], self.methods[key],
+                            self.streams[key], self.losses[key])
+
+    def __iter__(self) -> Iterator[Reading]:
+        for timestamp, download, upload, method, streams, loss in zip(
+                self.timestamps.tolist(), self.downloads.tolist(), self.uploads.tolist(), self.methods.tolist(),
+                self.streams.tolist(), self.losses.tolist()):
+            yield Reading(download, upload, datetime.fromtimestamp(timestamp), constants.METHODS_BY_CODE[method],
+                          streams or None, None if loss != loss else loss)  # NaN is the only value not equal to itself
+
+    def sort_by_timestamp(self):
+        """ Sorts the readings by timestamp, in place. Readings with the same timestamp keep their order. """
+        order = np.argsort(self.timestamps, kind="stable")
+        self.timestamps, self.downloads = self.timestamps[order], self.downloads[order]
+        self.uploads, self.methods, self.streams = self.uploads[order], self.methods[order], self.streams[order]
+        self.losses = self.losses[order]
+
+    def filter_by_time(self, time_constraints: tuple[datetime, datetime] | None) -> "ReadingBatch":
+        """ Returns a batch with only the readings within the time constraints (see files.read_results). """
+        if time_constraints is None:
+            return self
+        earliest, latest = time_constraints[0].timestamp(), time_constraints[1].timestamp()
+        return self[(self.timestamps >= earliest) & (self.timestamps <= latest)]
+
+    def group_by_method(self) -> dict[constants.RecordingMethod, "ReadingBatch"]:
+        """ Splits the batch into a batch for each recording method. Methods with no readings are not included. """
+        groups = {}
+        for method in constants.RecordingMethod:
+            mask = self.methods == constants.METHOD_CODES[method]
+            if mask.any():
+                groups[method] = self[mask]
+        return groups
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} readings)"
 
 
 def create_logger() -> logging.Logger:
@@ -57,11 +194,19 @@ class BaseRecorder:
     The methods 'prepare', 'process', and 'cleanup' are meant to be overridden.
     The recording_loop is meant to be passed to a thread
     """
-    _new_readings_queue: Queue | None = None  # Used to store new readings, which can be used to update graphs. Use
-    # thread-safe structure like queue, for interacting with other threads (like a GUI).
+    _readings_bus = bus.ReadingsBus()  # New readings are published to this, which can be used to update graphs. It is
+    # thread-safe, for interacting with other threads (like a GUI).
     _logger = create_logger()
+    _timings = timings.TimingRegistry()  # How long each phase of each recorder's readings took (see the timings module)
     csv_path = constants.RECORDING_DEFAULT_PATH
 
+    # The results writer shared by every running recorder (see acquire_results_writer)
+    _writer_lock = Lock()
+    _writer_users = 0  # How many recorders are using the results writer
+    _results_queue: Queue | None = None
+    _writer_close_event: Event | None = None
+    _writer_thread: Thread | None = None
+
     def __init__(self, identifier: str = "recorder"):
         """ A base class defining how recorders will run, that is meant to be extended.
         :param identifier: a string identifying the recorder.
@@ -70,30 +215,24 @@ class BaseRecorder:
         self._recorder_running = False
 
         self.stop_event = Event()  # This can be set to indicate when the recorder should be stopped.
+        # A scheduler.BandwidthLease shared with other recorders running at the same time, so their speed tests don't
+        # overlap. Set by the scheduler; None if the recorder is run on its own.
+        self.bandwidth_lease = None
+        self._reading_phases = {}  # How long each phase of the current reading has taken so far, in seconds
         BaseRecorder.get_logger().info(f"Created {identifier}")
 
-    # New readings queue related functions
+    # New readings bus related functions
     @staticmethod
-    def get_new_readings_queue() -> Queue:
-        """ Gets the readings queue. """
-        return BaseRecorder._new_readings_queue
+    def get_readings_bus() -> bus.ReadingsBus:
+        """ Gets the bus that new readings are published to; subscribe to it to receive them (e.g. to update
+        graphs). """
+        return BaseRecorder._readings_bus
 
     @staticmethod  # Static method because regardless of which class it is from, it should only affect BaseRecorder.
-    def add_reading_to_queue(reading: Reading):
-        """ Adds a reading to the queue. """
-        BaseRecorder._new_readings_queue.put(reading)
-
-    @staticmethod
-    def initialise_new_readings_queue():
-        """ Initialises the queue for storing new readings; this is likely to be called before a graph is opened. """
-        BaseRecorder._new_readings_queue = Queue()
-
-    @staticmethod
-    def delete_new_readings_queue():
-        """ Indicates that the queue is not needed; likely to be called once a graph is closed. """
-        # This implicitly deletes the queue, saving memory
-        BaseRecorder._new_readings_queue = None
-    # End of new readings queue related functions
+    def publish_reading(reading: Reading):
+        """ Publishes a reading to every subscriber of the readings bus. """
+        BaseRecorder._readings_bus.publish(reading)
+    # End of new readings bus related functions
 
     # Get logger
     @staticmethod  # Use this to get the logger, so that only one is used throughout child classes.
@@ -101,44 +240,167 @@ class BaseRecorder:
         """ Returns the BaseRecorder logger. """
         return BaseRecorder._logger
 
-    def recording_loop(self):
-        """ Opens the CSV file, repeatedly takes a reading, adds it to the new readings queue and CSV file.
-        May raise any errors from open() statement. """
-        # Open CSV file and initialise writer
-        with open(BaseRecorder.csv_path, "a+") as csv_file:
-            writer = csv.DictWriter(csv_file, Reading.attributes)
+    # Timing related functions
+    @staticmethod
+    def get_timings() -> timings.TimingRegistry:
+        """ Returns the registry of how long each phase of each recorder's readings took, shared by every recorder. Use
+        its snapshot method to get the statistics. """
+        return BaseRecorder._timings
+
+    @contextmanager
+    def time_phase(self, phase: str):
+        """ A context manager that records how long its block took, as the phase provided of the current reading. Use
+        this in process to time sub-phases, e.g. the download and upload tests. """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            BaseRecorder._timings.record(self.identifier, phase, seconds)
+            self._reading_phases[phase] = self._reading_phases.get(phase, 0) + seconds
+
+    def log_if_slow(self, seconds: float):
+        """ Logs how long each phase of the current reading took, if the reading took at least
+        constants.SLOW_READING_THRESHOLD seconds. """
+        if seconds >= constants.SLOW_READING_THRESHOLD:
+            BaseRecorder.get_logger().warning(f"Reading by '{self.identifier}' took {seconds:.1f}s: "
+                                              f"{timings.format_phases(self._reading_phases)}")
+    # End of timing related functions
+
+    # Results writer related functions
+    @staticmethod
+    def acquire_results_writer() -> Queue:
+        """ Starts the results writer thread for csv_path if it isn't already running, and returns the queue to send
+        readings to it with. Every recorder shares the same writer, so the recording file is only opened once.
+        Call release_results_writer once the queue is no longer needed.
+            May raise any errors from open() statement. """
+        from . import files  # Imported here because files depends on this module
+
+        with BaseRecorder._writer_lock:
+            if BaseRecorder._writer_users == 0:
+                # Open the file before starting the thread, so errors are raised here rather than in the thread
+                writer = files.ResultsWriter(BaseRecorder.csv_path)
+                BaseRecorder._results_queue = Queue()
+                BaseRecorder._writer_close_event = Event()
+                BaseRecorder._writer_thread = Thread(target=writer.run, name="results writer",
+                                                     args=(BaseRecorder._results_queue,
+                                                           BaseRecorder._writer_close_event))
+                BaseRecorder._writer_thread.start()
+            BaseRecorder._writer_users += 1
+            return BaseRecorder._results_queue
 
-            # Create header if it does not yet exist
-            if csv_file.readline() != "":
-                writer.writeheader()
-            csv_file.seek(0)
+    @staticmethod
+    def release_results_writer():
+        """ Indicates that a queue from acquire_results_writer is no longer needed. Once no recorder needs the results
+        writer, it writes the readings left in its queue and stops. Waits for it to stop. """
+        with BaseRecorder._writer_lock:
+            BaseRecorder._writer_users -= 1
+            if BaseRecorder._writer_users > 0:
+                return
+            BaseRecorder._writer_close_event.set()
+            BaseRecorder._results_queue.put(None)  # Wake the writer, so it sees the close event straight away
+            BaseRecorder._writer_thread.join()
+            BaseRecorder._results_queue = BaseRecorder._writer_close_event = BaseRecorder._writer_thread = None
+    # End of results writer related functions
 
-            self.prepare()
+    def recording_loop(self):
+        """ Repeatedly takes a reading, publishes it to the readings bus and sends it to the results writer, which adds
+        it to the recording file.
+        The storage format used depends on the suffix of csv_path (see storage.open_storage). The file's timestamp
+        index and rollups are kept up to date too (see the index and rollups modules).
+        May raise any errors from open() statement. """
+        results_queue = BaseRecorder.acquire_results_writer()
+        try:
+            with self.time_phase("prepare"):
+                self.prepare()
             self.indicate_recorder_started()
             # Repeat until the recorder is stopped
             while not self.stop_event.is_set():
-                reading = self.process()
+                # Waiting for the next reading to be due isn't part of the reading, so it isn't included in its time
+                self.wait_for_next_reading()
+                if self.stop_event.is_set():
+                    break
+                self._reading_phases = {}
+                start = perf_counter()
+                reading = self.take_reading()
 
                 if reading is None:  # I'm unsure how this happens, but it can; probably related to threading
-                    BaseRecorder.get_logger().warning("Reading returned None")
+                    if not self.stop_event.is_set():  # Recorders may return None when told to stop
+                        BaseRecorder.get_logger().warning("Reading returned None")
                     continue
 
-                # Attempt to add new Reading object to queue
-                if BaseRecorder._new_readings_queue is not None:
-                    BaseRecorder.add_reading_to_queue(reading)
+                # Pass new Reading object to anything using it live
+                with self.time_phase("publish"):
+                    BaseRecorder.publish_reading(reading)
 
                 # Record to file
-                writer.writerow(reading.format_for_csv())
-                csv_file.flush()  # Flush buffer to ensure there is no data to be written
-
-        self.cleanup()
+                with self.time_phase("queue put"):
+                    results_queue.put(reading)
+
+                seconds = perf_counter() - start
+                BaseRecorder._timings.record(self.identifier, "reading", seconds)
+                self.log_if_slow(seconds)
+
+                # A failed test may mean the connection is down; if so, wait until it is back (without holding the
+                # bandwidth lease, so other recorders aren't held up)
+                if self.is_failed_reading(reading):
+                    with self.time_phase("outage wait"):
+                        self.wait_out_outage()
+        finally:
+            BaseRecorder.release_results_writer()
+
+        with self.time_phase("cleanup"):
+            self.cleanup()
         self.indicate_recorder_stopped()
 
+    def take_reading(self) -> Reading | None:
+        """ Calls process to take a reading, holding the bandwidth lease while it runs if the recorder has one (waiting
+        for other recorders' readings to finish first). Returns None if the recorder was stopped while waiting. """
+        if self.bandwidth_lease is None:
+            with self.time_phase("process"):
+                return self.process()
+
+        with self.time_phase("lease wait"):
+            lease = self.bandwidth_lease.acquire(self.identifier, self.stop_event)
+        if lease is None:
+            return None
+        with lease:
+            with self.time_phase("process"):
+                reading = self.process()
+            if reading is not None:
+                lease.record_reading(reading)
+        return reading
+
+    def wait_out_outage(self) -> bool:
+        """ Checks whether the connection is down, and if so, records an outage and waits until the connection is back
+        or the recorder is told to stop (see outages.wait_out_outage). Returns True if there was an outage. """
+        had_outage = outages.wait_out_outage(self.identifier, self.get_probe_addresses(), self.stop_event,
+                                             BaseRecorder.csv_path)
+        if had_outage and not self.stop_event.is_set():
+            BaseRecorder.get_logger().info(f"Connection is back; '{self.identifier}' is resuming.")
+        return had_outage
+
     # Functions to override
+    def is_failed_reading(self, reading: Reading) -> bool:
+        """ Returns True if the reading shows the test failed, which may mean the connection is down. For overriding by
+        recorders whose readings aren't speeds. """
+        return reading.download == 0 or reading.upload == 0
+
+    def get_probe_addresses(self) -> list[tuple[str, int]]:
+        """ Returns the (host, port) tuples probed to check whether the connection is down. For overriding, e.g. to
+        probe the server the recorder tests with first. """
+        return list(constants.OUTAGE_PROBE_ADDRESSES)
+
     def prepare(self):
         """ Function called before the recording loop starts. For overriding. """
         pass
 
+    def wait_for_next_reading(self):
+        """ Function called before each reading is taken, outside the reading's time, e.g. to wait until the next
+        reading is due. Time the wait with time_phase, and stop waiting straight away if stop_event is set. For
+        overriding. """
+        pass
+
     def process(self) -> Reading:
         """ This function is to be overridden. It is here for demonstration purposes only. """
         BaseRecorder.get_logger().warning("USING BASE CLASS, WHICH IS FOR TESTING PURPOSES ONLY")
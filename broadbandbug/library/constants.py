@@ -1,25 +1,134 @@
+from datetime import timedelta
 from enum import Enum
 from pathlib import Path
 
 TIME_FORMAT = '%d/%m/%Y %H:%M:%S'
 RECORDING_DEFAULT_PATH = Path("./RECORDING.csv")
+BINARY_RECORDING_SUFFIX = ".bbr"  # Recording files with this suffix use the binary storage format instead of CSV
+INDEX_SUFFIX = ".idx"  # Added to the name of a recording file to get the name of its timestamp index sidecar file
+INDEX_BLOCK_SIZE = 256  # How many readings are described by each entry of a timestamp index
+ROLLUP_SUFFIX = ".rollup"  # Added to the name of a recording file to get the name of its rollup database
+OUTAGES_SUFFIX = ".outages"  # Added to the name of a recording file to get the name of its outage log
+MANIFEST_SUFFIX = ".manifest"  # Added to the name of a recording file to get the name of its shard manifest
+SHARDS_SUFFIX = ".shards"  # Added to the name of a recording file to get the name of the directory of its shards
+
+MEMORY_MAPPED_READS = True  # Read recording files into arrays through memory maps (see the mapped module)
+
+WRITER_BATCH_SIZE = 64  # The results writer flushes once this many readings are waiting to be written...
+WRITER_FLUSH_INTERVAL_MS = 1000  # ...or once the oldest reading has been waiting this long
+WRITER_FSYNC = False  # Whether the results writer waits for each flush to reach the disk (safer, but slower)
 
 class RecordingMethod(Enum):
     SPEEDTEST_CLI = "Speedtest CLI"
     BSC = "Broadband Speed Checker"
     WHICH_WEBSITE = "Which? Website"
+    LATENCY = "Latency probe"
 
 
+# Codes used to store the recording method in binary recording files. These must never change once assigned, otherwise
+# existing binary files will be misread; add new methods with new codes instead.
+METHOD_CODES = {
+    RecordingMethod.SPEEDTEST_CLI: 0,
+    RecordingMethod.BSC: 1,
+    RecordingMethod.WHICH_WEBSITE: 2,
+    RecordingMethod.LATENCY: 3,
+}
+METHODS_BY_CODE = {code: method for method, code in METHOD_CODES.items()}
+
 LINE_COLORS = {
     RecordingMethod.SPEEDTEST_CLI: ["#0f3071", "#71500f"],
     RecordingMethod.BSC: ["#000000", "#ff0000"],
     RecordingMethod.WHICH_WEBSITE: ["#ce3a38", "#38ccce"],
+    RecordingMethod.LATENCY: ["#2a7f2a", "#9b59b6"],
 }
+# Methods that measure latency (stored as download), jitter (stored as upload) and loss rather than speeds. Their
+# readings are plotted against a separate axis, in milliseconds.
+LATENCY_METHODS = (RecordingMethod.LATENCY,)
+
+
+class RollupResolution(Enum):
+    """ The length of time summarised by each bucket of a rollup table (see the rollups module). """
+    HOUR = "hour"
+    DAY = "day"
+
+
+# Time ranges at least this long are read from the rollup tables instead of the recording file, if it has them
+ROLLUP_MIN_RANGE = timedelta(days=7)
+ROLLUP_DAILY_MIN_RANGE = timedelta(days=90)  # Time ranges at least this long use daily rollups instead of hourly
+
+
+class ShardPeriod(Enum):
+    """ How much time each shard of a partitioned recording file covers (see the shards module). """
+    DAY = "day"
+    MONTH = "month"
+
+
+# Set to a ShardPeriod to move readings from before the current day or month out of the recording file into shards, so
+# queries and backups don't need to touch the whole history; None keeps every reading in the recording file
+SHARD_PERIOD = None
+
+
+class Compression(Enum):
+    """ How shards that are no longer written to are compressed (see shards.compact). Values are the suffixes added to
+    compressed files' names. """
+    GZIP = ".gz"
+    XZ = ".xz"  # Smaller than gzip, but much slower to compress and decompress
+
+
+SHARD_COMPRESSION = Compression.GZIP
+SHARD_COMPRESS_AFTER = timedelta(days=7)  # Shards are compressed this long after their period ends; None to never
+
+
+class OverflowPolicy(Enum):
+    """ What a subscription to the readings bus does when a reading arrives while its queue is full (see the bus
+    module). """
+    DROP_OLDEST = "drop oldest"  # Drop the oldest queued reading
+    COALESCE = "coalesce"  # Replace the latest queued reading from the same method, so only the newest is kept
+
+
+READINGS_QUEUE_SIZE = 1024  # The most readings kept waiting for each subscriber to the readings bus
 
 
 class Browser(Enum):
     EDGE = "Edge"
+    CHROME = "Chrome"
 
 
 METHODS_USING_BROWSER = (RecordingMethod.BSC, RecordingMethod.WHICH_WEBSITE)
-TIMEOUT = 30  # How long speedtest cli recorder should wait when the network goes down before trying another test
+BROWSER_HEADLESS = True  # Whether browser recorders hide the browser window
+DRIVER_POOL_SIZE = 1  # The most web drivers kept open for each browser, shared by every browser recorder
+BROWSER_POLL_INTERVAL = 0.25  # How often browser recorders check if the page is ready, in seconds
+BROWSER_SETUP_TIMEOUT = 30  # Seconds browser recorders wait for a page to load before the test counts as failed
+BROWSER_TEST_TIMEOUT = 120  # Seconds browser recorders wait for a speed test to finish before it counts as failed
+LOD_FACTOR = 8  # How many buckets of each level of detail are grouped into one bucket of the next (see the lod module)
+LOD_POINTS_PER_PIXEL = 2  # The most points per pixel of width that are plotted before using a lower level of detail
+BUFFER_INITIAL_CAPACITY = 1024  # How many items a GrowableArray has space for when it is created
+GRAPH_MAX_RETENTION = None  # A timedelta limiting how long readings are kept on live graphs, or None to keep them all
+GRAPH_LOAD_CHUNK_SIZE = 100_000  # How many readings are sent to a graph window at a time while it loads
+MAX_RECORDERS = 5  # The most recorders that can run at once
+LEASE_GAP = 1  # Seconds left between one recorder's speed test finishing and another's starting, so the link settles
+LEASE_STOP_CHECK_INTERVAL = 0.5  # How often recorders waiting for the bandwidth lease check if they should stop
+# Upper bounds of the buckets of timing histograms (see the timings module), in seconds: 1 ms, doubling up to ~9 mins
+TIMING_BUCKETS = tuple(0.001 * 2 ** i for i in range(20))
+SLOW_READING_THRESHOLD = 180  # Readings taking longer than this many seconds are logged with how long each phase took
+RUNNER_EXECUTOR_WORKERS = 8  # Threads a RecorderRunner uses for blocking code, like running blocking recorders
+SPEEDTEST_STREAMS = 1  # Parallel streams used by the speedtest cli recorder, or None to calibrate when it starts
+SPEEDTEST_MAX_STREAMS = 16  # The most streams tried when calibrating
+SPEEDTEST_CALIBRATION_GAIN = 0.1  # How much faster (as a fraction) doubling the streams must be to use more streams
+SERVER_CACHE_PATH = Path("./speedtest_servers.json")  # Where the ranked speedtest servers are cached
+SERVER_CACHE_TTL = 24 * 60 * 60  # Seconds before the cached speedtest servers are ranked again
+SERVER_CACHE_SIZE = 5  # How many of the closest speedtest servers are ranked and cached
+TIMEOUT = 30  # How long browser recorders wait before trying again when the browser can't be started
+OUTAGE_PROBE_ADDRESSES = (("1.1.1.1", 443), ("8.8.8.8", 443))  # Probed (with a TCP connect) to check the connection
+OUTAGE_PROBE_TIMEOUT = 2  # Seconds a probe waits to connect before the address counts as unreachable
+OUTAGE_INITIAL_BACKOFF = 1  # Seconds between the first probes during an outage; this doubles after each probe...
+OUTAGE_MAX_BACKOFF = 60  # ...up to this many seconds
+LATENCY_INTERVAL = 5  # Seconds between the samples taken by the latency recorder
+LATENCY_PROBES = 5  # TCP connects timed for each latency sample
+LATENCY_PROBE_SPACING = 0.2  # Seconds between the probes of a sample, so they measure jitter rather than bursts
+LATENCY_TARGETS = (("1.1.1.1", 443),)  # Addresses the latency recorder connects to
+EXPORTER_ENABLED = False  # Whether the GUI serves metrics for monitoring tools to scrape (see the exporter module)
+EXPORTER_HOST = "127.0.0.1"  # The address the metrics exporter listens on; use "0.0.0.0" to allow other computers
+EXPORTER_PORT = 9750  # The port the metrics exporter listens on
+EXPORTER_AVERAGE_WINDOW = timedelta(hours=1)  # How far back the metrics exporter's rolling averages go
+DAEMON_STARTUP_TARGET = 1.0  # Most seconds starting the daemon should take on a small computer (see benchmarks.startup)
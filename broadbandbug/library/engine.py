@@ -0,0 +1,337 @@
+""" Contains the asyncio recorder engine, which runs many recorders in one thread.
+
+Recorders based on BaseRecorder block while taking a reading, so each needs a thread of its own. Recorders based on
+AsyncBaseRecorder instead await while waiting on the network, so a RecorderRunner can run lots of them (like lightweight
+probes taking a reading every second) on a single event loop, in a single thread.
+Blocking recorders can be run by a RecorderRunner too: they are wrapped in an ExecutorRecorder, which calls their
+methods in the runner's thread pool, so they don't hold up the event loop.
+
+Readings are published to the readings bus and sent to the shared results writer, the same as BaseRecorder does, so
+graphs and recording files don't need to know how the recorder was run.
+"""
+import asyncio
+from concurrent import futures
+from datetime import datetime
+from threading import Event, Thread
+from time import perf_counter
+from typing import Iterable
+
+from . import classes
+from . import constants
+from . import outages
+
+
+class AsyncBaseRecorder:
+    """ A base class defining how asyncio recorders will run, that is meant to be extended, like BaseRecorder.
+    The coroutines 'prepare', 'process', and 'cleanup' are meant to be overridden. Their code must not block (use
+    asyncio.to_thread for anything that does), otherwise every other recorder on the event loop is held up.
+    The recording_loop coroutine is meant to be run by a RecorderRunner.
+    """
+    def __init__(self, identifier: str = "recorder"):
+        """ :param identifier: a string identifying the recorder. """
+        self.identifier = identifier
+        self._recorder_running = False
+
+        # Set to indicate the recorder should stop. A threading event, so any thread can set it (and so it can be
+        # passed to the bandwidth lease), which is also passed to the event loop by send_stop_signal
+        self.stop_event = Event()
+        self.bandwidth_lease = None  # A scheduler.BandwidthLease shared with other recorders, like BaseRecorder's
+        self._reading_phases = {}  # How long each phase of the current reading has taken so far, like BaseRecorder's
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopping: asyncio.Event | None = None  # Set on the event loop when stop_event is set
+        classes.BaseRecorder.get_logger().info(f"Created {identifier}")
+
+    async def recording_loop(self):
+        """ Repeatedly takes a reading, publishes it to the readings bus and sends it to the results writer, like
+        BaseRecorder.recording_loop.
+        May raise any errors from open() statement. """
+        self._stopping = asyncio.Event()
+        self._loop = asyncio.get_running_loop()  # After _stopping is created, so _wake_loop never sees one without it
+        if self.stop_event.is_set():  # In case the recorder was stopped before it started
+            self._stopping.set()
+
+        # Opening and closing the results writer can wait on the disk, so done in a thread
+        results_queue = await asyncio.to_thread(classes.BaseRecorder.acquire_results_writer)
+        try:
+            with self.time_phase("prepare"):
+                await self.prepare()
+            self.indicate_recorder_started()
+            # Repeat until the recorder is stopped
+            while not self.stop_event.is_set():
+                # Waiting for the next reading to be due isn't part of the reading, so it isn't included in its time
+                await self.wait_for_next_reading()
+                if self.stop_event.is_set():
+                    break
+                self._reading_phases = {}
+                start = perf_counter()
+                reading = await self.take_reading()
+
+                if reading is None:
+                    if not self.stop_event.is_set():  # Recorders may return None when told to stop
+                        classes.BaseRecorder.get_logger().warning("Reading returned None")
+                    continue
+
+                with self.time_phase("publish"):
+                    classes.BaseRecorder.publish_reading(reading)
+                with self.time_phase("queue put"):
+                    results_queue.put(reading)
+
+                seconds = perf_counter() - start
+                classes.BaseRecorder.get_timings().record(self.identifier, "reading", seconds)
+                self.log_if_slow(seconds)
+
+                # A failed test may mean the connection is down; if so, wait until it is back
+                if self.is_failed_reading(reading):
+                    with self.time_phase("outage wait"):
+                        await self.wait_out_outage()
+        finally:
+            await asyncio.to_thread(classes.BaseRecorder.release_results_writer)
+
+        with self.time_phase("cleanup"):
+            await self.cleanup()
+        self.indicate_recorder_stopped()
+
+    async def take_reading(self) -> classes.Reading | None:
+        """ Awaits process to take a reading, holding the bandwidth lease while it runs if the recorder has one, like
+        BaseRecorder.take_reading. Returns None if the recorder was stopped while waiting. """
+        if self.bandwidth_lease is None:
+            with self.time_phase("process"):
+                return await self.process()
+
+        # The lease blocks while waiting, so wait in a thread
+        with self.time_phase("lease wait"):
+            lease = await asyncio.to_thread(self.bandwidth_lease.acquire, self.identifier, self.stop_event)
+        if lease is None:
+            return None
+        with lease:
+            with self.time_phase("process"):
+                reading = await self.process()
+            if reading is not None:
+                lease.record_reading(reading)
+        return reading
+
+    # Timing functions, which work the same as BaseRecorder's (time_phase times blocks with awaits in them too)
+    time_phase = classes.BaseRecorder.time_phase
+    log_if_slow = classes.BaseRecorder.log_if_slow
+
+    async def wait_for_stop(self, timeout: float) -> bool:
+        """ Waits up to timeout seconds, unless the recorder is told to stop first. Use this instead of asyncio.sleep
+        between readings, so stopping is immediate. Returns True if the recorder was told to stop. """
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.stop_event.is_set()
+
+    async def wait_out_outage(self) -> bool:
+        """ Like BaseRecorder.wait_out_outage, but waits in a thread so the event loop isn't held up. """
+        return await asyncio.to_thread(outages.wait_out_outage, self.identifier, self.get_probe_addresses(),
+                                       self.stop_event, classes.BaseRecorder.csv_path)
+
+    # Functions to override
+    def is_failed_reading(self, reading: classes.Reading) -> bool:
+        """ Returns True if the reading shows the test failed, like BaseRecorder.is_failed_reading. For overriding. """
+        return reading.download == 0 or reading.upload == 0
+
+    def get_probe_addresses(self) -> list[tuple[str, int]]:
+        """ Returns the (host, port) tuples probed to check whether the connection is down. For overriding. """
+        return list(constants.OUTAGE_PROBE_ADDRESSES)
+
+    async def prepare(self):
+        """ Coroutine awaited before the recording loop starts. For overriding. """
+        pass
+
+    async def wait_for_next_reading(self):
+        """ Coroutine awaited before each reading is taken, outside the reading's time, like
+        BaseRecorder.wait_for_next_reading. For overriding. """
+        pass
+
+    async def process(self) -> classes.Reading:
+        """ This coroutine is to be overridden. It is here for demonstration purposes only. """
+        classes.BaseRecorder.get_logger().warning("USING BASE CLASS, WHICH IS FOR TESTING PURPOSES ONLY")
+        await self.wait_for_stop(1)  # So the demonstration doesn't flood the results
+        return classes.Reading(1, 2, datetime.now(), constants.RecordingMethod.BSC)
+
+    async def cleanup(self):
+        """ Coroutine awaited after the recording loop ends. For overriding. """
+        pass
+    # End of functions to override
+
+    # Recorder running state functions
+    def indicate_recorder_started(self):
+        """ Indicates that the recorder has started. For use within the recording_loop, shouldn't be used elsewhere. """
+        classes.BaseRecorder.get_logger().info(f"Recorder '{self.identifier}' has started.")
+        self._recorder_running = True
+
+    def send_stop_signal(self):
+        """ Sends a signal to the recorder to stop. The recorder may not stop immediately. Can be used from any
+        thread. """
+        classes.BaseRecorder.get_logger().info(f"Stopping '{self.identifier}'...")
+        self.stop_event.set()
+        self._wake_loop()
+
+    def _wake_loop(self):
+        """ Passes the stop signal on to the event loop, so wait_for_stop returns straight away. """
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def indicate_recorder_stopped(self):
+        """ Indicates that the recorder has stopped. For use within the recording_loop, shouldn't be used elsewhere. """
+        classes.BaseRecorder.get_logger().info(f"Recorder '{self.identifier}' has stopped.")
+        self._recorder_running = False
+
+    @property
+    def recorder_running(self) -> bool:
+        return self._recorder_running
+    # End of recorder running state functions
+
+    def __repr__(self):
+        return f"{type(self).__name__}: {self.identifier!r} ({'stopped' if self.recorder_running else 'active'})"
+
+
+class ExecutorRecorder(AsyncBaseRecorder):
+    """ Runs a blocking BaseRecorder on an event loop, by calling its methods in the loop's default executor. """
+    def __init__(self, recorder: classes.BaseRecorder):
+        """ :param recorder: the blocking recorder to run. Its identifier is used as this recorder's identifier. """
+        super().__init__(recorder.identifier)
+        self.recorder = recorder
+        self.stop_event = recorder.stop_event  # So stopping either stops both
+
+    @property
+    def bandwidth_lease(self):
+        return self.recorder.bandwidth_lease
+
+    @bandwidth_lease.setter
+    def bandwidth_lease(self, bandwidth_lease):
+        # Set before the recorder is, by AsyncBaseRecorder.__init__
+        if hasattr(self, "recorder"):
+            self.recorder.bandwidth_lease = bandwidth_lease
+
+    # The phases are timed by the blocking recorder, so the phases it times itself are logged with the recording loop's
+    @property
+    def _reading_phases(self):
+        return self.recorder._reading_phases
+
+    @_reading_phases.setter
+    def _reading_phases(self, reading_phases):
+        if hasattr(self, "recorder"):
+            self.recorder._reading_phases = reading_phases
+
+    def time_phase(self, phase: str):
+        return self.recorder.time_phase(phase)
+
+    async def take_reading(self) -> classes.Reading | None:
+        # The blocking recorder holds the bandwidth lease itself
+        return await self._run_in_executor(self.recorder.take_reading)
+
+    async def wait_out_outage(self) -> bool:
+        return await self._run_in_executor(self.recorder.wait_out_outage)
+
+    def is_failed_reading(self, reading: classes.Reading) -> bool:
+        return self.recorder.is_failed_reading(reading)
+
+    async def prepare(self):
+        await self._run_in_executor(self.recorder.prepare)
+
+    async def wait_for_next_reading(self):
+        await self._run_in_executor(self.recorder.wait_for_next_reading)
+
+    async def process(self) -> classes.Reading:
+        return await self._run_in_executor(self.recorder.process)
+
+    async def cleanup(self):
+        await self._run_in_executor(self.recorder.cleanup)
+
+    def send_stop_signal(self):
+        self.recorder.send_stop_signal()
+        self._wake_loop()
+
+    @staticmethod
+    async def _run_in_executor(function):
+        return await asyncio.get_running_loop().run_in_executor(None, function)
+
+
+class RecorderRunner:
+    """ Runs many recorders on one event loop, in one background thread (see the module documentation). Blocking
+    recorders (BaseRecorders) are wrapped in an ExecutorRecorder. Can be used as a context manager, which starts the
+    runner, then stops it on exit. """
+    def __init__(self, recorders: Iterable[AsyncBaseRecorder | classes.BaseRecorder] = (),
+                 max_workers: int = constants.RUNNER_EXECUTOR_WORKERS, bandwidth_lease=None):
+        """ :param recorders: the recorders to run. More can be added with add.
+        :param max_workers: the most threads used to run blocking code, including blocking recorders.
+        :param bandwidth_lease: a scheduler.BandwidthLease given to every recorder, so their speed tests don't
+        overlap. Set to None for recorders that don't need one (like probes that use hardly any bandwidth).
+        """
+        self.max_workers = max_workers
+        self.bandwidth_lease = bandwidth_lease
+        self.recorders: list[AsyncBaseRecorder] = []
+        self._futures: dict[AsyncBaseRecorder, futures.Future] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: Thread | None = None
+        self._executor: futures.ThreadPoolExecutor | None = None
+
+        for recorder in recorders:
+            self.add(recorder)
+
+    def add(self, recorder: AsyncBaseRecorder | classes.BaseRecorder) -> AsyncBaseRecorder:
+        """ Adds a recorder to be run, starting it if the runner is running. Returns the recorder as it is run (so a
+        blocking recorder is returned wrapped in an ExecutorRecorder). """
+        if isinstance(recorder, classes.BaseRecorder):
+            recorder = ExecutorRecorder(recorder)
+        if self.bandwidth_lease is not None:
+            recorder.bandwidth_lease = self.bandwidth_lease
+        self.recorders.append(recorder)
+        if self._loop is not None:
+            self._start_recorder(recorder)
+        return recorder
+
+    def start(self):
+        """ Starts the event loop in a background thread, and starts every recorder on it. """
+        if self._loop is not None:
+            return
+        self._loop = asyncio.new_event_loop()
+        self._executor = futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="recorder runner")
+        self._loop.set_default_executor(self._executor)
+        self._thread = Thread(target=self._loop.run_forever, name="recorder runner", daemon=True)
+        self._thread.start()
+        for recorder in self.recorders:
+            self._start_recorder(recorder)
+
+    def _start_recorder(self, recorder: AsyncBaseRecorder):
+        future = asyncio.run_coroutine_threadsafe(recorder.recording_loop(), self._loop)
+        future.add_done_callback(lambda done: self._on_recorder_done(recorder, done))
+        self._futures[recorder] = future
+
+    @staticmethod
+    def _on_recorder_done(recorder: AsyncBaseRecorder, future: futures.Future):
+        if not future.cancelled() and future.exception() is not None:
+            classes.BaseRecorder.get_logger().error(f"Recorder '{recorder.identifier}' failed: {future.exception()!r}")
+
+    def stop(self, wait: bool = True):
+        """ Sends a stop signal to every recorder.
+        :param wait: set to True to wait for every recorder to stop, then close the event loop.
+        """
+        for recorder in self.recorders:
+            recorder.send_stop_signal()
+        if self._loop is None or not wait:
+            return
+
+        futures.wait(self._futures.values())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown()
+        self._loop = self._thread = self._executor = None
+
+    def errors(self) -> dict[str, BaseException]:
+        """ Returns the error that stopped each recorder that failed, by recorder identifier. """
+        return {recorder.identifier: future.exception() for recorder, future in self._futures.items()
+                if future.done() and not future.cancelled() and future.exception() is not None}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,276 @@
+""" Contains the metrics exporter, an optional embedded HTTP server that lets monitoring tools scrape the latest
+readings, rolling averages, whether each recorder is running, and the timing statistics (see the timings module).
+
+The exporter subscribes to the readings bus, and keeps everything it serves in memory (MetricsState), so scrapes never
+read the recording file, and are cheap however often they happen. It serves:
+    /metrics: the Prometheus text format.
+    /readings: the same information as JSON.
+Metrics are named after what the readings of each method store: speed methods have download and upload, while latency
+methods (constants.LATENCY_METHODS) have latency and jitter, in milliseconds, and loss.
+"""
+import json
+from collections import deque
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Iterable
+
+from . import classes
+from . import constants
+
+METRIC_PREFIX = "broadbandbug"
+BUS_POLL_INTERVAL = 0.5  # Seconds the exporter waits for readings before checking whether it should stop
+
+
+def get_value_names(method: constants.RecordingMethod) -> tuple[str, str]:
+    """ Returns what the download and upload of a method's readings measure, for naming metrics. """
+    if method in constants.LATENCY_METHODS:
+        return "latency_milliseconds", "jitter_milliseconds"
+    return "download", "upload"
+
+
+class MethodStats:
+    """ The latest reading of a recording method, and the readings within the rolling average window, with their
+    totals so the averages don't need to be summed for every scrape. Not thread-safe by itself. """
+    def __init__(self, window: timedelta):
+        self.window = window
+        self.latest: classes.Reading | None = None
+        self.total_readings = 0  # Every reading seen, including ones that have left the window
+
+        self._window_readings: deque[classes.Reading] = deque()
+        self._download_sum = self._upload_sum = self._loss_sum = 0.0
+        self._loss_count = 0
+
+    def add(self, reading: classes.Reading):
+        self.total_readings += 1
+        if self.latest is None or reading.timestamp >= self.latest.timestamp:
+            self.latest = reading
+
+        self._window_readings.append(reading)
+        self._update_sums(reading, 1)
+        # The window is relative to the latest reading rather than the clock, so it doesn't empty while a recorder is
+        # between readings
+        while self._window_readings and self._window_readings[0].timestamp < self.latest.timestamp - self.window:
+            self._update_sums(self._window_readings.popleft(), -1)
+
+    def _update_sums(self, reading: classes.Reading, sign: int):
+        self._download_sum += sign * reading.download
+        self._upload_sum += sign * reading.upload
+        if reading.loss is not None:
+            self._loss_sum += sign * reading.loss
+            self._loss_count += sign
+
+    def averages(self) -> dict:
+        """ Returns the mean download, upload and loss of the readings in the window, and how many there are. Loss is
+        None if none of them measured it. """
+        count = len(self._window_readings)
+        return {"count": count,
+                "download": self._download_sum / count if count else None,
+                "upload": self._upload_sum / count if count else None,
+                "loss": self._loss_sum / self._loss_count if self._loss_count else None}
+
+
+class MetricsState:
+    """ What the exporter serves, updated with each new reading. Thread-safe. """
+    def __init__(self, window: timedelta = constants.EXPORTER_AVERAGE_WINDOW):
+        """ :param window: how far back the rolling averages go, from each method's latest reading. """
+        self.window = window
+        self._methods: dict[constants.RecordingMethod, MethodStats] = {}
+        self._lock = Lock()
+
+    def add(self, reading: classes.Reading):
+        with self._lock:
+            if reading.method not in self._methods:
+                self._methods[reading.method] = MethodStats(self.window)
+            self._methods[reading.method].add(reading)
+
+    def snapshot(self) -> dict[constants.RecordingMethod, dict]:
+        """ Returns the latest reading, averages and reading count of each method that has had a reading. """
+        with self._lock:
+            return {method: {"latest": stats.latest, "averages": stats.averages(), "total": stats.total_readings}
+                    for method, stats in self._methods.items()}
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(**labels) -> str:
+    return "{" + ",".join(f'{name}="{escape_label(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class MetricsExporter:
+    """ Serves the readings and timing statistics over HTTP (see the module documentation). Use start to start it, and
+    stop to stop it, or use it as a context manager. """
+    def __init__(self, host: str = constants.EXPORTER_HOST, port: int = constants.EXPORTER_PORT,
+                 get_recorders: Callable[[], Iterable] = tuple,
+                 window: timedelta = constants.EXPORTER_AVERAGE_WINDOW):
+        """ :param host: the address to listen on. The default only accepts connections from this computer.
+        :param port: the port to listen on, or 0 to use any free port (see address).
+        :param get_recorders: returns the recorders (BaseRecorder or AsyncBaseRecorder) to report the running state
+        of. Called for each scrape, so recorders can come and go.
+        :param window: how far back the rolling averages go.
+        """
+        self.host = host
+        self.port = port
+        self.get_recorders = get_recorders
+        self.state = MetricsState(window)
+
+        self._subscription = None
+        self._server: ThreadingHTTPServer | None = None
+        self._threads: list[Thread] = []
+        self._stopping = False
+
+    def start(self):
+        """ Subscribes to the readings bus and starts serving.
+            May raise OSError if the port can't be listened on (e.g. it is in use). """
+        self._server = ThreadingHTTPServer((self.host, self.port), ExporterRequestHandler)
+        self._server.daemon_threads = True
+        self._server.exporter = self
+        self._stopping = False
+        # Readings are only needed for the latest values and averages, so if they arrive faster than the exporter can
+        # keep up (which is unlikely), the oldest are dropped
+        self._subscription = classes.BaseRecorder.get_readings_bus().subscribe()
+        self._threads = [Thread(target=self._consume_readings, name="exporter readings", daemon=True),
+                         Thread(target=self._server.serve_forever, name="exporter server", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        classes.BaseRecorder.get_logger().info(f"Serving metrics on http://{self.address[0]}:{self.address[1]}")
+
+    def _consume_readings(self):
+        while not self._stopping:
+            for reading in self._subscription.get_many(timeout=BUS_POLL_INTERVAL):
+                self.state.add(reading)
+
+    def stop(self):
+        """ Stops serving, and unsubscribes from the readings bus. Waits for the server to stop. """
+        if self._server is None:
+            return
+        self._stopping = True
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._subscription.close()
+        self._server = self._subscription = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """ The (host, port) the exporter is listening on, which differs from port if it was 0. """
+        return self._server.server_address[:2]
+
+    def get_recorder_states(self) -> dict[str, bool]:
+        """ Returns whether each recorder is running, by identifier. """
+        return {recorder.identifier: recorder.recorder_running for recorder in self.get_recorders()}
+
+    def render_json(self) -> dict:
+        """ Returns what /readings serves. """
+        methods = {}
+        for method, stats in self.state.snapshot().items():
+            latest = stats["latest"]
+            methods[method.value] = {
+                "latest": {"download": latest.download, "upload": latest.upload,
+                           "timestamp": latest.timestamp.isoformat(), "streams": latest.streams, "loss": latest.loss},
+                "averages": stats["averages"],
+                "total": stats["total"],
+            }
+        return {"generated": datetime.now().isoformat(), "average_window_seconds": self.state.window.total_seconds(),
+                "methods": methods, "recorders": self.get_recorder_states(),
+                "timings": classes.BaseRecorder.get_timings().snapshot(),
+                "dropped_readings": self._subscription.dropped if self._subscription else 0}
+
+    def render_metrics(self) -> str:
+        """ Returns what /metrics serves, in the Prometheus text format. """
+        lines = []
+
+        def add_metric(name: str, metric_type: str, description: str, samples: list[tuple[dict, float]]):
+            if not samples:
+                return
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{METRIC_PREFIX}_{name}{format_labels(**labels) if labels else ''} {value!r}")
+
+        # Latest readings and averages, by what they measure
+        snapshot = self.state.snapshot()
+        latest, averages = {}, {}
+        for method, stats in snapshot.items():
+            labels = {"method": method.value}
+            reading = stats["latest"]
+            for name, value in zip(get_value_names(method), (reading.download, reading.upload)):
+                latest.setdefault(name, []).append((labels, float(value)))
+            for name, value in zip(get_value_names(method), (stats["averages"]["download"],
+                                                              stats["averages"]["upload"])):
+                averages.setdefault(name, []).append((labels, value))
+            if reading.loss is not None:
+                latest.setdefault("loss_ratio", []).append((labels, float(reading.loss)))
+            if stats["averages"]["loss"] is not None:
+                averages.setdefault("loss_ratio", []).append((labels, stats["averages"]["loss"]))
+        for name, samples in latest.items():
+            add_metric(f"latest_{name}", "gauge", f"The {name.replace('_', ' ')} of the latest reading.", samples)
+        for name, samples in averages.items():
+            add_metric(f"average_{name}", "gauge", f"The mean {name.replace('_', ' ')} of recent readings.", samples)
+
+        add_metric("latest_reading_timestamp_seconds", "gauge", "When the latest reading was taken.",
+                   [({"method": method.value}, stats["latest"].timestamp.timestamp())
+                    for method, stats in snapshot.items()])
+        add_metric("average_readings", "gauge", "How many readings the averages are of.",
+                   [({"method": method.value}, float(stats["averages"]["count"]))
+                    for method, stats in snapshot.items()])
+        add_metric("readings_total", "counter", "Readings received since the exporter started.",
+                   [({"method": method.value}, float(stats["total"])) for method, stats in snapshot.items()])
+        add_metric("recorder_running", "gauge", "Whether each recorder is running.",
+                   [({"recorder": identifier}, float(running))
+                    for identifier, running in self.get_recorder_states().items()])
+        add_metric("exporter_dropped_readings_total", "counter", "Readings dropped because the exporter fell behind.",
+                   [({}, float(self._subscription.dropped if self._subscription else 0))])
+
+        # Timings, as a histogram for each recorder and phase
+        histograms = classes.BaseRecorder.get_timings().get_histograms()
+        if histograms:
+            name = f"{METRIC_PREFIX}_phase_duration_seconds"
+            lines.append(f"# HELP {name} How long each phase of taking and recording a reading took.")
+            lines.append(f"# TYPE {name} histogram")
+            for recorder, phases in histograms.items():
+                for phase, histogram in phases.items():
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        labels = format_labels(recorder=recorder, phase=phase, le=bound)
+                        lines.append(f"{name}_bucket{labels} {cumulative}")
+                    labels = format_labels(recorder=recorder, phase=phase)
+                    lines.append(f"{name}_sum{labels} {histogram.total!r}")
+                    lines.append(f"{name}_count{labels} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class ExporterRequestHandler(BaseHTTPRequestHandler):
+    """ Handles requests to a MetricsExporter's server. """
+    def do_GET(self):
+        exporter: MetricsExporter = self.server.exporter
+        match self.path.split("?")[0]:
+            case "/metrics":
+                self.send_body(exporter.render_metrics(), "text/plain; version=0.0.4; charset=utf-8")
+            case "/readings" | "/":
+                self.send_body(json.dumps(exporter.render_json()), "application/json")
+            case _:
+                self.send_error(404)
+
+    def send_body(self, body: str, content_type: str):
+        encoded = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes happen every few seconds, which would flood the log
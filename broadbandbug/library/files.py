@@ -1,10 +1,19 @@
 """ Contains most functions related to file handling, including creation, reading, and filtering. """
-import csv
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
+from queue import Empty, Queue
+from threading import Event, Thread
+from time import monotonic
+from typing import Iterable, Iterator
 
 from . import classes
 from . import constants
+from . import index
+from . import rollups
+from . import shards
+from . import storage
+
+WRITER_TIMINGS_NAME = "results writer"  # What the results writer's phases are recorded as (see the timings module)
 
 
 def ensure_file_exists(path: Path | str, is_dir: bool):
@@ -28,55 +37,331 @@ def ensure_file_exists(path: Path | str, is_dir: bool):
     return exists
 
 
-def read_results(csv_path: Path | str, time_constraints: tuple[datetime, datetime] | None, merge_methods: bool) -> dict | list:
+def upgrade_recording(recording_path: Path | str) -> bool:
+    """ Upgrades the recording file at the path provided if it was made before streams and loss were recorded, so they
+    are recorded in readings appended to it (see storage.BaseStorage.upgrade), then rebuilds its index and updates its
+    rollups. Must not be used while the recording file is open for writing. Returns True if it was upgraded. """
+    recording_path = Path(recording_path)
+    recording = storage.open_storage(recording_path)
+    if not recording.is_outdated():
+        return False
+
+    # Roll up any readings that haven't been yet first, since where the rollups have got to is stored as a byte offset,
+    # which is no longer valid after the upgrade
+    rollups.build_rollups(recording_path)
+    recording.upgrade()
+    index.get_index_path(recording_path).unlink(missing_ok=True)
+    index.build_index(recording_path)
+    with rollups.RollupDatabase(recording_path) as database:
+        database.set_rolled_up_end(recording_path.stat().st_size)
+    classes.BaseRecorder.get_logger().info(f"Upgraded {recording_path} to record every field of readings")
+    return True
+
+
+class ResultsWriter:
+    """ Writes readings to a recording file, keeping its timestamp index and rollups up to date (see the index and
+    rollups modules). Readings are written in batches (group commit): they are buffered until flush is called, which
+    run does once batch_size readings are waiting, or flush_interval_ms after the first of them was written, whichever
+    is first. This is much cheaper than flushing after every reading, and lets several recorders share one file
+    handle, by sending their readings to one writer thread over a queue (see results_writer).
+    """
+    def __init__(self, results_path: Path | str, batch_size: int = constants.WRITER_BATCH_SIZE,
+                 flush_interval_ms: float = constants.WRITER_FLUSH_INTERVAL_MS, fsync: bool = constants.WRITER_FSYNC,
+                 shard_period: constants.ShardPeriod | None = constants.SHARD_PERIOD,
+                 compress_after: timedelta | None = constants.SHARD_COMPRESS_AFTER):
+        """ Opens the recording file for appending, and its index and rollups for updating.
+            May raise any errors from open() statement.
+        :param results_path: path to the recording file. The storage format is chosen by its suffix (see
+        storage.open_storage).
+        :param batch_size: the most readings that are buffered before they are flushed.
+        :param flush_interval_ms: the longest a reading is buffered before it is flushed, in milliseconds.
+        :param fsync: set to True to wait for each flush to be written to disk (see storage.BaseAppender.sync).
+        :param shard_period: set to a ShardPeriod to move readings out of the recording file into shards when it is
+        opened, and whenever a reading from a new period is written (see the shards module). Set to None to keep every
+        reading in the recording file.
+        :param compress_after: how long after their period ends shards are compressed (see shards.compact), which is
+        done in the background after rolling. Set to None to never compress them.
+        """
+        if batch_size < 1:
+            raise ValueError("batch size must be at least 1")
+        self.results_path = Path(results_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.fsync = fsync
+        self.shard_period = shard_period
+        self.compress_after = compress_after
+
+        self.unflushed = 0  # How many readings have been written since the last flush
+        self._flush_deadline = None  # time.monotonic() when the unflushed readings must be flushed by
+        self._period_end = None  # When the current shard period ends, if the recording file is split into shards
+        self._compaction: Thread | None = None
+        self._open(datetime.now())
+
+    def _open(self, now: datetime):
+        """ Opens the recording file, its index and rollups, first moving readings from before the current period into
+        shards if shard_period is set, then compressing old shards, and upgrading the recording file if it was made
+        before some fields of readings were recorded (see upgrade_recording). """
+        if self.shard_period is not None:
+            shards.roll(self.results_path, self.shard_period, now)
+            self._period_end = shards.get_next_period_start(shards.get_period_start(now, self.shard_period),
+                                                           self.shard_period)
+            if self.compress_after is not None:
+                # Compressing can take a while, so is done in the background rather than holding up readings
+                self._compaction = Thread(target=shards.compact, args=(self.results_path, self.compress_after),
+                                          kwargs={"now": now}, name="shard compaction", daemon=True)
+                self._compaction.start()
+
+        upgrade_recording(self.results_path)
+        recording = storage.open_storage(self.results_path)
+        self._appender = recording.open_appender()
+        self._index_updater = index.IndexUpdater(recording)
+        self._rollup_updater = rollups.RollupUpdater(recording)
+
+    def write(self, reading: classes.Reading):
+        """ Writes a reading to the file's buffer. It is not guaranteed to be in the file until flush is called. """
+        if self._period_end is not None and reading.timestamp >= self._period_end:
+            # The first reading of a new period, so move the previous period's readings into a shard
+            self.close()
+            self._open(reading.timestamp)
+
+        with classes.BaseRecorder.get_timings().time(WRITER_TIMINGS_NAME, "write"):
+            start = self._appender.tell()
+            self._appender.append(reading)
+            self._index_updater.add(reading, start, self._appender.tell())
+            self._rollup_updater.add(reading, self._appender.tell())
+
+        if self.unflushed == 0:
+            self._flush_deadline = monotonic() + self.flush_interval
+        self.unflushed += 1
+
+    def flush(self):
+        """ Writes the buffered readings to the file, then updates the rollups (in one transaction). """
+        with classes.BaseRecorder.get_timings().time(WRITER_TIMINGS_NAME, "flush"):
+            if self.fsync:
+                self._appender.sync()
+            else:
+                self._appender.flush()
+            self._rollup_updater.flush()
+        self.unflushed = 0
+        self._flush_deadline = None
+
+    def is_flush_due(self) -> bool:
+        return self.unflushed > 0 and (self.unflushed >= self.batch_size or monotonic() >= self._flush_deadline)
+
+    def run(self, results_queue: Queue, close_event: Event):
+        """ Writes the readings put in results_queue until close_event is set, flushing them in batches. Once
+        close_event is set, the readings left in the queue are written and flushed, then the file is closed.
+        None can be put in the queue to check close_event without waiting. """
+        try:
+            while True:
+                closing = close_event.is_set()
+                # Wait for a reading, but not past when the buffered readings are due to be flushed
+                timeout = self.flush_interval if self._flush_deadline is None else self._flush_deadline - monotonic()
+                try:
+                    reading = results_queue.get_nowait() if closing else results_queue.get(timeout=max(timeout, 0))
+                except Empty:
+                    reading = None
+
+                if reading is not None:
+                    self.write(reading)
+                if self.is_flush_due():
+                    self.flush()
+                if closing and reading is None and results_queue.empty():
+                    break
+        finally:
+            self.close()
+
+    def close(self):
+        """ Flushes any buffered readings and closes the file. """
+        self.flush()
+        self._appender.close()
+        self._index_updater.close()
+        self._rollup_updater.close()
+        if self._compaction is not None:
+            self._compaction.join()
+
+
+def results_writer(results_path: Path | str, results_queue: Queue, close_event: Event, **kwargs):
+    """ Writes the readings put in results_queue to the recording file at results_path in batches, until close_event is
+    set, then writes the readings left in the queue and closes the file. Meant to be run in its own thread, so that
+    every recorder can share one writer. Keyword arguments are passed to ResultsWriter. """
+    ResultsWriter(results_path, **kwargs).run(results_queue, close_event)
+
+
+def read_results(csv_path: Path | str, time_constraints: tuple[datetime, datetime] | None, merge_methods: bool,
+                 as_batch: bool = False, use_rollups: bool = False) -> dict | list | classes.ReadingBatch:
     """
     Reads the broadband readings stored in the file at csv_path.
-        May raise any errors from an open() statement, or if csv_path refers to a file that is not a CSV file.
-    :param csv_path: path to csv file to read broadband readings from.
+        May raise any errors from an open() statement, or if csv_path refers to a file that is not a recording file.
+    :param csv_path: path to the recording file to read broadband readings from. The storage format is chosen by the
+    file's suffix (see storage.open_storage), so binary recording files can be read too.
+    If the file has a timestamp index (see the index module), it is used to only read the parts of the file that are
+    within the time constraints. If the file has been split into shards (see the shards module), only the shards within
+    the time constraints are read.
     :param time_constraints: a tuple storing two datetime objects to indicate what times to return (from, to).
     Set to None to ignore this constraint.
     :param merge_methods: set to True to merge readings from different methods into one line.
+    :param as_batch: set to True to use ReadingBatch objects instead of lists of Reading objects, which is much faster
+    and uses much less memory for large files.
+    :param use_rollups: set to True to read the file's rollups (see the rollups module) instead of its readings if the
+    time constraints (or the whole file, if there are none) cover at least constants.ROLLUP_MIN_RANGE. In that case, a
+    reading is returned for each hour or day of each method, with the mean speeds in that time.
     :return: a dict if group_by_method is True, where each key is a method, linked with a list of Reading objects.
-    Otherwise, returns a list of Reading objects.
+    Otherwise, returns a list of Reading objects. If as_batch is True, ReadingBatch objects are used instead of lists.
     """
-    # Create data structure for storing Reading objects - group by method name if necessary, otherwise use a simple list
-    readings = [] if merge_methods else {method: [] for method in constants.RecordingMethod}
+    if use_rollups:
+        resolution = choose_rollup_resolution(csv_path, time_constraints)
+        if resolution is not None:
+            readings = [bucket.to_reading() for bucket in rollups.read_rollups(csv_path, resolution, time_constraints)]
+            if as_batch:
+                readings = classes.ReadingBatch.from_readings(readings)
+            return readings if merge_methods else group_readings_by_method(readings)
+
+    if as_batch:
+        if shards.is_partitioned(csv_path):
+            # Only the shards overlapping the time constraints are read, and they are already in order (grouping keeps
+            # the order), so there is no need to sort them again
+            batch = classes.ReadingBatch.from_records(shards.read_arrays_in_range(csv_path, time_constraints))
+            batch = batch.filter_by_time(time_constraints)
+            return batch if merge_methods else batch.group_by_method()
 
-    with open(csv_path, "r") as csv_file:
-        reader = csv.DictReader(csv_file)
+        batch = classes.ReadingBatch.from_records(index.read_arrays_in_range(csv_path, time_constraints))
+        batch = batch.filter_by_time(time_constraints)
+        readings = batch if merge_methods else batch.group_by_method()
+        sort_by_timestamp(readings)
+        return readings
 
-        row: dict  # Specify row is a dict, to help PyCharm
+    # Create data structure for storing Reading objects - group by method name if necessary, otherwise use a simple list
+    readings = [] if merge_methods else {method: [] for method in constants.RecordingMethod}
 
-        # Rather than considering whether to group by method within the for loop, which would be more readable,
-        # I have used 2 for loops running similar code, so that the if statement is not re-evaluated repeatedly,
-        # which should be slightly faster.
-        if merge_methods:
-            for row in reader:
-                reading = create_reading_from_row(row)
-                if check_reading_in_constraints(reading, time_constraints):
-                    readings.append(reading)
+    # Rather than considering whether to group by method within the for loop, which would be more readable,
+    # I have used 2 for loops running similar code, so that the if statement is not re-evaluated repeatedly,
+    # which should be slightly faster.
+    if merge_methods:
+        readings.extend(iter_results(csv_path, time_constraints))
 
-        else:
-            for row in reader:
-                reading = create_reading_from_row(row)
-                if check_reading_in_constraints(reading, time_constraints):
-                    readings[reading.method].append(reading)
-            prune_unused_groups(readings)
+    else:
+        for reading in iter_results(csv_path, time_constraints):
+            readings[reading.method].append(reading)
+        prune_unused_groups(readings)
 
-    # Sort by timestamp, in case the data from csv is out of order
+    # Sort by timestamp, in case the data from csv is out of order. Shards are each in order already, which the sort
+    # detects, so this is cheap for partitioned recording files.
     sort_by_timestamp(readings)
 
     return readings
 
 
+def iter_result_batches(csv_path: Path | str, time_constraints: tuple[datetime, datetime] | None,
+                        use_rollups: bool = False, chunk_size: int = constants.GRAPH_LOAD_CHUNK_SIZE
+                        ) -> Iterator[tuple[classes.ReadingBatch, float]]:
+    """
+    Yields the readings that read_results would return (with merge_methods and as_batch set to True) a chunk at a time,
+    so they can be shown as they load (e.g. by a graph window). Each chunk is yielded with the fraction of the
+    recording that has been read so far, from 0 to 1.
+    Recording files that have been split into shards (see the shards module) are read a shard at a time, and other
+    recording files a part at a time (see iter_file_batches), so the first chunks are yielded before the rest is read.
+    Chunks are in timestamp order, apart from the readings of an unsharded recording file that were stored after later
+    readings, which are yielded last.
+        May raise the same errors as read_results.
+    :param chunk_size: the most readings in each chunk.
+    See read_results for the other parameters.
+    """
+    if use_rollups and choose_rollup_resolution(csv_path, time_constraints) is not None:
+        batches = [(read_results(csv_path, time_constraints, True, as_batch=True, use_rollups=True), 1.0)]
+    elif shards.is_partitioned(csv_path):
+        batches = shards.iter_batches(csv_path, time_constraints)
+    else:
+        batches = iter_file_batches(csv_path, time_constraints)
+
+    loaded_before = 0.0  # The fraction loaded before the current batch
+    for batch, loaded_after in batches:
+        if not len(batch):
+            # Still yielded, so the caller knows how much has been read (and can stop between batches)
+            yield batch, loaded_after
+        for start in range(0, len(batch), chunk_size):
+            end = min(start + chunk_size, len(batch))
+            yield batch[start:end], loaded_before + (loaded_after - loaded_before) * end / len(batch)
+        loaded_before = loaded_after
+
+
+def iter_file_batches(csv_path: Path | str, time_constraints: tuple[datetime, datetime] | None
+                      ) -> Iterator[tuple[classes.ReadingBatch, float]]:
+    """ Yields the readings of a recording file within the time constraints a part at a time (see
+    index.iter_arrays_in_range), each sorted by timestamp, along with the fraction of the file's bytes read so far.
+    Readings from before the end of a part already yielded (e.g. from a recorder that finished after another that
+    started later) are held back and yielded together at the end, so only the last batch can overlap the others. """
+    size = max(Path(csv_path).stat().st_size, 1)
+    latest = float("-inf")  # The latest timestamp yielded so far
+    late = []
+    for records, end in index.iter_arrays_in_range(csv_path, time_constraints):
+        batch = classes.ReadingBatch.from_records(records).filter_by_time(time_constraints)
+        batch.sort_by_timestamp()
+        is_late = batch.timestamps < latest
+        if is_late.any():
+            late.append(batch[is_late])
+            batch = batch[~is_late]
+        if len(batch):
+            latest = batch.timestamps[-1]
+        # Readings may have been added since the size was found
+        yield batch, min(end / size, 1.0)
+
+    late_batch = classes.ReadingBatch.concatenate(late)
+    late_batch.sort_by_timestamp()
+    yield late_batch, 1.0
+
+
+def choose_rollup_resolution(csv_path: Path | str,
+                             time_constraints: tuple[datetime, datetime] | None) -> constants.RollupResolution | None:
+    """ Returns the resolution of rollups that read_results should use for the time constraints provided, or None if
+    the readings should be read instead (because the range is short, or the file has no rollups). """
+    if not rollups.has_rollups(csv_path):
+        return None
+    time_span = time_constraints or rollups.get_time_span(csv_path)
+    if time_span is None:
+        return None
+    return rollups.choose_resolution(*time_span)
+
+
+def group_readings_by_method(readings: list | classes.ReadingBatch) -> dict:
+    """ Splits readings into groups for each recording method, as returned by read_results when merge_methods is False.
+    Methods with no readings are not included. """
+    if isinstance(readings, classes.ReadingBatch):
+        return readings.group_by_method()
+
+    groups = {method: [] for method in constants.RecordingMethod}
+    for reading in readings:
+        groups[reading.method].append(reading)
+    prune_unused_groups(groups)
+    return groups
+
+
+def iter_results(csv_path: Path | str, time_constraints: tuple[datetime, datetime] | None = None,
+                 methods: Iterable[constants.RecordingMethod] | None = None) -> Iterator[classes.Reading]:
+    """
+    Lazily yields the broadband readings stored in the file at csv_path, in the order they are stored (which may not be
+    timestamp order), after those in any of its shards within the time constraints (see the shards module). Unlike
+    read_results, readings are not all kept in memory, so this should be used if the readings are only needed once,
+    e.g. for aggregating (see the pipeline module for stages that can process the readings).
+        May raise any errors from an open() statement, or if csv_path refers to a file that is not a recording file.
+    :param csv_path: path to the recording file to read broadband readings from (see read_results).
+    :param time_constraints: a tuple storing two datetime objects to indicate what times to yield (from, to).
+    Set to None to ignore this constraint.
+    :param methods: the recording methods to yield readings from. Set to None to ignore this constraint.
+    """
+    methods = None if methods is None else frozenset(methods)
+    for path in shards.get_recording_paths(csv_path, time_constraints):
+        for reading in index.iter_readings_in_range(path, time_constraints):
+            if (check_reading_in_constraints(reading, time_constraints)
+                    and (methods is None or reading.method in methods)):
+                yield reading
+
+
 # Used by include_reading, implicitly tested by it
 def create_reading_from_row(row: dict) -> classes.Reading:
     """ Creates a Reading object from the dict provided - dict must have keys for 'upload', 'download', 'timestamp', and 'method'.
      For use with a method that gets Readings from a file. """
-    return classes.Reading(float(row["download"]),
-                           float(row["upload"]),
-                           classes.Reading.convert_string_to_datetime(row["timestamp"]),
-                           constants.RecordingMethod(row["method"]))
+    return classes.Reading.from_csv_row(row)
 
 
 # Used by include_reading, implicitly tested by it
@@ -106,16 +391,23 @@ def prune_unused_groups(readings: dict):
 
 
 # Used by include_reading, implicitly tested by it
-def sort_by_timestamp(readings: dict | list):
+def sort_by_timestamp(readings: dict | list | classes.ReadingBatch):
     """ For merged, sorts all the readings by timestamp, for unmerged, sorts all the readings within each group by timestamp.
+    Groups may be lists of readings or ReadingBatch objects.
     For use with a method that gets readings from a file. """
     def sort(reading: classes.Reading):
         return reading.timestamp
 
-    if isinstance(readings, list):
-        # Sort all readings
-        readings.sort(key=sort)
-    elif isinstance(readings, dict):
+    def sort_group(group: list | classes.ReadingBatch):
+        if isinstance(group, classes.ReadingBatch):
+            group.sort_by_timestamp()
+        else:
+            group.sort(key=sort)
+
+    if isinstance(readings, dict):
         # Sort within each method
         for method in readings.keys():
-            readings[method].sort(key=sort)
+            sort_group(readings[method])
+    else:
+        # Sort all readings
+        sort_group(readings)
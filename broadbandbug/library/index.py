@@ -0,0 +1,226 @@
+""" Contains the timestamp index, a sparse index kept in a sidecar file next to a recording file, which allows readings
+within a time range to be read without parsing the whole recording file.
+
+The recording file is split into blocks of consecutive readings (constants.INDEX_BLOCK_SIZE readings each), and the
+sidecar stores one fixed-width entry per complete block: where the block starts and ends in the recording file, how many
+readings it has, and the earliest and latest timestamp in it. Readings after the last complete block are not indexed,
+and are always read. Blocks are described by their earliest and latest timestamps rather than assuming the file is in
+order, since readings from different recorders may be interleaved.
+"""
+import struct
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+from . import classes
+from . import constants
+from . import mapped
+from . import storage
+
+ENTRY_STRUCT = struct.Struct("<QQIdd")  # Start offset, end offset, number of readings, earliest, latest
+
+
+class IndexEntry(NamedTuple):
+    start: int  # Byte offset of the first reading in the block
+    end: int  # Byte offset just after the last reading in the block
+    count: int  # Number of readings in the block
+    earliest: float  # Earliest timestamp in the block, in seconds since the epoch
+    latest: float  # Latest timestamp in the block, in seconds since the epoch
+
+
+def get_index_path(recording_path: Path | str) -> Path:
+    """ Returns the path of the sidecar index file for the recording file at the path provided. """
+    recording_path = Path(recording_path)
+    return recording_path.with_name(recording_path.name + constants.INDEX_SUFFIX)
+
+
+class TimestampIndex:
+    """ The timestamp index for a recording file. Call load before using it. """
+    def __init__(self, recording: storage.BaseStorage):
+        self.recording = recording
+        self.path = get_index_path(recording.path)
+        self.entries: list[IndexEntry] = []
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @property
+    def indexed_end(self) -> int:
+        """ The byte offset in the recording file where the readings that have not been indexed start. """
+        if self.entries:
+            return self.entries[-1].end
+        return self.recording.data_offset()
+
+    def load(self) -> bool:
+        """ Loads the entries from the sidecar file, if it exists.
+        Returns False if the index does not match the recording file (for example, because the recording file was
+        replaced with a smaller one), in which case the loaded entries are discarded; otherwise returns True. """
+        self.entries = []
+        if not self.exists():
+            return True
+
+        with open(self.path, "rb") as index_file:
+            data = index_file.read()
+        # Ignore an entry at the end that was only partially written
+        complete_size = len(data) - len(data) % ENTRY_STRUCT.size
+        self.entries = [IndexEntry(*values) for values in ENTRY_STRUCT.iter_unpack(data[:complete_size])]
+
+        if self.entries and self.entries[-1].end > self.recording.path.stat().st_size:
+            self.entries = []
+            return False
+        return True
+
+    def iter_ranges(self, time_constraints: tuple[datetime, datetime] | None) -> Iterator[tuple[int, int | None]]:
+        """ Yields the (offset, count) of each range of readings in the recording file that may have readings within the
+        time constraints (see files.read_results), in the form used by the storage backends' iter_readings. The last
+        range always includes the readings that haven't been indexed, so its count is None. """
+        if time_constraints is None:
+            yield self.recording.data_offset(), None
+            return
+
+        earliest, latest = time_constraints[0].timestamp(), time_constraints[1].timestamp()
+
+        # Blocks are contiguous, so neighbouring blocks that are needed are read together, rather than re-opening the
+        # recording file for each block.
+        run_start = run_count = None
+        for entry in self.entries:
+            if entry.latest < earliest or entry.earliest > latest:
+                # Block isn't needed, so read the blocks before it (if any)
+                if run_start is not None:
+                    yield run_start, run_count
+                    run_start = run_count = None
+            elif run_start is None:
+                run_start, run_count = entry.start, entry.count
+            else:
+                run_count += entry.count
+
+        # Read the remaining blocks, along with the readings that haven't been indexed
+        yield (self.indexed_end if run_start is None else run_start), None
+
+    def iter_readings(self, time_constraints: tuple[datetime, datetime] | None) -> Iterator[classes.Reading]:
+        """ Yields the readings from each block that may have readings within the time constraints (see
+        files.read_results), followed by any readings that have not been indexed. Readings outside the constraints may
+        still be yielded, so they should be checked by the caller. """
+        for offset, count in self.iter_ranges(time_constraints):
+            yield from self.recording.iter_readings(offset, count)
+
+    def read_arrays(self, time_constraints: tuple[datetime, datetime] | None,
+                    memory_mapped: bool = constants.MEMORY_MAPPED_READS) -> np.ndarray:
+        """ Loads the same readings that iter_readings would yield into a structured NumPy array (see
+        storage.BinaryStorage.read_arrays).
+        :param memory_mapped: set to True to read through a memory map (see mapped.read_arrays). If only one range of
+        a binary recording file is needed, the array is then a read-only view of the file, rather than a copy.
+        """
+        read = (lambda offset, count: mapped.read_arrays(self.recording, offset, count)) if memory_mapped \
+            else self.recording.read_arrays
+        parts = [read(offset, count) for offset, count in self.iter_ranges(time_constraints)]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def iter_arrays(self, time_constraints: tuple[datetime, datetime] | None) -> Iterator[tuple[np.ndarray, int]]:
+        """ Yields the readings that read_arrays would load a part at a time, along with the byte offset just after
+        each part (see mapped.iter_arrays). """
+        for offset, count in self.iter_ranges(time_constraints):
+            yield from mapped.iter_arrays(self.recording, offset, count)
+
+
+class IndexUpdater:
+    """ Keeps the timestamp index of a recording file up to date as readings are appended to it.
+    Can be used as a context manager, which closes the sidecar file on exit. """
+    def __init__(self, recording: storage.BaseStorage, block_size: int = constants.INDEX_BLOCK_SIZE):
+        """ Loads the index for the recording provided, and indexes any readings that were added without updating it
+        (rewriting the index if it did not match the recording file).
+        :param recording: the recording to keep the index of up to date. The recording file must exist.
+        :param block_size: the number of readings in each block.
+        """
+        self.index = TimestampIndex(recording)
+        self.block_size = block_size
+
+        # Details of the block currently being built, which is written once it has enough readings
+        self._block_start = self._block_end = self._block_count = 0
+        self._block_earliest = self._block_latest = None
+
+        index_matches = self.index.load()
+        self._index_file = open(self.index.path, "ab" if index_matches else "wb")
+
+        # Catch up with readings that have not yet been indexed
+        for start, end, reading in recording.iter_readings_with_offsets(self.index.indexed_end):
+            self.add(reading, start, end)
+
+    def add(self, reading: classes.Reading, start: int, end: int):
+        """ Adds a reading that has just been appended to the recording file to the index.
+        :param reading: the reading that was appended.
+        :param start: the byte offset where the reading starts in the recording file.
+        :param end: the byte offset where the reading ends in the recording file.
+        """
+        timestamp = reading.timestamp.timestamp()
+        if self._block_count == 0:
+            self._block_start = start
+            self._block_earliest = self._block_latest = timestamp
+        else:
+            self._block_earliest = min(self._block_earliest, timestamp)
+            self._block_latest = max(self._block_latest, timestamp)
+        self._block_end = end
+        self._block_count += 1
+
+        if self._block_count == self.block_size:
+            entry = IndexEntry(self._block_start, self._block_end, self._block_count,
+                               self._block_earliest, self._block_latest)
+            self._index_file.write(ENTRY_STRUCT.pack(*entry))
+            self._index_file.flush()
+            self.index.entries.append(entry)
+            self._block_count = 0
+
+    def close(self):
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def iter_readings_in_range(recording_path: Path | str,
+                           time_constraints: tuple[datetime, datetime] | None) -> Iterator[classes.Reading]:
+    """ Yields the readings from the recording file that may be within the time constraints, using its timestamp index
+    if it has one, otherwise yields every reading. See TimestampIndex.iter_readings. """
+    recording = storage.open_storage(recording_path)
+    timestamp_index = TimestampIndex(recording)
+    if time_constraints is None or not timestamp_index.exists():
+        return recording.iter_readings()
+
+    timestamp_index.load()
+    return timestamp_index.iter_readings(time_constraints)
+
+
+def read_arrays_in_range(recording_path: Path | str, time_constraints: tuple[datetime, datetime] | None) -> np.ndarray:
+    """ Loads the readings from the recording file that may be within the time constraints into a structured NumPy
+    array, using its timestamp index if it has one. See TimestampIndex.read_arrays. """
+    recording = storage.open_storage(recording_path)
+    timestamp_index = TimestampIndex(recording)
+    if time_constraints is None or not timestamp_index.exists():
+        return mapped.read_arrays(recording) if constants.MEMORY_MAPPED_READS else recording.read_arrays()
+
+    timestamp_index.load()
+    return timestamp_index.read_arrays(time_constraints)
+
+
+def iter_arrays_in_range(recording_path: Path | str,
+                        time_constraints: tuple[datetime, datetime] | None) -> Iterator[tuple[np.ndarray, int]]:
+    """ Yields the readings that read_arrays_in_range would load a part at a time, along with the byte offset just
+    after each part, so callers can show how much of the file has been read. See TimestampIndex.iter_arrays. """
+    recording = storage.open_storage(recording_path)
+    timestamp_index = TimestampIndex(recording)
+    if time_constraints is None or not timestamp_index.exists():
+        return mapped.iter_arrays(recording)
+
+    timestamp_index.load()
+    return timestamp_index.iter_arrays(time_constraints)
+
+
+def build_index(recording_path: Path | str, block_size: int = constants.INDEX_BLOCK_SIZE):
+    """ Creates or updates the timestamp index for the recording file at the path provided. Recorders keep the index
+    up to date themselves, so this is only needed for recording files made without an index. """
+    IndexUpdater(storage.open_storage(recording_path), block_size).close()
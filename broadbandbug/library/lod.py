@@ -0,0 +1,205 @@
+""" Contains the level of detail (LOD) engine used to plot lines with lots of points quickly.
+
+An LODPyramid precomputes summaries of a line's values at several levels of detail. Level 0 is the original points;
+each level after that groups constants.LOD_FACTOR consecutive buckets of the level before into one bucket, storing the
+minimum, maximum and mean value of each bucket. When plotting, select picks the most detailed level that has no more
+points in the visible range than can be seen at the width of the plot, so zooming in shows more detail, all the way down
+to the original points, while zoomed out views only draw a few points per pixel.
+
+Every level is stored in GrowableArrays, so adding points to a live line or dropping old points only updates the buckets
+affected, in place. Buckets are aligned to the position of each point since the pyramid was created, so dropping points
+from the start doesn't change which bucket later points belong to.
+
+Timestamps must be in ascending order.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+from . import constants
+from .buffers import GrowableArray
+
+
+class LODLevel(NamedTuple):
+    starts: np.ndarray  # Timestamp of the first point in each bucket
+    ends: np.ndarray  # Timestamp of the last point in each bucket
+    mins: np.ndarray  # Minimum value in each bucket
+    maxs: np.ndarray  # Maximum value in each bucket
+    sums: np.ndarray  # Sum of the values in each bucket, used to calculate means
+    counts: np.ndarray  # Number of original points in each bucket
+
+    @property
+    def means(self) -> np.ndarray:
+        return self.sums / self.counts
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def summarise(starts: np.ndarray, ends: np.ndarray, mins: np.ndarray, maxs: np.ndarray, sums: np.ndarray,
+              counts: np.ndarray, factor: int, first_position: int = 0) -> LODLevel:
+    """ Groups every factor consecutive buckets (or points, where mins, maxs and sums are the values, and counts are
+    ones) into one bucket. first_position is the position of the first bucket provided in its level, which is used to
+    align the groups (so a group always starts at a position that is a multiple of factor). """
+    bucket_starts = np.arange(-(first_position % factor), len(starts), factor)
+    bucket_starts[0] = 0
+    bucket_ends = np.append(bucket_starts[1:], len(starts)) - 1
+    return LODLevel(starts[bucket_starts], ends[bucket_ends],
+                    np.minimum.reduceat(mins, bucket_starts), np.maximum.reduceat(maxs, bucket_starts),
+                    np.add.reduceat(sums, bucket_starts), np.add.reduceat(counts, bucket_starts))
+
+
+class LODPyramid:
+    """ Summaries of a line at several levels of detail (see the module documentation). """
+    def __init__(self, timestamps=(), values=(), factor: int = constants.LOD_FACTOR):
+        """ :param timestamps: the x values of the line, in ascending order.
+        :param values: the y values of the line.
+        :param factor: how many buckets of each level are grouped into one bucket of the next level.
+        """
+        if factor < 2:
+            raise ValueError("LOD factor must be at least 2")
+        self.factor = factor
+        self.clear()
+        self.extend(timestamps, values)
+
+    def clear(self):
+        """ Removes every point. """
+        self._timestamps = GrowableArray()
+        self._values = GrowableArray()
+        self._levels: list[LODLevel] = []  # Levels 1 onwards, as GrowableArrays
+        # The position of the first stored point/bucket of each level (starting at level 0), counting those dropped
+        self._first_positions = [0]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps.view
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values.view
+
+    @property
+    def levels(self) -> list[LODLevel]:
+        """ Levels 1 onwards (level 0 is timestamps and values). Like GrowableArray.view, these should not be kept
+        after the pyramid is changed. """
+        return [LODLevel(*(column.view for column in level)) for level in self._levels]
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def _get_level_slice(self, level_number: int, start: int = 0, end: int | None = None) -> LODLevel:
+        """ Returns part of the level provided, treating each point of level 0 as a bucket of its own. """
+        if level_number == 0:
+            timestamps, values = self.timestamps[start:end], self.values[start:end]
+            return LODLevel(timestamps, timestamps, values, values, values, np.ones(len(values), dtype=np.int64))
+        return LODLevel(*(column[start:end] for column in self._levels[level_number - 1]))
+
+    def _get_level_length(self, level_number: int) -> int:
+        return len(self) if level_number == 0 else len(self._levels[level_number - 1].starts)
+
+    def extend(self, timestamps, values):
+        """ Adds points to the end of the line, updating only the buckets of each level that the new points affect. """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(timestamps) == 0:
+            return
+
+        # The position of the first changed point at level 0 (and later, the first changed bucket at each level)
+        first_changed = self._first_positions[0] + len(self._timestamps)
+        self._timestamps.extend(timestamps)
+        self._values.extend(values)
+
+        level_number = 1
+        # Keep adding levels until there would only be one bucket
+        while self._get_level_length(level_number - 1) > 1:
+            below_first_position = self._first_positions[level_number - 1]
+            if level_number > len(self._levels):
+                # New level, so calculate every bucket
+                first_changed = below_first_position // self.factor
+                self._levels.append(LODLevel(*(GrowableArray(dtype=np.int64 if field == "counts" else np.float64)
+                                               for field in LODLevel._fields)))
+                self._first_positions.append(first_changed)
+            else:
+                first_changed //= self.factor
+
+            # Recalculate from the start of the first bucket containing a changed point/bucket from the level below
+            start = max(first_changed * self.factor - below_first_position, 0)
+            changed = summarise(*self._get_level_slice(level_number - 1, start),
+                                factor=self.factor, first_position=below_first_position + start)
+
+            for column, new in zip(self._levels[level_number - 1], changed):
+                column.truncate(first_changed - self._first_positions[level_number])
+                column.extend(new)
+            level_number += 1
+
+    def drop_before(self, timestamp: float):
+        """ Removes the points with timestamps before the one provided, updating the first bucket of each level. """
+        count = int(np.searchsorted(self.timestamps, timestamp, "left"))
+        if count == 0:
+            return
+        if count == len(self):
+            self.clear()
+            return
+
+        self._timestamps.drop_front(count)
+        self._values.drop_front(count)
+        self._first_positions[0] += count
+
+        for level_number, level in enumerate(self._levels, start=1):
+            below_first_position = self._first_positions[level_number - 1]
+            first_position = below_first_position // self.factor
+            for column in level:
+                column.drop_front(first_position - self._first_positions[level_number])
+            self._first_positions[level_number] = first_position
+
+            # Some of what the first bucket summarised may have been dropped, so recalculate it from the level below
+            end = (first_position + 1) * self.factor - below_first_position
+            first_bucket = summarise(*self._get_level_slice(level_number - 1, 0, end),
+                                     factor=self.factor, first_position=below_first_position)
+            for column, new in zip(level, first_bucket):
+                column[0] = new[0]
+
+    def choose_level(self, x_min: float, x_max: float, pixel_width: int) -> int:
+        """ Returns the most detailed level which has no more than constants.LOD_POINTS_PER_PIXEL points per pixel in
+        the range of x values provided. """
+        visible = np.searchsorted(self.timestamps, x_max, "right") - np.searchsorted(self.timestamps, x_min, "left")
+        max_points = max(pixel_width, 1) * constants.LOD_POINTS_PER_PIXEL
+
+        level = 0
+        points = visible
+        while level < len(self._levels) and points > max_points:
+            level += 1
+            # Each level has factor times fewer buckets than the level before, but each bucket is drawn as 2 points
+            points = visible // self.factor ** level * 2
+        return level
+
+    def select(self, x_min: float, x_max: float, pixel_width: int,
+               use_means: bool = False) -> tuple[np.ndarray, np.ndarray, int]:
+        """ Returns the points to plot to show the line between x_min and x_max, on a plot that is pixel_width pixels
+        wide, along with the level of detail used. One point either side of the range is included, so the line
+        continues off the edges of the plot. At level 0, the arrays returned share memory with the pyramid.
+        At levels other than 0, each bucket is drawn as a vertical line from its minimum to its maximum, which keeps
+        spikes visible, or as a single point at its mean if use_means is True.
+        """
+        level = self.choose_level(x_min, x_max, pixel_width)
+        if level == 0:
+            first = max(np.searchsorted(self.timestamps, x_min, "left") - 1, 0)
+            last = np.searchsorted(self.timestamps, x_max, "right") + 1
+            return self.timestamps[first:last], self.values[first:last], level
+
+        summary = self.levels[level - 1]
+        first = max(np.searchsorted(summary.ends, x_min, "left") - 1, 0)
+        last = np.searchsorted(summary.starts, x_max, "right") + 1
+        summary = LODLevel(*(column[first:last] for column in summary))
+
+        midpoints = (summary.starts + summary.ends) / 2
+        if use_means:
+            return midpoints, summary.means, level
+        # Each bucket's minimum and maximum are drawn at its midpoint, so the line between them is vertical
+        return np.repeat(midpoints, 2), np.column_stack([summary.mins, summary.maxs]).ravel(), level
+
+    def full_range(self) -> tuple[float, float]:
+        """ Returns the range of x values covered by the line, or (0, 0) if it has no points. """
+        if len(self) == 0:
+            return 0, 0
+        return self.timestamps[0], self.timestamps[-1]
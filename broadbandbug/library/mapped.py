@@ -0,0 +1,218 @@
+""" Contains the memory-mapped reader, which reads recording files through mmap instead of Python file objects, so
+large files load with very little allocation (see read_arrays).
+
+Binary recording files are returned as a view of the mapped file, rather than a copy: each field's column (e.g.
+array["timestamp"]) is a view too, and the file's pages are only read from disk when they are used. Since the pages
+belong to the OS page cache, processes reading the same file (e.g. the GUI and an analysis script) share them rather
+than each having their own copy. The views are read-only, and keep the file mapped until they are deleted.
+CSV recording files have to be parsed, but are scanned as bytes with NumPy, a chunk at a time (CSV_CHUNK_SIZE), rather
+than making a dict and several strings for each row like csv.DictReader. Files with quoted fields, or rows with the
+wrong number of fields, are read with CSVStorage.read_arrays instead, which handles them the same way as before.
+
+Compressed recording files (see the storage module) can't be mapped, so are read with their backend's read_arrays.
+"""
+import io
+import mmap
+from typing import Iterator
+
+import numpy as np
+
+from . import constants
+from . import storage
+from . import timeparse
+
+CSV_CHUNK_SIZE = 4 * 1024 * 1024  # How many bytes of a CSV recording file are parsed at a time
+CSV_LINE_ESTIMATE = 64  # A generous estimate of the length of a row, for choosing how much to scan to find count rows
+# Used in place of empty optional fields when parsing them: streams of 0 mean unknown, and a loss of NaN not measured
+EMPTY_FIELD_VALUES = {"streams": b"0", "loss": b"nan"}
+
+
+class UnsupportedLayoutError(ValueError):
+    """ Raised when a CSV recording file can't be parsed as bytes, so needs to be read normally. """
+
+
+def map_file(path) -> mmap.mmap | None:
+    """ Maps the file at the path provided into memory, read-only. Returns None if the file is empty, since empty files
+    can't be mapped. The mapping stays valid after the file is closed. """
+    with open(path, "rb") as file:
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+
+
+def read_arrays(recording: storage.BaseStorage, offset: int | None = None, count: int | None = None) -> np.ndarray:
+    """ Loads the readings in the recording file into a structured NumPy array in the format of storage.RECORD_DTYPE,
+    like the read_arrays method of its storage backend, but through a memory map (see the module documentation).
+    The array is read-only if it is a view of the file.
+    :param offset: the byte offset of the reading to start from (see storage.BaseStorage.iter_readings). Set to None to
+    start from the first reading.
+    :param count: the maximum number of readings to load. Set to None to read until the end of the file.
+    """
+    if recording.compression is not None:
+        return recording.read_arrays(offset, count)
+    if isinstance(recording, storage.BinaryStorage):
+        return storage.upgrade_records(read_binary_records(recording, offset, count))
+    try:
+        return read_csv_arrays(recording, offset, count)
+    except UnsupportedLayoutError:
+        return recording.read_arrays(offset, count)
+
+
+def iter_arrays(recording: storage.BaseStorage, offset: int | None = None,
+                count: int | None = None) -> Iterator[tuple[np.ndarray, int]]:
+    """ Yields the readings that read_arrays would load a part at a time (about CSV_CHUNK_SIZE bytes of the file each),
+    along with the byte offset just after each part, so large files can be used as they are read. Compressed files are
+    read in one part. """
+    if recording.compression is not None:
+        yield recording.read_arrays(offset, count), recording.path.stat().st_size
+        return
+    if isinstance(recording, storage.BinaryStorage):
+        # Slicing the view doesn't read anything, so only the records in each part are read from disk
+        records = read_binary_records(recording, offset, count)
+        start = storage.HEADER_STRUCT.size if offset is None else offset
+        part_size = max(CSV_CHUNK_SIZE // records.itemsize, 1)
+        for part_start in range(0, len(records), part_size):
+            part = records[part_start:part_start + part_size]
+            yield storage.upgrade_records(part), start + (part_start + len(part)) * records.itemsize
+        return
+
+    position = offset
+    try:
+        for records, position in iter_csv_arrays(recording, offset, count):
+            if count is not None:
+                count -= len(records)
+            yield records, position
+    except UnsupportedLayoutError:
+        # Read the rest of the file normally, from the end of the last part that could be parsed
+        yield recording.read_arrays(position, count), recording.path.stat().st_size
+
+
+def read_binary_records(recording: storage.BinaryStorage, offset: int | None = None,
+                        count: int | None = None) -> np.ndarray:
+    """ Returns a read-only view of the complete records in a binary recording file, in the layout of the file's
+    version (see storage.RECORD_DTYPES), without copying them. The offset and count work the same way as for
+    read_arrays.
+        Raises BinaryFormatError if the file isn't a binary recording file. """
+    mapping = map_file(recording.path)
+    if mapping is None:
+        recording.read_header(io.BytesIO())  # Raises the same error as reading the header of an empty file
+    record_dtype = storage.RECORD_DTYPES[recording.read_header(io.BytesIO(mapping[:storage.HEADER_STRUCT.size]))]
+
+    offset = storage.HEADER_STRUCT.size if offset is None else offset
+    available = max(len(mapping) - offset, 0) // record_dtype.itemsize  # A partly written record at the end is ignored
+    count = available if count is None else min(count, available)
+    return np.frombuffer(mapping, dtype=record_dtype, count=count, offset=offset if count else 0)
+
+
+def read_csv_arrays(recording: storage.CSVStorage, offset: int | None = None, count: int | None = None) -> np.ndarray:
+    """ Parses the rows of a CSV recording file into a structured array in the format of storage.RECORD_DTYPE, by
+    scanning the mapped file as bytes. The offset and count work the same way as for read_arrays.
+        Raises UnsupportedLayoutError if the file has quoted fields, or rows with the wrong number of fields, and
+        ValueError if a field isn't valid. """
+    parts = [records for records, _ in iter_csv_arrays(recording, offset, count)]
+    if not parts:
+        return np.empty(0, dtype=storage.RECORD_DTYPE)
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def iter_csv_arrays(recording: storage.CSVStorage, offset: int | None = None,
+                    count: int | None = None) -> Iterator[tuple[np.ndarray, int]]:
+    """ Yields the rows that read_csv_arrays would parse a chunk (CSV_CHUNK_SIZE) at a time, along with the byte
+    offset just after each chunk's rows. Raises the same errors as read_csv_arrays, which may be after some chunks
+    have been yielded. """
+    mapping = map_file(recording.path)
+    if mapping is None:
+        return
+    header_end = mapping.find(b"\n") + 1 or len(mapping)
+    header = mapping[:header_end].decode().strip().split(",")
+    # Quotes are only looked for in the rows that are parsed (see parse_csv_rows), so reading part of a large file
+    # (e.g. a range from the timestamp index) doesn't read the whole file
+    if b'"' in mapping[:header_end] or not {"download", "upload", "timestamp", "method"}.issubset(header):
+        raise UnsupportedLayoutError(f"{recording.path} doesn't have a header that can be parsed as bytes")
+
+    position = header_end if offset is None else offset
+    while position < len(mapping) and (count is None or count > 0):
+        # Only scan as much as is likely to be needed for count rows, up to a chunk. Each chunk ends at the end of a
+        # row, so rows are never split between chunks.
+        scan_size = CSV_CHUNK_SIZE if count is None else min(CSV_CHUNK_SIZE, count * CSV_LINE_ESTIMATE)
+        end = min(position + scan_size, len(mapping))
+        if end < len(mapping):
+            end = mapping.rfind(b"\n", position, end) + 1 or mapping.find(b"\n", end) + 1 or len(mapping)
+
+        chunk = np.frombuffer(mapping, dtype=np.uint8, count=end - position, offset=position)
+        records, end_of_rows = parse_csv_rows(chunk, header, count)
+        position += end_of_rows
+        if count is not None:
+            count -= len(records)
+        yield records, position
+
+
+def parse_csv_rows(chunk: np.ndarray, header: list[str], count: int | None) -> tuple[np.ndarray, int]:
+    """ Parses up to count rows (or every row, if count is None) from a chunk of a CSV recording file, which must
+    start at the start of a row. Returns the rows as a structured array in the format of storage.RECORD_DTYPE, and the
+    offset in the chunk after the last row parsed. Blank lines are skipped, like csv.DictReader does. """
+    # Rows end at each newline, and at the end of the chunk if the last row has no newline
+    row_ends = np.flatnonzero(chunk == ord("\n"))
+    if len(chunk) and chunk[-1] != ord("\n"):
+        row_ends = np.append(row_ends, len(chunk))
+    row_starts = np.concatenate(([0], row_ends[:-1] + 1)).astype(np.int64)
+    # Leave out the carriage returns before each newline: csv.writer writes one, and files written in text mode on
+    # Windows have two. Any others would start a new row, so can't be handled here.
+    row_stops = row_ends.copy()
+    while (stripping := (row_stops > row_starts) & (chunk[np.maximum(row_stops - 1, 0)] == ord("\r"))).any():
+        row_stops -= stripping
+
+    not_blank = row_stops > row_starts
+    if count is not None and np.count_nonzero(not_blank) > count:
+        last = np.flatnonzero(not_blank)[count - 1]
+        row_ends, row_starts, row_stops, not_blank = (row_ends[:last + 1], row_starts[:last + 1],
+                                                      row_stops[:last + 1], not_blank[:last + 1])
+    end_of_rows = int(min(row_ends[-1] + 1, len(chunk))) if len(row_ends) else 0
+    if (chunk[:end_of_rows] == ord('"')).any():
+        raise UnsupportedLayoutError("rows have quoted fields")
+    if np.count_nonzero(chunk[:end_of_rows] == ord("\r")) != (row_ends - row_stops).sum():
+        raise UnsupportedLayoutError("rows have carriage returns that aren't at the end")
+    row_starts, row_stops = row_starts[not_blank], row_stops[not_blank]
+
+    # Find each field from the commas in each row, which must be one fewer than the number of columns
+    commas = np.flatnonzero(chunk[:end_of_rows] == ord(","))
+    first_commas = np.searchsorted(commas, row_starts)
+    if not (np.searchsorted(commas, row_stops) - first_commas == len(header) - 1).all():
+        raise UnsupportedLayoutError("rows don't all have a field for each column")
+    row_commas = commas[first_commas[:, np.newaxis] + np.arange(len(header) - 1)]
+    field_starts = np.column_stack([row_starts, row_commas + 1])
+    field_stops = np.column_stack([row_commas, row_stops])
+
+    def get_column(name: str) -> np.ndarray:
+        """ Returns the fields of a column as an array of bytes strings, with empty fields filled in. """
+        column = header.index(name)
+        fields = gather_fields(chunk, field_starts[:, column], field_stops[:, column])
+        if name in EMPTY_FIELD_VALUES:
+            fields = fields.astype(f"S{max(fields.itemsize, len(EMPTY_FIELD_VALUES[name]))}")
+            fields[field_stops[:, column] == field_starts[:, column]] = EMPTY_FIELD_VALUES[name]
+        return fields
+
+    records = np.empty(len(row_starts), dtype=storage.RECORD_DTYPE)
+    records["timestamp"] = timeparse.parse_timestamps(get_column("timestamp"))
+    records["download"] = get_column("download").astype(np.float64)
+    records["upload"] = get_column("upload").astype(np.float64)
+    records["streams"] = get_column("streams").astype(np.float64) if "streams" in header else 0
+    records["loss"] = get_column("loss").astype(np.float64) if "loss" in header else np.nan
+
+    # Methods are looked up once for each distinct value, rather than for each row
+    values, inverse = np.unique(get_column("method"), return_inverse=True)
+    codes_by_value = {method.value.encode(): code for method, code in constants.METHOD_CODES.items()}
+    try:
+        records["method"] = np.array([codes_by_value[value] for value in values.tolist()], dtype=np.uint8)[inverse]
+    except KeyError as e:
+        raise ValueError(f"{e.args[0].decode()!r} is not a valid RecordingMethod") from None
+    return records, end_of_rows
+
+
+def gather_fields(chunk: np.ndarray, starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """ Copies the bytes from each start to stop offset in the chunk into an array of fixed-width bytes strings. """
+    width = max(int((stops - starts).max(initial=0)), 1)
+    positions = starts[:, np.newaxis] + np.arange(width)
+    characters = np.where(positions < stops[:, np.newaxis], chunk[np.minimum(positions, len(chunk) - 1)], 0)
+    return characters.astype(np.uint8).view(f"S{width}").ravel()
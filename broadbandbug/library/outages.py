@@ -0,0 +1,143 @@
+""" Contains the outage detector, which notices when the connection goes down and when it comes back, and the outage
+log, a sidecar file next to a recording file that stores when each outage started and ended.
+
+When a recorder's test fails (gives a speed of 0), the detector probes the connection with TCP connects, which take a
+fraction of a second and hardly any bandwidth, rather than repeating the test. If a probe connects, the connection is up
+and the recorder carries on. Otherwise, an outage has started: the detector keeps probing, doubling the time between
+probes up to constants.OUTAGE_MAX_BACKOFF, and wakes the recorder as soon as a probe connects again.
+
+The start and end of each outage are appended to the outage log as separate events, so an outage that is still going on
+(or that was cut short by the application closing) is recorded too.
+"""
+import csv
+import socket
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Lock
+from typing import Callable, Iterable
+
+from . import constants
+
+EVENT_FIELDS = ["timestamp", "event", "recorder"]
+START_EVENT = "start"
+END_EVENT = "end"
+
+_log_lock = Lock()  # Stops events from recorders in different threads being written at the same time
+
+
+@dataclass(slots=True)
+class Outage:
+    """ A period when the connection was down.
+    :var start: datetime, when the outage was detected.
+    :var end: datetime | None, when the connection came back, or None if it hasn't (or the application was closed
+    first).
+    :var recorder: str, the identifier of the recorder that detected it.
+    """
+    start: datetime
+    end: datetime | None
+    recorder: str
+
+
+def tcp_probe(addresses: Iterable[tuple[str, int]], timeout: float = constants.OUTAGE_PROBE_TIMEOUT) -> bool:
+    """ Returns True if a TCP connection can be made to any of the addresses provided (as (host, port) tuples). """
+    for address in addresses:
+        try:
+            with socket.create_connection(address, timeout):
+                return True
+        except OSError:
+            continue
+    return False
+
+
+class OutageDetector:
+    """ Probes the connection, backing off exponentially while it is down (see the module documentation). """
+    def __init__(self, probe: Callable[[], bool], stop_event: Event | None = None,
+                 initial_backoff: float = constants.OUTAGE_INITIAL_BACKOFF,
+                 max_backoff: float = constants.OUTAGE_MAX_BACKOFF):
+        """ :param probe: returns True if the connection is up.
+        :param stop_event: an event that stops waiting early when set.
+        :param initial_backoff: the time between the first probes, in seconds.
+        :param max_backoff: the longest time between probes, in seconds.
+        """
+        self.probe = probe
+        self.stop_event = stop_event or Event()
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+    def wait_for_connection(self) -> bool:
+        """ Probes until the connection is up, waiting longer between each probe. Returns True once the connection is
+        up, or False if stop_event was set first. """
+        backoff = self.initial_backoff
+        while not self.probe():
+            if self.stop_event.wait(backoff):
+                return False
+            backoff = min(backoff * 2, self.max_backoff)
+        return True
+
+
+def get_outage_log_path(recording_path: Path | str) -> Path:
+    """ Returns the path of the outage log for the recording file at the path provided. """
+    recording_path = Path(recording_path)
+    return recording_path.with_name(recording_path.name + constants.OUTAGES_SUFFIX)
+
+
+def record_event(recording_path: Path | str, event: str, recorder: str, timestamp: datetime | None = None):
+    """ Appends an outage event (START_EVENT or END_EVENT) to the outage log of the recording file provided. """
+    path = get_outage_log_path(recording_path)
+    timestamp = timestamp or datetime.now()
+    with _log_lock:
+        new_file = not path.exists()
+        with open(path, "a", newline="") as log_file:
+            writer = csv.writer(log_file)
+            if new_file:
+                writer.writerow(EVENT_FIELDS)
+            writer.writerow([timestamp.strftime(constants.TIME_FORMAT), event, recorder])
+
+
+def read_outages(recording_path: Path | str,
+                 time_constraints: tuple[datetime, datetime] | None = None) -> list[Outage]:
+    """ Reads the outages from the outage log of the recording file provided, oldest first. Returns an empty list if
+    there is no outage log.
+    :param time_constraints: if provided, only outages overlapping this range are returned.
+    """
+    path = get_outage_log_path(recording_path)
+    if not path.exists():
+        return []
+
+    outages = []
+    ongoing: dict[str, Outage] = {}  # The outage each recorder is in the middle of
+    with open(path, "r", newline="") as log_file:
+        for row in csv.DictReader(log_file):
+            timestamp = datetime.strptime(row["timestamp"], constants.TIME_FORMAT)
+            if row["event"] == START_EVENT:
+                ongoing[row["recorder"]] = Outage(timestamp, None, row["recorder"])
+                outages.append(ongoing[row["recorder"]])
+            elif row["event"] == END_EVENT and row["recorder"] in ongoing:
+                ongoing.pop(row["recorder"]).end = timestamp
+
+    if time_constraints is not None:
+        start, end = time_constraints
+        outages = [outage for outage in outages if outage.start <= end and (outage.end is None or outage.end >= start)]
+    return outages
+
+
+def wait_out_outage(identifier: str, addresses: Iterable[tuple[str, int]], stop_event: Event,
+                    recording_path: Path | str) -> bool:
+    """ Used by recorders after a test fails. Probes the connection once; if it is down, records the start of an outage,
+    waits for the connection to come back, then records the end of the outage.
+    Returns True if there was an outage.
+    :param identifier: the identifier of the recorder, recorded with the events.
+    :param addresses: the (host, port) tuples to probe.
+    :param stop_event: an event that stops waiting early when set. The end of the outage isn't recorded if it is.
+    :param recording_path: the path of the recording file, next to which the outage log is kept.
+    """
+    addresses = list(addresses)
+    detector = OutageDetector(lambda: tcp_probe(addresses), stop_event)
+    if detector.probe():
+        return False
+
+    record_event(recording_path, START_EVENT, identifier)
+    if detector.wait_for_connection():
+        record_event(recording_path, END_EVENT, identifier)
+    return True
@@ -0,0 +1,75 @@
+""" Contains composable stages for processing streams of readings (like those from files.iter_results) lazily, so that
+memory use doesn't grow with the number of readings.
+
+Each function ending in _stage makes a stage: a function that takes an iterable and returns an iterator over the
+processed items. Stages can be chained with run_pipeline, for example, to get the mean download speed of each hour:
+    hourly = run_pipeline(files.iter_results(path),
+                          window_stage(timedelta(hours=1)),
+                          map_stage(lambda window: (window[0], mean(reading.download for reading in window[1]))))
+"""
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
+
+from . import classes
+
+Stage = Callable[[Iterable], Iterator]
+
+
+def run_pipeline(source: Iterable, *stages: Stage) -> Iterator:
+    """ Passes the items from source through each stage in turn, returning an iterator over the output of the last. """
+    iterator = iter(source)
+    for stage in stages:
+        iterator = stage(iterator)
+    return iterator
+
+
+def filter_stage(predicate: Callable[[Any], bool]) -> Stage:
+    """ Makes a stage that only passes on items that predicate returns True for. """
+    def stage(items: Iterable) -> Iterator:
+        return filter(predicate, items)
+    return stage
+
+
+def map_stage(function: Callable[[Any], Any]) -> Stage:
+    """ Makes a stage that passes on the result of calling function with each item. """
+    def stage(items: Iterable) -> Iterator:
+        return map(function, items)
+    return stage
+
+
+def batch_stage(size: int) -> Stage:
+    """ Makes a stage that groups items into lists of the size provided (the last list may be smaller). """
+    if size < 1:
+        raise ValueError("batch size must be at least 1")
+
+    def stage(items: Iterable) -> Iterator[list]:
+        iterator = iter(items)
+        while batch := list(islice(iterator, size)):
+            yield batch
+    return stage
+
+
+def window_stage(duration: timedelta, origin: datetime = datetime(1970, 1, 1)) -> Stage:
+    """ Makes a stage that groups readings into consecutive windows of time of the duration provided, passing on a
+    tuple of (window start, list of readings) for each window with readings in it.
+    Windows are aligned to origin, so hourly windows start on the hour by default. Readings should be in timestamp
+    order; a reading from an earlier window than the one before it starts a new window.
+    """
+    if duration <= timedelta(0):
+        raise ValueError("window duration must be positive")
+
+    def stage(readings: Iterable[classes.Reading]) -> Iterator[tuple[datetime, list[classes.Reading]]]:
+        window_start = None
+        window = []
+        for reading in readings:
+            reading_window_start = origin + (reading.timestamp - origin) // duration * duration
+            if reading_window_start != window_start and window:
+                yield window_start, window
+                window = []
+            window_start = reading_window_start
+            window.append(reading)
+
+        if window:
+            yield window_start, window
+    return stage
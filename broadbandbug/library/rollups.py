@@ -0,0 +1,315 @@
+""" Contains the rollup tables, which summarise the readings of a recording file by hour and by day, so that long time
+ranges can be shown without reading every reading.
+
+The rollups are kept in an SQLite database next to the recording file. For each resolution (see
+constants.RollupResolution), recording method and bucket of time, they store how many readings there were, and the
+minimum, maximum and total download and upload speeds. Percentiles can't be combined exactly without keeping every
+reading, so each bucket also stores a histogram of each speed over fixed, logarithmically spaced bins, which percentiles
+are estimated from (to within a bin, which is about 10% of the speed wide).
+
+The results writer updates the rollups as readings are written (see RollupUpdater and files.ResultsWriter). The
+database also stores how far through the recording file has been rolled up, so readings added without updating the
+rollups (e.g. by older versions) are caught up with the next time the rollups are updated. Use build_rollups (or run
+this module) to create the rollups for an existing recording file.
+Buckets start on the hour or at midnight, in local time, like the readings' timestamps.
+"""
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+from . import classes
+from . import constants
+from . import storage
+
+# Edges of the histogram bins, in the same units as the speeds. Speeds below the first edge or above the last go in
+# bins of their own. These must never change once rollups have been made, otherwise existing histograms will be misread.
+HISTOGRAM_EDGES = np.geomspace(0.01, 100_000, 161)
+HISTOGRAM_DTYPE = np.dtype("<u4")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    resolution TEXT NOT NULL,
+    method INTEGER NOT NULL,  -- Code from constants.METHOD_CODES
+    start REAL NOT NULL,  -- Start of the bucket, in seconds since the epoch
+    count INTEGER NOT NULL,
+    download_min REAL NOT NULL,
+    download_max REAL NOT NULL,
+    download_sum REAL NOT NULL,
+    download_histogram BLOB NOT NULL,
+    upload_min REAL NOT NULL,
+    upload_max REAL NOT NULL,
+    upload_sum REAL NOT NULL,
+    upload_histogram BLOB NOT NULL,
+    PRIMARY KEY (resolution, method, start)
+);
+CREATE TABLE IF NOT EXISTS progress (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    rolled_up_end INTEGER NOT NULL  -- Byte offset in the recording file after the last reading rolled up
+);
+"""
+
+
+def get_rollup_path(recording_path: Path | str) -> Path:
+    """ Returns the path of the rollup database for the recording file at the path provided. """
+    recording_path = Path(recording_path)
+    return recording_path.with_name(recording_path.name + constants.ROLLUP_SUFFIX)
+
+
+def get_bucket_start(timestamp: datetime, resolution: constants.RollupResolution) -> datetime:
+    """ Returns the start of the bucket that the timestamp provided belongs to. """
+    if resolution is constants.RollupResolution.HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def choose_resolution(earliest: datetime, latest: datetime) -> constants.RollupResolution | None:
+    """ Returns the resolution of rollups to use to show the readings between the times provided, or None if the range
+    is short enough to show every reading. """
+    if latest - earliest >= constants.ROLLUP_DAILY_MIN_RANGE:
+        return constants.RollupResolution.DAY
+    if latest - earliest >= constants.ROLLUP_MIN_RANGE:
+        return constants.RollupResolution.HOUR
+    return None
+
+
+@dataclass(slots=True)
+class Aggregate:
+    """ Summarises a set of speeds.
+    :var count: int, the number of speeds.
+    :var minimum: float, the smallest speed.
+    :var maximum: float, the largest speed.
+    :var total: float, the sum of the speeds.
+    :var histogram: the number of speeds in each bin of HISTOGRAM_EDGES.
+    """
+    count: int = 0
+    minimum: float = float("inf")
+    maximum: float = float("-inf")
+    total: float = 0.0
+    histogram: np.ndarray = field(default_factory=lambda: np.zeros(len(HISTOGRAM_EDGES) + 1, dtype=HISTOGRAM_DTYPE))
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count
+
+    def add(self, value: float):
+        self.count += 1
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        self.total += value
+        self.histogram[np.searchsorted(HISTOGRAM_EDGES, value, "right")] += 1
+
+    def merge(self, other: "Aggregate"):
+        """ Adds the speeds summarised by other to this aggregate. """
+        self.count += other.count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.total += other.total
+        self.histogram += other.histogram
+
+    def percentile(self, percent: float) -> float:
+        """ Estimates the speed that the percent provided of the speeds are less than or equal to, by interpolating
+        within the histogram bin it is in. """
+        if not 0 <= percent <= 100:
+            raise ValueError("percent must be between 0 and 100")
+        rank = percent / 100 * self.count
+        cumulative = np.cumsum(self.histogram)
+        bin_number = min(int(np.searchsorted(cumulative, rank, "left")), len(self.histogram) - 1)
+
+        # Bins at either end have no edge on one side, so use the minimum or maximum instead
+        lower = HISTOGRAM_EDGES[bin_number - 1] if bin_number > 0 else self.minimum
+        upper = HISTOGRAM_EDGES[bin_number] if bin_number < len(HISTOGRAM_EDGES) else self.maximum
+        lower, upper = max(lower, self.minimum), min(upper, self.maximum)
+
+        before = cumulative[bin_number - 1] if bin_number > 0 else 0
+        in_bin = self.histogram[bin_number]
+        fraction = (rank - before) / in_bin if in_bin else 0
+        return float(lower + (upper - lower) * fraction)
+
+    def to_row(self) -> tuple:
+        return self.minimum, self.maximum, self.total, self.histogram.tobytes()
+
+    @staticmethod
+    def from_row(count: int, minimum: float, maximum: float, total: float, histogram: bytes) -> "Aggregate":
+        return Aggregate(count, minimum, maximum, total, np.frombuffer(histogram, dtype=HISTOGRAM_DTYPE).copy())
+
+
+class RollupBucket(NamedTuple):
+    """ A summary of the readings from one recording method in one bucket of time. """
+    resolution: constants.RollupResolution
+    method: constants.RecordingMethod
+    start: datetime
+    download: Aggregate
+    upload: Aggregate
+
+    @property
+    def count(self) -> int:
+        return self.download.count
+
+    def to_reading(self) -> classes.Reading:
+        """ Returns a Reading with the mean speeds of the bucket, timestamped at the start of the bucket. """
+        return classes.Reading(self.download.mean, self.upload.mean, self.start, self.method)
+
+
+class RollupDatabase:
+    """ The rollup database of a recording file. Closes the database on exit when used as a context manager. """
+    def __init__(self, recording_path: Path | str):
+        """ Opens the rollup database for the recording file at the path provided, creating it if necessary. """
+        self.path = get_rollup_path(recording_path)
+        # The database may be opened in one thread and used in another (see files.ResultsWriter), but never by two
+        # threads at once
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def get_rolled_up_end(self) -> int | None:
+        """ Returns the byte offset in the recording file after the last reading rolled up, or None if nothing has
+        been rolled up. """
+        row = self.connection.execute("SELECT rolled_up_end FROM progress WHERE id = 0").fetchone()
+        return None if row is None else row[0]
+
+    def set_rolled_up_end(self, end: int):
+        """ Sets the byte offset in the recording file after the last reading rolled up, e.g. after readings that have
+        been rolled up are moved out of the recording file (see the shards module). """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO progress VALUES (0, ?)", (end,))
+
+    def get_buckets(self, resolution: constants.RollupResolution,
+                    time_constraints: tuple[datetime, datetime] | None = None) -> list[RollupBucket]:
+        """ Returns the buckets of the resolution provided, in order of start time, then recording method.
+        :param time_constraints: a tuple of two datetime objects; only buckets containing times between them are
+        returned. Set to None to return every bucket.
+        """
+        query = "SELECT * FROM rollups WHERE resolution = ?"
+        parameters = [resolution.value]
+        if time_constraints is not None:
+            query += " AND start >= ? AND start <= ?"
+            parameters += [get_bucket_start(time_constraints[0], resolution).timestamp(),
+                           time_constraints[1].timestamp()]
+        query += " ORDER BY start, method"
+        return [RollupBucket(resolution, constants.METHODS_BY_CODE[method], datetime.fromtimestamp(start),
+                             Aggregate.from_row(count, *row[:4]), Aggregate.from_row(count, *row[4:]))
+                for _, method, start, count, *row in self.connection.execute(query, parameters)]
+
+    def get_time_span(self) -> tuple[datetime, datetime] | None:
+        """ Returns the start of the earliest and latest hourly buckets, or None if there are no rollups. """
+        earliest, latest = self.connection.execute("SELECT MIN(start), MAX(start) FROM rollups WHERE resolution = ?",
+                                                   (constants.RollupResolution.HOUR.value,)).fetchone()
+        if earliest is None:
+            return None
+        return datetime.fromtimestamp(earliest), datetime.fromtimestamp(latest)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class RollupUpdater:
+    """ Keeps the rollups of a recording file up to date as readings are appended to it. Readings are added to buckets
+    in memory, and written to the database by flush. Can be used as a context manager, which flushes and closes the
+    database on exit. """
+    def __init__(self, recording: storage.BaseStorage):
+        """ Opens the rollup database for the recording provided and rolls up any readings that were added without
+        updating it (rebuilding the rollups if they did not match the recording file).
+        :param recording: the recording to keep the rollups of up to date. The recording file must exist.
+        """
+        self.database = RollupDatabase(recording.path)
+        # Changed buckets that have not been written yet, by (resolution, method, bucket start)
+        self._pending: dict[tuple[constants.RollupResolution, constants.RecordingMethod, datetime],
+                            tuple[Aggregate, Aggregate]] = {}
+
+        self._rolled_up_end = self.database.get_rolled_up_end()
+        if self._rolled_up_end is None or self._rolled_up_end > recording.path.stat().st_size:
+            # The recording file was replaced with a smaller one, so start again
+            with self.database.connection:
+                self.database.connection.execute("DELETE FROM rollups")
+            self._rolled_up_end = recording.data_offset()
+
+        # Catch up with readings that have not yet been rolled up
+        for _, end, reading in recording.iter_readings_with_offsets(self._rolled_up_end):
+            self.add(reading, end)
+        self.flush()
+
+    def add(self, reading: classes.Reading, end: int):
+        """ Adds a reading that has just been appended to the recording file to the rollups. It is written by the next
+        call to flush.
+        :param reading: the reading that was appended.
+        :param end: the byte offset where the reading ends in the recording file.
+        """
+        for resolution in constants.RollupResolution:
+            key = (resolution, reading.method, get_bucket_start(reading.timestamp, resolution))
+            if key not in self._pending:
+                self._pending[key] = (Aggregate(), Aggregate())
+            download, upload = self._pending[key]
+            download.add(reading.download)
+            upload.add(reading.upload)
+        self._rolled_up_end = end
+
+    def flush(self):
+        """ Merges the changed buckets into the database, in a single transaction. """
+        with self.database.connection as connection:
+            for (resolution, method, start), (download, upload) in self._pending.items():
+                key = (resolution.value, constants.METHOD_CODES[method], start.timestamp())
+                row = connection.execute("SELECT * FROM rollups WHERE resolution = ? AND method = ? AND start = ?",
+                                         key).fetchone()
+                if row is not None:
+                    count = row[3]
+                    download.merge(Aggregate.from_row(count, *row[4:8]))
+                    upload.merge(Aggregate.from_row(count, *row[8:]))
+                connection.execute("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (*key, download.count, *download.to_row(), *upload.to_row()))
+            connection.execute("INSERT OR REPLACE INTO progress VALUES (0, ?)", (self._rolled_up_end,))
+        self._pending.clear()
+
+    def close(self):
+        self.flush()
+        self.database.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def has_rollups(recording_path: Path | str) -> bool:
+    return get_rollup_path(recording_path).exists()
+
+
+def read_rollups(recording_path: Path | str, resolution: constants.RollupResolution,
+                 time_constraints: tuple[datetime, datetime] | None = None) -> list[RollupBucket]:
+    """ Returns the buckets of the resolution provided from the rollups of the recording file at the path provided.
+    See RollupDatabase.get_buckets. """
+    with RollupDatabase(recording_path) as database:
+        return database.get_buckets(resolution, time_constraints)
+
+
+def get_time_span(recording_path: Path | str) -> tuple[datetime, datetime] | None:
+    """ Returns the span of time covered by the rollups of the recording file at the path provided. See
+    RollupDatabase.get_time_span. """
+    with RollupDatabase(recording_path) as database:
+        return database.get_time_span()
+
+
+def build_rollups(recording_path: Path | str):
+    """ Creates or updates the rollups for the recording file at the path provided. Recorders keep the rollups up to
+    date themselves, so this is only needed for recording files made without rollups. """
+    RollupUpdater(storage.open_storage(recording_path)).close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Creates or updates the rollup tables of a recording file.")
+    parser.add_argument("recording_path", type=Path, nargs="?", default=constants.RECORDING_DEFAULT_PATH)
+    args = parser.parse_args()
+
+    build_rollups(args.recording_path)
+    print(f"Rolled up {args.recording_path} to {get_rollup_path(args.recording_path)}")
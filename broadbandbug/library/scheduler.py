@@ -0,0 +1,225 @@
+""" Contains the recorder scheduler, which runs several recorders at once.
+
+Speed tests running at the same time would compete for the same connection, so each would measure only part of it.
+To stop this, recorders run by a scheduler share a BandwidthLease, which only one of them can hold at a time. Each
+recorder holds the lease while it takes a reading (see BaseRecorder.take_reading), so the tests themselves never
+overlap, while everything else (starting browsers, waiting after an outage, writing results) still runs concurrently.
+Recorders are given the lease in the order they asked for it, and a short gap can be left between tests so the
+connection settles.
+The lease also keeps statistics for each recorder: how long it waited for the lease, how long it held it, and the
+readings it took.
+"""
+from collections import deque
+from concurrent import futures
+from dataclasses import dataclass
+from threading import Condition, Event
+from time import monotonic
+from typing import Iterable
+
+from . import classes
+from . import constants
+
+
+@dataclass(slots=True)
+class RecorderStats:
+    """ Statistics about a recorder's use of a BandwidthLease.
+    :var leases: int, how many times the recorder has held the lease.
+    :var total_wait: float, the total time spent waiting for the lease, in seconds.
+    :var max_wait: float, the longest time spent waiting for the lease, in seconds.
+    :var total_held: float, the total time the lease was held for, in seconds.
+    :var readings: int, how many readings were taken while holding the lease.
+    :var total_download: float, the sum of the download speeds of those readings.
+    :var total_upload: float, the sum of the upload speeds of those readings.
+    :var first_lease: float | None, time.monotonic() when the recorder first asked for the lease.
+    """
+    leases: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+    total_held: float = 0.0
+    readings: int = 0
+    total_download: float = 0.0
+    total_upload: float = 0.0
+    first_lease: float | None = None
+
+    @property
+    def mean_wait(self) -> float:
+        """ The mean time spent waiting for the lease (the queueing delay), in seconds. """
+        return self.total_wait / self.leases if self.leases else 0.0
+
+    @property
+    def mean_download(self) -> float:
+        return self.total_download / self.readings if self.readings else 0.0
+
+    @property
+    def mean_upload(self) -> float:
+        return self.total_upload / self.readings if self.readings else 0.0
+
+    @property
+    def readings_per_hour(self) -> float:
+        """ How many readings the recorder has taken per hour since it first asked for the lease. """
+        if self.first_lease is None or self.readings == 0:
+            return 0.0
+        return self.readings / max(monotonic() - self.first_lease, 1e-9) * 3600
+
+
+class Lease:
+    """ A held BandwidthLease, returned by BandwidthLease.acquire. Use release, or use it as a context manager. """
+    def __init__(self, bandwidth_lease: "BandwidthLease", stats: RecorderStats):
+        self.bandwidth_lease = bandwidth_lease
+        self.stats = stats
+        self.acquired = monotonic()
+
+    def record_reading(self, reading: classes.Reading):
+        """ Adds a reading taken while holding the lease to the holder's statistics. """
+        with self.bandwidth_lease._condition:
+            self.stats.readings += 1
+            self.stats.total_download += reading.download
+            self.stats.total_upload += reading.upload
+
+    def release(self):
+        self.bandwidth_lease._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class BandwidthLease:
+    """ Stops bandwidth-heavy work (like speed tests) from different recorders happening at the same time. See the
+    module documentation. Thread-safe. """
+    def __init__(self, gap: float = constants.LEASE_GAP):
+        """ :param gap: the least time left between one holder releasing the lease and the next acquiring it, in
+        seconds. """
+        self.gap = gap
+        self.stats: dict[str, RecorderStats] = {}  # By recorder identifier
+
+        self._condition = Condition()
+        self._waiting = deque()  # Tickets of the recorders waiting for the lease, in the order they asked for it
+        self._holder: Lease | None = None
+        self._released = float("-inf")  # time.monotonic() when the lease was last released
+
+    def acquire(self, identifier: str, stop_event: Event | None = None) -> Lease | None:
+        """ Waits until the lease is free and it is the turn of the recorder provided, then holds it.
+        :param identifier: the identifier of the recorder, used to keep its statistics.
+        :param stop_event: if this is set while waiting, stop waiting and return None.
+        :return: the held lease, which must be released once the bandwidth-heavy work is done, or None if stop_event
+        was set.
+        """
+        ticket = object()
+        with self._condition:
+            stats = self.stats.setdefault(identifier, RecorderStats())
+            asked = monotonic()
+            if stats.first_lease is None:
+                stats.first_lease = asked
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    if stop_event is not None and stop_event.is_set():
+                        return None
+                    if self._holder is None and self._waiting[0] is ticket:
+                        # Leave a gap after the last holder, so the connection settles
+                        gap_left = self._released + self.gap - monotonic()
+                        if gap_left <= 0:
+                            break
+                        self._condition.wait(gap_left)
+                    else:
+                        # Check stop_event regularly, since setting it doesn't wake this thread
+                        self._condition.wait(constants.LEASE_STOP_CHECK_INTERVAL)
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+
+            wait = monotonic() - asked
+            stats.leases += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            self._holder = Lease(self, stats)
+            return self._holder
+
+    def _release(self, lease: Lease):
+        with self._condition:
+            if self._holder is not lease:
+                raise RuntimeError("lease released when it was not held")
+            self._released = monotonic()
+            lease.stats.total_held += self._released - lease.acquired
+            self._holder = None
+            self._condition.notify_all()
+
+    @property
+    def held(self) -> bool:
+        return self._holder is not None
+
+
+class RecorderScheduler:
+    """ Runs several recorders at once, each in its own thread, sharing a BandwidthLease so their speed tests don't
+    overlap. Can be used as a context manager, which starts the recorders, then stops them on exit. """
+    def __init__(self, recorders: Iterable[classes.BaseRecorder] = (), max_recorders: int = constants.MAX_RECORDERS,
+                 bandwidth_lease: BandwidthLease | None = None):
+        """ :param recorders: the recorders to run. More can be added with add.
+        :param max_recorders: the most recorders that can run at once.
+        :param bandwidth_lease: the lease shared by the recorders. Set to None to create a new one.
+        """
+        self.max_recorders = max_recorders
+        self.bandwidth_lease = bandwidth_lease or BandwidthLease()
+        self.recorders: list[classes.BaseRecorder] = []
+        self._futures: dict[classes.BaseRecorder, futures.Future] = {}
+        self._executor: futures.ThreadPoolExecutor | None = None
+
+        for recorder in recorders:
+            self.add(recorder)
+
+    def add(self, recorder: classes.BaseRecorder):
+        """ Adds a recorder to be run by the scheduler, starting it if the scheduler is running.
+        Raises ValueError if max_recorders recorders have already been added. """
+        if len(self.recorders) >= self.max_recorders:
+            raise ValueError(f"a scheduler can only run {self.max_recorders} recorders")
+        recorder.bandwidth_lease = self.bandwidth_lease
+        self.recorders.append(recorder)
+        if self._executor is not None:
+            self._start_recorder(recorder)
+
+    def start(self):
+        """ Starts every recorder, each in its own thread. """
+        if self._executor is not None:
+            return
+        self._executor = futures.ThreadPoolExecutor(self.max_recorders, thread_name_prefix="recorder")
+        for recorder in self.recorders:
+            self._start_recorder(recorder)
+
+    def _start_recorder(self, recorder: classes.BaseRecorder):
+        future = self._executor.submit(recorder.recording_loop)
+        future.add_done_callback(lambda done: self._on_recorder_done(recorder, done))
+        self._futures[recorder] = future
+
+    @staticmethod
+    def _on_recorder_done(recorder: classes.BaseRecorder, future: futures.Future):
+        if not future.cancelled() and future.exception() is not None:
+            classes.BaseRecorder.get_logger().error(f"Recorder '{recorder.identifier}' failed: {future.exception()!r}")
+
+    def stop(self, wait: bool = True):
+        """ Sends a stop signal to every recorder.
+        :param wait: set to True to wait for every recorder to stop.
+        """
+        for recorder in self.recorders:
+            recorder.send_stop_signal()
+        if self._executor is not None:
+            self._executor.shutdown(wait)
+            self._executor = None
+
+    def errors(self) -> dict[str, BaseException]:
+        """ Returns the error that stopped each recorder that failed, by recorder identifier. """
+        return {recorder.identifier: future.exception() for recorder, future in self._futures.items()
+                if future.done() and not future.cancelled() and future.exception() is not None}
+
+    def stats(self) -> dict[str, RecorderStats]:
+        """ Returns the statistics of each recorder that has asked for the lease, by recorder identifier. """
+        return dict(self.bandwidth_lease.stats)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,360 @@
+""" Contains partitioned storage, which splits a recording's history into shards covering a day or a month each (see
+constants.ShardPeriod), so queries and backups only need to touch the parts of the history they are about.
+
+New readings are always written to the recording file. Rolling the recording file (see roll) moves the readings from
+before the current period out of it, into a shard for each period they are from; the recording file is left with the
+current period's readings. Shards are kept in a directory next to the recording file, and use the same storage format
+(and suffix), so each shard is a recording file in its own right, with its own timestamp index.
+The manifest, a JSON file next to the recording file, lists each shard with the period it covers, its earliest and
+latest timestamps, and how many readings it has. Reading a time range (see files.read_results) only opens the shards
+whose timestamps overlap it, and since shards are sorted by timestamp when they are written, and cover separate
+periods, their readings can be joined in order rather than sorted again.
+
+Shards are rarely read once their period is over, so compact compresses them (see constants.SHARD_COMPRESSION) a
+while after (constants.SHARD_COMPRESS_AFTER). Compressed shards are decompressed as they are read (see the storage
+module), and are read whole, since a shard's period is already a small part of the history.
+
+The rollups stay with the recording file, and still summarise readings that have been moved to shards.
+"""
+import json
+import os
+import shutil
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from threading import Lock
+from typing import Iterator
+
+import numpy as np
+
+from . import classes
+from . import constants
+from . import index
+from . import rollups
+from . import storage
+
+MANIFEST_VERSION = 1
+COPY_BUFFER_SIZE = 1024 * 1024  # How many bytes are compressed at a time
+
+# Held while the manifest is loaded, changed and saved, so rolling and compacting (which may be in different threads)
+# don't overwrite each other's changes
+_manifest_lock = Lock()
+
+
+@dataclass(slots=True)
+class ShardInfo:
+    """ A manifest entry, describing a shard.
+    :var name: str, the shard's file name, in the shards directory.
+    :var start: float, the start of the period the shard covers, in seconds since the epoch.
+    :var earliest: float, the earliest timestamp in the shard, in seconds since the epoch.
+    :var latest: float, the latest timestamp in the shard, in seconds since the epoch.
+    :var count: int, how many readings the shard has.
+    :var compression: str, the suffix added to the shard's file name if it has been compressed (see
+    constants.Compression), otherwise None.
+    """
+    name: str
+    start: float
+    earliest: float
+    latest: float
+    count: int
+    compression: str | None = None
+
+
+def get_manifest_path(recording_path: Path | str) -> Path:
+    """ Returns the path of the manifest for the recording file at the path provided. """
+    recording_path = Path(recording_path)
+    return recording_path.with_name(recording_path.name + constants.MANIFEST_SUFFIX)
+
+
+def get_shards_dir(recording_path: Path | str) -> Path:
+    """ Returns the path of the directory the shards of the recording file at the path provided are kept in. """
+    recording_path = Path(recording_path)
+    return recording_path.with_name(recording_path.name + constants.SHARDS_SUFFIX)
+
+
+def is_partitioned(recording_path: Path | str) -> bool:
+    """ Returns True if the recording file at the path provided has shards. """
+    return get_manifest_path(recording_path).exists()
+
+
+def get_period_start(timestamp: datetime, period: constants.ShardPeriod) -> datetime:
+    """ Returns the start of the period containing the timestamp provided. Periods start at midnight, in local time,
+    like the readings' timestamps. """
+    if period is constants.ShardPeriod.MONTH:
+        return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_next_period_start(start: datetime, period: constants.ShardPeriod) -> datetime:
+    """ Returns the start of the period after the one starting at the time provided. """
+    if period is constants.ShardPeriod.MONTH:
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    # Adding a day to the date rather than 24 hours, so days either side of a clock change still start at midnight
+    return datetime.fromordinal(start.toordinal() + 1)
+
+
+class Manifest:
+    """ The list of a recording file's shards (see the module documentation). """
+    def __init__(self, recording_path: Path | str, period: constants.ShardPeriod):
+        self.recording_path = Path(recording_path)
+        self.path = get_manifest_path(recording_path)
+        self.period = period
+        self.shards: dict[str, ShardInfo] = {}  # By name
+
+    @staticmethod
+    def load(recording_path: Path | str) -> "Manifest | None":
+        """ Loads the manifest of the recording file at the path provided, or returns None if it has no shards. """
+        manifest_path = get_manifest_path(recording_path)
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, "r") as manifest_file:
+            data = json.load(manifest_file)
+        manifest = Manifest(recording_path, constants.ShardPeriod(data["period"]))
+        manifest.shards = {shard["name"]: ShardInfo(**shard) for shard in data["shards"]}
+        return manifest
+
+    def save(self):
+        """ Writes the manifest, replacing the previous one in one step, so it is never left partly written. """
+        data = {"version": MANIFEST_VERSION, "period": self.period.value,
+                "shards": [asdict(shard) for shard in sorted(self.shards.values(), key=lambda shard: shard.start)]}
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary_path, "w") as manifest_file:
+            json.dump(data, manifest_file, indent=1)
+        os.replace(temporary_path, self.path)
+
+    def get_shard_path(self, shard: ShardInfo) -> Path:
+        return get_shards_dir(self.recording_path) / (shard.name + (shard.compression or ""))
+
+    def get_shards(self, time_constraints: tuple[datetime, datetime] | None = None) -> list[ShardInfo]:
+        """ Returns the shards with readings within the time constraints (see files.read_results), oldest first. """
+        shards = sorted(self.shards.values(), key=lambda shard: shard.start)
+        if time_constraints is None:
+            return shards
+        earliest, latest = time_constraints[0].timestamp(), time_constraints[1].timestamp()
+        return [shard for shard in shards if shard.latest >= earliest and shard.earliest <= latest]
+
+    def get_shard_name(self, start: datetime) -> str:
+        """ Returns the file name of the shard for the period starting at the time provided. """
+        date_format = "%Y-%m" if self.period is constants.ShardPeriod.MONTH else "%Y-%m-%d"
+        return f"{self.recording_path.stem}.{start.strftime(date_format)}{self.recording_path.suffix}"
+
+
+def get_recording_paths(recording_path: Path | str,
+                        time_constraints: tuple[datetime, datetime] | None = None) -> list[Path]:
+    """ Returns the paths of the files that may have readings of the recording within the time constraints: the shards
+    that overlap them, oldest first, then the recording file itself (if it exists). """
+    recording_path = Path(recording_path)
+    manifest = Manifest.load(recording_path)
+    paths = []
+    if manifest is not None:
+        paths = [manifest.get_shard_path(shard) for shard in manifest.get_shards(time_constraints)]
+    if recording_path.exists() or not paths:
+        paths.append(recording_path)
+    return paths
+
+
+def write_recording(path: Path, records: np.ndarray):
+    """ Writes records (in the format of storage.RECORD_DTYPE) to a new recording file at the path provided, replacing
+    any file there in one step, and indexes it. """
+    temporary_path = path.with_name(path.name + ".tmp" + path.suffix)  # Keeping the suffix, so the format is the same
+    temporary_path.unlink(missing_ok=True)
+    with storage.open_storage(temporary_path).open_appender() as appender:
+        appender.append_records(records)
+    os.replace(temporary_path, path)
+    index.get_index_path(path).unlink(missing_ok=True)
+    index.build_index(path)
+
+
+def deduplicate_and_sort(records: np.ndarray) -> np.ndarray:
+    """ Returns the records sorted by timestamp, without exact duplicates. Duplicates can only appear if rolling was
+    interrupted after a shard was written, but before the readings were removed from the recording file. """
+    # Compared as raw bytes, since NaN (used for unmeasured loss) isn't equal to itself
+    _, first_indices = np.unique(records.view(np.dtype((np.void, records.dtype.itemsize))), return_index=True)
+    records = records[np.sort(first_indices)]
+    return records[np.argsort(records["timestamp"], kind="stable")]
+
+
+def roll(recording_path: Path | str, period: constants.ShardPeriod, now: datetime | None = None) -> int:
+    """ Moves the readings from before the current period out of the recording file at the path provided, into shards
+    (see the module documentation). Readings for a period that already has a shard (e.g. ones that arrived late) are
+    added to it. Must not be used while the recording file is open for writing. Returns how many readings were moved.
+    :param period: how much time each shard covers. Must be the same as before, if the recording already has shards.
+    :param now: the current time, which decides the current period. Set to None to use datetime.now().
+    """
+    recording_path = Path(recording_path)
+    if not recording_path.exists():
+        return 0
+    with _manifest_lock:
+        return _roll(recording_path, period, now)
+
+
+def _roll(recording_path: Path, period: constants.ShardPeriod, now: datetime | None) -> int:
+    manifest = Manifest.load(recording_path) or Manifest(recording_path, period)
+    if manifest.period is not period:
+        raise ValueError(f"{recording_path} is already split into shards of a {manifest.period.value}, not a "
+                         f"{period.value}")
+
+    records = storage.open_storage(recording_path).read_arrays()
+    current_start = get_period_start(now or datetime.now(), period).timestamp()
+    old = records["timestamp"] < current_start
+    if not old.any():
+        return 0
+
+    # Bring the rollups up to date first, so the readings being moved are still summarised. Shards don't have rollups
+    # of their own, so this is the last chance to add them.
+    rollups.build_rollups(recording_path)
+
+    # Split the old readings by period, once they are sorted
+    moved = records[old]
+    moved = moved[np.argsort(moved["timestamp"], kind="stable")]
+    get_shards_dir(recording_path).mkdir(exist_ok=True)
+    replaced = []  # Compressed shards that have been rewritten uncompressed, to delete once the manifest is saved
+    period_start = get_period_start(datetime.fromtimestamp(moved["timestamp"][0]), period)
+    while period_start.timestamp() < current_start:
+        period_end = get_next_period_start(period_start, period)
+        first, last = np.searchsorted(moved["timestamp"], [period_start.timestamp(), period_end.timestamp()])
+        if first < last:
+            name = manifest.get_shard_name(period_start)
+            shard_records = moved[first:last]
+            if name in manifest.shards:
+                existing_path = manifest.get_shard_path(manifest.shards[name])
+                existing = storage.open_storage(existing_path).read_arrays()
+                shard_records = deduplicate_and_sort(np.concatenate([existing, shard_records]))
+                if manifest.shards[name].compression is not None:
+                    replaced.append(existing_path)  # It is compressed again by the next compaction
+            shard = ShardInfo(name, period_start.timestamp(), float(shard_records["timestamp"][0]),
+                              float(shard_records["timestamp"][-1]), len(shard_records))
+            write_recording(manifest.get_shard_path(shard), shard_records)
+            manifest.shards[name] = shard
+        period_start = period_end
+    manifest.save()
+    for path in replaced:
+        path.unlink()
+
+    # Leave the current period's readings in the recording file. Its index no longer matches, so is rebuilt, and the
+    # rollups already include the readings that are left.
+    write_recording(recording_path, records[~old])
+    with rollups.RollupDatabase(recording_path) as database:
+        database.set_rolled_up_end(recording_path.stat().st_size)
+    return int(old.sum())
+
+
+def compress_file(source: Path, destination: Path, compression: constants.Compression):
+    """ Writes a compressed copy of the file at source to destination, a block at a time, replacing any file there in
+    one step. """
+    temporary_path = destination.with_name(destination.name + ".tmp")
+    with open(source, "rb") as source_file, storage.COMPRESSED_OPENERS[compression](temporary_path, "wb") as file:
+        shutil.copyfileobj(source_file, file, COPY_BUFFER_SIZE)
+    os.replace(temporary_path, destination)
+
+
+def compact(recording_path: Path | str, compress_after: timedelta = constants.SHARD_COMPRESS_AFTER,
+            compression: constants.Compression = constants.SHARD_COMPRESSION, now: datetime | None = None) -> int:
+    """ Compresses the shards of the recording file at the path provided whose periods ended at least compress_after
+    ago, replacing the uncompressed shards. Can be run while the recording is being written to, or rolled in another
+    thread (ResultsWriter runs it in the background after rolling). Returns how many shards were compressed.
+    :param now: the current time. Set to None to use datetime.now().
+    """
+    manifest = Manifest.load(recording_path)
+    if manifest is None:
+        return 0
+    cutoff = (now or datetime.now()) - compress_after
+
+    compressed = 0
+    for shard in manifest.get_shards():
+        if shard.compression is not None or \
+                get_next_period_start(datetime.fromtimestamp(shard.start), manifest.period) > cutoff:
+            continue
+        path = manifest.get_shard_path(shard)
+        compressed_path = path.with_name(path.name + compression.value)
+        compress_file(path, compressed_path, compression)
+
+        with _manifest_lock:
+            # The manifest is loaded again, in case the shard was rolled into while it was being compressed
+            latest_manifest = Manifest.load(recording_path)
+            if latest_manifest.shards.get(shard.name) != shard:
+                compressed_path.unlink()
+                continue
+            latest_manifest.shards[shard.name].compression = compression.value
+            latest_manifest.save()
+            # Removed while still holding the lock, since a roll adding late readings to the shard after it's released
+            # would write them to a new uncompressed shard at the same path. Compressed shards are read whole, so
+            # don't need their index either.
+            path.unlink()
+            index.get_index_path(path).unlink(missing_ok=True)
+        compressed += 1
+    return compressed
+
+
+def read_arrays_in_range(recording_path: Path | str, time_constraints: tuple[datetime, datetime] | None) -> np.ndarray:
+    """ Loads the readings of the recording within the time constraints, from the recording file and any of its shards
+    that overlap them, into a structured NumPy array (see storage.BaseStorage.read_arrays), sorted by timestamp.
+    Readings just outside the time constraints may be included, so they should be filtered by the caller. """
+    parts = []
+    for path in get_recording_paths(recording_path, time_constraints):
+        records = index.read_arrays_in_range(path, time_constraints)
+        if path == Path(recording_path):  # Shards are sorted when they are written, but the recording file isn't
+            records = records[np.argsort(records["timestamp"], kind="stable")]
+        parts.append(records)
+    return merge_sorted(parts)
+
+
+def iter_batches(recording_path: Path | str,
+                 time_constraints: tuple[datetime, datetime] | None) -> Iterator[tuple[classes.ReadingBatch, float]]:
+    """ Yields the readings of the recording within the time constraints a shard at a time, each sorted by timestamp
+    and after the batch before it, along with the fraction of the files that have been read so far.
+    The recording file's readings are yielded last, apart from any from the period of a shard (readings that arrived
+    late), which are yielded with that shard, so that batches never overlap. """
+    recording_path = Path(recording_path)
+    manifest = Manifest.load(recording_path)
+    overlapping = [] if manifest is None else manifest.get_shards(time_constraints)
+
+    # The recording file is read first, for its late readings
+    remaining = classes.ReadingBatch.empty()
+    if recording_path.exists() or not overlapping:
+        remaining = classes.ReadingBatch.from_records(index.read_arrays_in_range(recording_path, time_constraints))
+        remaining = remaining.filter_by_time(time_constraints)
+        remaining.sort_by_timestamp()
+
+    for number, shard in enumerate(overlapping):
+        batch = classes.ReadingBatch.from_records(index.read_arrays_in_range(manifest.get_shard_path(shard),
+                                                                             time_constraints))
+        batch = batch.filter_by_time(time_constraints)
+        # Add the late readings up to the end of the shard's period
+        period_end = get_next_period_start(datetime.fromtimestamp(shard.start), manifest.period).timestamp()
+        late_count = int(np.searchsorted(remaining.timestamps, period_end))
+        if late_count:
+            batch = classes.ReadingBatch.concatenate([batch, remaining[:late_count]])
+            batch.sort_by_timestamp()
+            remaining = remaining[late_count:]
+        yield batch, (number + 1) / (len(overlapping) + 1)
+    yield remaining, 1.0
+
+
+def merge_sorted(parts: list[np.ndarray]) -> np.ndarray:
+    """ Joins structured arrays that are each sorted by timestamp into one sorted array. Shards cover separate periods,
+    so they can simply be joined in order; they are only sorted again if some overlap (e.g. readings in the recording
+    file that arrived late, for a period that already has a shard). """
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return np.empty(0, dtype=storage.RECORD_DTYPE)
+    joined = np.concatenate(parts)
+    if all(earlier["timestamp"][-1] <= later["timestamp"][0] for earlier, later in zip(parts, parts[1:])):
+        return joined
+    return joined[np.argsort(joined["timestamp"], kind="stable")]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Moves readings from before the current day or month out of a "
+                                                 "recording file, into shards.")
+    parser.add_argument("recording_path", type=Path, nargs="?", default=constants.RECORDING_DEFAULT_PATH)
+    parser.add_argument("--period", type=constants.ShardPeriod, default=constants.SHARD_PERIOD or
+                        constants.ShardPeriod.MONTH, help="how much time each shard covers: 'day' or 'month'")
+    args = parser.parse_args()
+
+    print(f"Moved {roll(args.recording_path, args.period)} readings into shards in "
+          f"{get_shards_dir(args.recording_path)}")
+    if constants.SHARD_COMPRESS_AFTER is not None:
+        print(f"Compressed {compact(args.recording_path)} shards")
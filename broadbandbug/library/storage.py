@@ -0,0 +1,532 @@
+""" Contains the storage backends that readings are recorded to and read from: the original CSV format, and an
+append-only binary format which can be loaded straight into NumPy arrays.
+Use open_storage to get the backend for a path.
+
+The binary format is a small header followed by fixed-width little-endian records, one per reading:
+    float64 timestamp (seconds since the epoch), float32 download, float32 upload, uint8 method code,
+    uint8 number of streams (0 if unknown; only in version 2 onwards), float32 loss (NaN if not measured; only in
+    version 3 onwards).
+Because every record is the same size, the whole file can be loaded with a single NumPy call, and each field is then
+available as its own column array without parsing anything.
+
+Recording files of either format can be read (but not appended to) compressed with gzip or xz, e.g. recording.csv.gz
+(see constants.Compression). They are decompressed as they are read, so are never decompressed to disk or all at once.
+"""
+import csv
+import gzip
+import io
+import lzma
+import os
+import struct
+from itertools import islice
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from . import classes
+from . import constants
+from . import timeparse
+
+
+class BaseAppender:
+    """ Appends readings to an open recording file. Can be used as a context manager, which closes the file on exit. """
+    def __init__(self, file):
+        self._file = file
+
+    # Functions to override
+    def append(self, reading: classes.Reading):
+        """ Writes a reading to the file. This function is to be overridden. It is here for demonstration purposes
+        only, and writes the reading as a line of text. """
+        classes.BaseRecorder.get_logger().warning("USING BASE CLASS, WHICH IS FOR TESTING PURPOSES ONLY")
+        self._file.write(f"{reading}\n")
+    # End of functions to override
+
+    def append_records(self, records: np.ndarray):
+        """ Writes the readings in a structured array in the format of RECORD_DTYPE (see BaseStorage.read_arrays) to
+        the file, in order. """
+        for reading in classes.ReadingBatch.from_records(records):
+            self.append(reading)
+
+    def flush(self):
+        """ Flushes the file's buffer, so that any readings appended so far are written. """
+        self._file.flush()
+
+    def sync(self):
+        """ Flushes the file's buffer, and waits for the operating system to write it to disk, so readings appended so
+        far are kept even if the computer loses power. This is much slower than flush. """
+        self.flush()
+        os.fsync(self._file.fileno())
+
+    def tell(self) -> int:
+        """ Returns the byte offset in the file that the next reading will be written at. """
+        return self._file.tell()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# Opens compressed files, decompressing (or compressing) them a block at a time as they are read (or written)
+COMPRESSED_OPENERS = {constants.Compression.GZIP: gzip.open, constants.Compression.XZ: lzma.open}
+
+
+def get_compression(path: Path | str) -> constants.Compression | None:
+    """ Returns how the file at the path provided is compressed, going by its suffix, or None if it isn't. """
+    suffix = Path(path).suffix
+    return next((compression for compression in constants.Compression if compression.value == suffix), None)
+
+
+class BaseStorage:
+    """ A base class defining how readings are stored in a recording file, that is meant to be extended. """
+    suffix = ""  # The file suffix this storage format is used for
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.compression = get_compression(self.path)
+
+    def open_file(self, mode: str, **kwargs):
+        """ Opens the recording file for reading, decompressing it as it is read if it is compressed. Keyword arguments
+        are passed to open(). """
+        if self.compression is None:
+            return open(self.path, mode, **kwargs)
+        # Unlike open(), compressed files are opened in binary mode unless text mode is asked for
+        return COMPRESSED_OPENERS[self.compression](self.path, mode if "b" in mode else mode + "t", **kwargs)
+
+    def check_writable(self):
+        """ Raises ValueError if the recording file is compressed, since compressed files can't be appended to. """
+        if self.compression is not None:
+            raise ValueError(f"{self.path} is compressed, so can't be appended to")
+
+    # Functions to override. The base class behaves like an empty file, which readings appended to aren't kept in.
+    def open_appender(self) -> BaseAppender:
+        """ Opens the recording file for appending, creating it if necessary. May raise any errors from open(), or
+        ValueError if the file is compressed. This function is to be overridden. It is here for demonstration purposes
+        only, and appends to a buffer in memory rather than the file. """
+        classes.BaseRecorder.get_logger().warning("USING BASE CLASS, WHICH IS FOR TESTING PURPOSES ONLY")
+        self.check_writable()
+        return BaseAppender(io.StringIO())
+
+    def data_offset(self) -> int:
+        """ Returns the byte offset of the first reading in the file. For overriding. """
+        return 0
+
+    def iter_readings(self, offset: int | None = None, count: int | None = None) -> Iterator[classes.Reading]:
+        """ Yields each Reading stored in the file, in the order they were recorded. For overriding.
+        :param offset: the byte offset of the reading to start from, which must be the start of a reading. Set to None
+        to start from the first reading.
+        :param count: the maximum number of readings to yield. Set to None to read until the end of the file.
+        """
+        yield from ()
+
+    def read_arrays(self, offset: int | None = None, count: int | None = None) -> np.ndarray:
+        """ Loads the readings that iter_readings would yield into a structured NumPy array, with the fields
+        'timestamp', 'download', 'upload' and 'method' (see RECORD_DTYPE). Each field can be accessed as a column,
+        e.g. array["download"]. For overriding. """
+        return np.empty(0, dtype=RECORD_DTYPE)
+
+    def iter_readings_with_offsets(self, offset: int | None = None) -> Iterator[tuple[int, int, classes.Reading]]:
+        """ Yields each Reading stored in the file from the offset provided (see iter_readings), along with the byte
+        offsets of where the reading starts and ends in the file. Readings that have not been fully written are not
+        yielded. This is slower than iter_readings, so should only be used where the offsets are needed. For
+        overriding. """
+        yield from ()
+
+    def is_outdated(self) -> bool:
+        """ Returns True if the file was made before some fields of readings (streams and loss) were recorded, so they
+        would be dropped from readings appended to it, until it is upgraded (see upgrade). For overriding. """
+        return False
+
+    def upgrade(self):
+        """ Rewrites the file in one step so that it records every field of readings, keeping the readings already in
+        it. Their byte offsets can change, so the file's index and rollups must be updated after (see
+        files.upgrade_recording). Must not be used while the file is open for writing. For overriding. """
+        pass
+    # End of functions to override
+
+    def get_temporary_path(self) -> Path:
+        """ Returns the path a file that will replace the recording file is written to first, keeping the suffix. """
+        return self.path.with_name(self.path.name + ".tmp" + self.path.suffix)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({str(self.path)!r})"
+
+
+# CSV storage
+class CSVAppender(BaseAppender):
+    def __init__(self, file):
+        super().__init__(file)
+        # Rows are formatted into a separate buffer first, so their size is known (see tell)
+        self._row_buffer = io.StringIO()
+
+        # Create header if the file is empty (a+ mode starts at the end of the file, so go back to check)
+        file.seek(0)
+        header = next(csv.reader([file.readline()]), [])
+        if header:
+            # Keep using the file's columns, so rows still line up with the header in files made before columns were
+            # added (those columns aren't recorded)
+            self._writer = csv.DictWriter(self._row_buffer, header, extrasaction="ignore")
+            missing = [name for name in classes.Reading.attributes if name not in header]
+            if missing:
+                classes.BaseRecorder.get_logger().warning(
+                    f"{file.name} has no {', '.join(missing)} columns, so they won't be recorded until it's upgraded")
+        else:
+            self._writer = csv.DictWriter(self._row_buffer, classes.Reading.attributes)
+            self._writer.writeheader()
+            file.write(self._take_row())
+            file.flush()
+        self._position = file.seek(0, 2)
+
+    def _take_row(self) -> str:
+        """ Returns what has been written to the row buffer, and empties it. """
+        row = self._row_buffer.getvalue()
+        self._row_buffer.seek(0)
+        self._row_buffer.truncate()
+        return row
+
+    def append(self, reading: classes.Reading):
+        self._writer.writerow(reading.format_for_csv())
+        row = self._take_row()
+        self._file.write(row)
+        self._position += len(row.encode(self._file.encoding))
+
+    def tell(self) -> int:
+        # The position is tracked rather than asking the file, since text files flush their buffer when asked, which
+        # would stop readings from being written in batches
+        return self._position
+
+
+class CSVStorage(BaseStorage):
+    """ Stores readings as rows of text in a CSV file (see Reading.format_for_csv). """
+    suffix = ".csv"
+
+    def open_appender(self) -> CSVAppender:
+        self.check_writable()
+        return CSVAppender(open(self.path, "a+", newline=""))
+
+    def data_offset(self) -> int:
+        # Readings start after the header line
+        with self.open_file("rb") as csv_file:
+            return len(csv_file.readline())
+
+    def iter_readings(self, offset: int | None = None, count: int | None = None) -> Iterator[classes.Reading]:
+        with self.open_file("r", newline="") as csv_file:
+            reader = csv.DictReader(csv_file)
+            if offset is not None:
+                # Read the header before moving to the offset, since it is needed to make sense of each row
+                _ = reader.fieldnames
+                csv_file.seek(offset)
+
+            for row in islice(reader, count):
+                yield classes.Reading.from_csv_row(row)
+
+    def iter_readings_with_offsets(self, offset: int | None = None) -> Iterator[tuple[int, int, classes.Reading]]:
+        # The file is read in binary mode, since text mode does not give usable offsets while iterating over lines
+        with self.open_file("rb") as csv_file:
+            header = next(csv.reader([csv_file.readline().decode()]), [])
+            if offset is not None:
+                csv_file.seek(offset)
+
+            while True:
+                start = csv_file.tell()
+                line = csv_file.readline()
+                if not line.endswith(b"\n"):  # End of file, or a row that is still being written
+                    break
+                if line.strip() == b"":  # Skip blank lines, like csv.DictReader does
+                    continue
+
+                row = next(csv.reader([line.decode()]))
+                yield start, csv_file.tell(), classes.Reading.from_csv_row(dict(zip(header, row)))
+
+    def read_arrays(self, offset: int | None = None, count: int | None = None) -> np.ndarray:
+        """ Loads the readings in the file into a structured NumPy array, in the same format as
+        BinaryStorage.read_arrays. Each column is converted at once, rather than creating a Reading for each row.
+        The offset and count parameters work in the same way as for iter_readings. """
+        with self.open_file("r", newline="") as csv_file:
+            reader = csv.DictReader(csv_file)
+            if offset is not None:
+                _ = reader.fieldnames
+                csv_file.seek(offset)
+            rows = list(islice(reader, count))
+        codes_by_value = {method.value: code for method, code in constants.METHOD_CODES.items()}
+
+        records = np.empty(len(rows), dtype=RECORD_DTYPE)
+        records["timestamp"] = timeparse.parse_timestamps([row["timestamp"] for row in rows])
+        records["download"] = [float(row["download"]) for row in rows]
+        records["upload"] = [float(row["upload"]) for row in rows]
+        records["streams"] = [int(row.get("streams") or 0) for row in rows]
+        records["loss"] = [float(row.get("loss") or "nan") for row in rows]
+        try:
+            records["method"] = [codes_by_value[row["method"]] for row in rows]
+        except KeyError as e:
+            raise ValueError(f"{e.args[0]!r} is not a valid RecordingMethod") from None
+        return records
+
+    def read_header(self) -> list[str]:
+        """ Returns the columns named in the file's header, or an empty list if the file is empty or doesn't exist. """
+        if not self.path.exists():
+            return []
+        with self.open_file("r", newline="") as csv_file:
+            return next(csv.reader([csv_file.readline()]), [])
+
+    def is_outdated(self) -> bool:
+        header = self.read_header()
+        return bool(header) and not set(classes.Reading.attributes).issubset(header)
+
+    def upgrade(self):
+        self.check_writable()
+        header = self.read_header()
+        missing = [name for name in classes.Reading.attributes if name not in header]
+        temporary_path = self.get_temporary_path()
+        # The missing columns are added to the end of each row as they are, rather than reading and rewriting each
+        # reading, so the values already recorded stay exactly as they were written
+        with self.open_file("r", newline="") as csv_file, open(temporary_path, "w", newline="") as upgraded_file:
+            csv.writer(upgraded_file).writerow(header + missing)
+            next(csv_file)
+            for line in csv_file:
+                if not line.endswith("\n"):  # A row that was only partly written
+                    break
+                if line.strip() != "":
+                    upgraded_file.write(line.rstrip("\r\n") + "," * len(missing) + "\r\n")
+        os.replace(temporary_path, self.path)
+# End of CSV storage
+
+
+# Binary storage
+BINARY_MAGIC = b"BBUG"
+BINARY_VERSION = 3  # The version new files are written with
+HEADER_STRUCT = struct.Struct("<4sHH")  # Magic, version, size of each record
+RECORD_STRUCT = struct.Struct("<dffBBf")  # Timestamp, download, upload, method code, streams, loss
+RECORD_DTYPE = np.dtype([("timestamp", "<f8"), ("download", "<f4"), ("upload", "<f4"), ("method", "u1"),
+                         ("streams", "u1"), ("loss", "<f4")])
+# The record layout of each version that can be read. Version 1 records have no streams, and versions before 3 have no
+# loss. Each version only adds fields to the end, so a record can be written in an older version by cutting it short.
+RECORD_DTYPES = {
+    1: np.dtype([("timestamp", "<f8"), ("download", "<f4"), ("upload", "<f4"), ("method", "u1")]),
+    2: np.dtype([("timestamp", "<f8"), ("download", "<f4"), ("upload", "<f4"), ("method", "u1"), ("streams", "u1")]),
+    3: RECORD_DTYPE,
+}
+BINARY_CHUNK_SIZE = 65536  # How many records are loaded at a time when iterating over readings
+
+
+def upgrade_records(records: np.ndarray) -> np.ndarray:
+    """ Converts records from an older version of the binary format to the current layout (RECORD_DTYPE). Records
+    already in the current layout are returned as they are. """
+    if records.dtype == RECORD_DTYPE:
+        return records
+    # Fields the version doesn't have are left as 0, or NaN for loss (meaning not measured)
+    converted = np.zeros(len(records), dtype=RECORD_DTYPE)
+    converted["loss"] = np.nan
+    for name in records.dtype.names:
+        converted[name] = records[name]
+    return converted
+
+
+class BinaryFormatError(ValueError):
+    """ Raised when a file is not a binary recording file, or was written with an unsupported version. """
+
+
+class BinaryAppender(BaseAppender):
+    def __init__(self, file, version: int = BINARY_VERSION):
+        """ :param file: the open recording file, positioned after its last complete record.
+        :param version: the binary format version of the file, which records are written in.
+        """
+        super().__init__(file)
+        self.version = version
+        if version < BINARY_VERSION:
+            classes.BaseRecorder.get_logger().warning(
+                f"{file.name} uses binary format version {version}, so not every field will be recorded until it's "
+                f"upgraded")
+
+    def append(self, reading: classes.Reading):
+        record = RECORD_STRUCT.pack(reading.timestamp.timestamp(), reading.download, reading.upload,
+                                    constants.METHOD_CODES[reading.method], reading.streams or 0,
+                                    float("nan") if reading.loss is None else reading.loss)
+        # Leave out the fields the file's version doesn't have
+        self._file.write(record[:RECORD_DTYPES[self.version].itemsize])
+
+    def append_records(self, records: np.ndarray):
+        # The records are already in the file's layout (or can be converted to it), so are written in one go
+        record_dtype = RECORD_DTYPES[self.version]
+        converted = np.zeros(len(records), dtype=record_dtype)
+        for name in record_dtype.names:
+            converted[name] = records[name]
+        self._file.write(converted.tobytes())
+
+
+class BinaryStorage(BaseStorage):
+    """ Stores readings as fixed-width binary records (see the module documentation for the layout). """
+    suffix = constants.BINARY_RECORDING_SUFFIX
+
+    def read_header(self, file) -> int:
+        """ Reads and validates the header at the start of the file provided, raising BinaryFormatError if invalid.
+        Returns the file's format version. """
+        header = file.read(HEADER_STRUCT.size)
+        if len(header) != HEADER_STRUCT.size:
+            raise BinaryFormatError(f"{self.path} is too short to be a binary recording file")
+
+        magic, version, record_size = HEADER_STRUCT.unpack(header)
+        if magic != BINARY_MAGIC:
+            raise BinaryFormatError(f"{self.path} is not a binary recording file")
+        if version not in RECORD_DTYPES or record_size != RECORD_DTYPES[version].itemsize:
+            raise BinaryFormatError(f"{self.path} uses unsupported binary format version {version}")
+        return version
+
+    def get_record_size(self) -> int:
+        """ Returns the size of each record in the file, which depends on its version. Files that don't exist yet
+        will be created with the current version. """
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return RECORD_STRUCT.size
+        with self.open_file("rb") as file:
+            return RECORD_DTYPES[self.read_header(file)].itemsize
+
+    def count_records(self) -> int:
+        """ Returns the number of complete records in the file (a partially written record at the end is ignored). """
+        return max(self.path.stat().st_size - HEADER_STRUCT.size, 0) // self.get_record_size()
+
+    def data_offset(self) -> int:
+        return HEADER_STRUCT.size
+
+    def open_appender(self) -> BinaryAppender:
+        self.check_writable()
+        file = open(self.path, "ab+")
+
+        if file.tell() == 0:
+            # New file, so write the header first
+            file.write(HEADER_STRUCT.pack(BINARY_MAGIC, BINARY_VERSION, RECORD_STRUCT.size))
+            file.flush()
+            version = BINARY_VERSION
+        else:
+            file.seek(0)
+            try:
+                version = self.read_header(file)
+            except BinaryFormatError:
+                file.close()
+                raise
+
+            # If the program was stopped partway through writing a record, discard it so that new records are aligned
+            end_of_complete_records = HEADER_STRUCT.size + self.count_records() * RECORD_DTYPES[version].itemsize
+            file.truncate(end_of_complete_records)
+            file.seek(end_of_complete_records)
+
+        return BinaryAppender(file, version)
+
+    def is_outdated(self) -> bool:
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            return False
+        with self.open_file("rb") as file:
+            return self.read_header(file) < BINARY_VERSION
+
+    def upgrade(self):
+        self.check_writable()
+        records = self.read_arrays()  # Converted to the current layout as they are read
+        temporary_path = self.get_temporary_path()
+        temporary_path.unlink(missing_ok=True)  # Left behind if upgrading was interrupted, so would be appended to
+        with BinaryStorage(temporary_path).open_appender() as appender:
+            appender.append_records(records)
+        os.replace(temporary_path, self.path)
+
+    def read_arrays(self, offset: int | None = None, count: int | None = None) -> np.ndarray:
+        """ Loads the records in the file into a structured NumPy array, with the fields 'timestamp', 'download',
+        'upload', 'method', 'streams' and 'loss' (see RECORD_DTYPE). Each field can be accessed as a column, e.g.
+        array["download"]. Records from older versions are converted to the current layout.
+        The offset and count parameters work in the same way as for iter_readings. """
+        if offset is None:
+            offset = HEADER_STRUCT.size
+
+        with self.open_file("rb") as file:
+            version = self.read_header(file)
+            record_dtype = RECORD_DTYPES[version]
+            file.seek(offset)
+            if self.compression is not None:
+                records = self.read_compressed_records(file, record_dtype, count)
+            else:
+                # Only read complete records
+                end_of_records = HEADER_STRUCT.size + self.count_records() * record_dtype.itemsize
+                available = max(end_of_records - offset, 0) // record_dtype.itemsize
+                count = available if count is None else min(count, available)
+                records = np.fromfile(file, dtype=record_dtype, count=count)
+
+        return upgrade_records(records)
+
+    @staticmethod
+    def read_compressed_records(file, record_dtype: np.dtype, count: int | None) -> np.ndarray:
+        """ Reads up to count complete records (or every record, if count is None) from a compressed file, a chunk at a
+        time, since its size isn't known without decompressing it, and np.fromfile needs an uncompressed file. """
+        chunks = []
+        while count is None or count > 0:
+            wanted = BINARY_CHUNK_SIZE if count is None else min(count, BINARY_CHUNK_SIZE)
+            data = file.read(wanted * record_dtype.itemsize)
+            chunks.append(np.frombuffer(data, dtype=record_dtype, count=len(data) // record_dtype.itemsize))
+            if len(chunks[-1]) < wanted:
+                break
+            if count is not None:
+                count -= wanted
+        # Joining the chunks copies them, so the array can be changed, like one from np.fromfile
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=record_dtype)
+
+    def iter_readings(self, offset: int | None = None, count: int | None = None) -> Iterator[classes.Reading]:
+        offset = HEADER_STRUCT.size if offset is None else offset
+        record_size = self.get_record_size()
+
+        # Load the records in chunks, so that memory use doesn't grow with the size of the file
+        while count is None or count > 0:
+            chunk_size = BINARY_CHUNK_SIZE if count is None else min(count, BINARY_CHUNK_SIZE)
+            records = self.read_arrays(offset, chunk_size)
+            yield from classes.ReadingBatch.from_records(records)
+
+            if len(records) < chunk_size:  # Reached the end of the file
+                break
+            offset += len(records) * record_size
+            if count is not None:
+                count -= len(records)
+
+    def iter_readings_with_offsets(self, offset: int | None = None) -> Iterator[tuple[int, int, classes.Reading]]:
+        # Records are all the same size, so the offsets can be calculated rather than read
+        start = HEADER_STRUCT.size if offset is None else offset
+        record_size = self.get_record_size()
+        for reading in self.iter_readings(offset):
+            yield start, start + record_size, reading
+            start += record_size
+# End of binary storage
+
+
+def open_storage(path: Path | str) -> BaseStorage:
+    """ Returns the storage backend for the recording file at the path provided, chosen by the file's suffix.
+    Files with the binary suffix (constants.BINARY_RECORDING_SUFFIX) use BinaryStorage, all others use CSVStorage.
+    Compressed files are chosen by the suffix before the compression suffix, e.g. recording.bbr.gz uses BinaryStorage.
+    """
+    path = Path(path)
+    suffix = path.suffix if get_compression(path) is None else Path(path.stem).suffix
+    if suffix == BinaryStorage.suffix:
+        return BinaryStorage(path)
+    return CSVStorage(path)
+
+
+def convert_csv_to_binary(csv_path: Path | str, binary_path: Path | str) -> int:
+    """ Copies every reading in the CSV recording file at csv_path into the binary recording file at binary_path,
+    appending to it if it already exists. Returns the number of readings copied. """
+    count = 0
+    with BinaryStorage(binary_path).open_appender() as appender:
+        for reading in CSVStorage(csv_path).iter_readings():
+            appender.append(reading)
+            count += 1
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Converts a CSV recording file to the binary recording format.")
+    parser.add_argument("csv_path", type=Path)
+    parser.add_argument("binary_path", type=Path, nargs="?",
+                        help=f"defaults to csv_path with the suffix {constants.BINARY_RECORDING_SUFFIX}")
+    args = parser.parse_args()
+
+    output_path = args.binary_path or args.csv_path.with_suffix(constants.BINARY_RECORDING_SUFFIX)
+    print(f"Converted {convert_csv_to_binary(args.csv_path, output_path)} readings to {output_path}")
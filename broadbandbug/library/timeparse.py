@@ -0,0 +1,137 @@
+""" Contains parsers specialised for timestamps in the format used by recording files (constants.TIME_FORMAT, which is
+'%d/%m/%Y %H:%M:%S'), which are much faster than datetime.strptime. If TIME_FORMAT is changed, these must be changed
+too.
+
+parse_timestamp parses a single timestamp into a datetime. parse_timestamps parses a whole column of timestamps at once
+with NumPy, into seconds since the epoch (the same values as datetime.timestamp() would give).
+Both accept what strptime accepts for this format: 1 or 2 digit days, months, hours, minutes and seconds, and 4 digit
+years; anything else raises a ValueError. Seconds may also have a fractional part of 1 to 6 digits (e.g.
+'05/07/2023 09:03:02.250'), which is how the timestamps of latency readings are written (see format_timestamp).
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Sequence
+
+import numpy as np
+
+from . import constants
+
+# Matches a timestamp, with groups for the day, month, year, hour, minute and second (the same as strptime would match),
+# and the fractional part of the second, if any
+TIMESTAMP_PATTERN = re.compile(r"(\d\d?)/(\d\d?)/(\d{4}) (\d\d?):(\d\d?):(\d\d?)(?:\.(\d{1,6}))?", re.ASCII)
+
+# Positions of the separators in a zero-padded timestamp (e.g. '05/07/2023 09:03:02'), which is how they are written
+PADDED_LENGTH = 19
+SEPARATORS = {2: "/", 5: "/", 10: " ", 13: ":", 16: ":"}
+DIGIT_POSITIONS = [i for i in range(PADDED_LENGTH) if i not in SEPARATORS]
+PADDED_MILLISECONDS_LENGTH = PADDED_LENGTH + 4  # With milliseconds (e.g. '05/07/2023 09:03:02.250')
+
+
+def format_timestamp(timestamp: datetime, milliseconds: bool = False) -> str:
+    """ Formats a datetime in the format of constants.TIME_FORMAT, leaving out any fractional second, so it can still
+    be parsed with datetime.strptime.
+    :param milliseconds: set to True to add the milliseconds if the datetime has a fractional second (e.g. for
+    latency readings, which are taken seconds apart).
+    """
+    string = timestamp.strftime(constants.TIME_FORMAT)
+    if milliseconds and timestamp.microsecond:
+        string += f".{timestamp.microsecond // 1000:03d}"
+    return string
+
+
+def make_error(string: str) -> ValueError:
+    return ValueError(f"time data {string!r} does not match format {constants.TIME_FORMAT!r}")
+
+
+def parse_timestamp(string: str) -> datetime:
+    """ Parses a timestamp in the format of constants.TIME_FORMAT into a datetime. Raises a ValueError if the timestamp
+    is not in the right format, or is not a valid date or time (like datetime.strptime). """
+    match = TIMESTAMP_PATTERN.fullmatch(string)
+    if match is None:
+        raise make_error(string)
+    fraction = match.group(7) or "0"
+    try:
+        return datetime(*map(int, match.group(3, 2, 1, 4, 5, 6)), int(fraction.ljust(6, "0")))
+    except ValueError:
+        raise make_error(string) from None
+
+
+def parse_timestamps(strings: Sequence[str] | np.ndarray) -> np.ndarray:
+    """ Parses a sequence of timestamps in the format of constants.TIME_FORMAT into a float64 NumPy array of seconds
+    since the epoch, treating each timestamp as local time (like datetime.timestamp() does). The timestamps may also
+    be an array of ASCII bytes strings (dtype S), which is used as it is.
+    Raises a ValueError if any timestamp is not in the right format, or is not a valid date or time. """
+    if len(strings) == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    try:
+        encoded = np.array(strings, dtype=np.bytes_)
+    except UnicodeEncodeError:
+        raise ValueError("timestamps must only contain ASCII characters") from None
+
+    # Parse zero-padded timestamps (with or without milliseconds) together, and any others individually. A timestamp
+    # that isn't padded can have the same length as one that is, so the separators are checked to tell them apart.
+    lengths = np.char.str_len(encoded)
+    characters = encoded.view(np.uint8).reshape(len(encoded), encoded.itemsize)
+    if encoded.itemsize < PADDED_MILLISECONDS_LENGTH:
+        characters = np.pad(characters, ((0, 0), (0, PADDED_MILLISECONDS_LENGTH - encoded.itemsize)))
+    padded = np.all([characters[:, i] == ord(separator) for i, separator in SEPARATORS.items()], axis=0)
+    milliseconds = characters[:, PADDED_LENGTH + 1:PADDED_MILLISECONDS_LENGTH].astype(np.int64) - ord("0")
+    with_milliseconds = (padded & (lengths == PADDED_MILLISECONDS_LENGTH) & (characters[:, PADDED_LENGTH] == ord("."))
+                         & np.all((milliseconds >= 0) & (milliseconds <= 9), axis=1))
+    padded = (padded & (lengths == PADDED_LENGTH)) | with_milliseconds
+
+    naive_seconds = np.empty(len(encoded), dtype=np.int64)
+    fractions = np.zeros(len(encoded), dtype=np.float64)
+    if padded.any():
+        naive_seconds[padded] = parse_padded_timestamps(encoded[padded])
+    fractions[with_milliseconds] = (milliseconds[with_milliseconds] @ np.array([100, 10, 1])) / 1000
+    for i in np.flatnonzero(~padded).tolist():
+        string = strings[i].decode() if isinstance(strings[i], bytes) else strings[i]
+        since_1970 = parse_timestamp(string) - datetime(1970, 1, 1)
+        naive_seconds[i] = since_1970 // timedelta(seconds=1)
+        fractions[i] = since_1970.microseconds / 1_000_000
+
+    return convert_naive_to_epoch(naive_seconds) + fractions
+
+
+def parse_padded_timestamps(encoded: np.ndarray) -> np.ndarray:
+    """ Parses an array of ASCII encoded, zero-padded timestamps (as produced by parse_timestamps) into int64 seconds
+    since 01/01/1970 00:00:00, without considering time zones. Raises a ValueError if any timestamp is invalid. """
+    # View each timestamp as a row of characters
+    characters = encoded.view(np.uint8).reshape(len(encoded), encoded.itemsize)[:, :PADDED_LENGTH]
+
+    separators_valid = np.all([characters[:, i] == ord(separator) for i, separator in SEPARATORS.items()], axis=0)
+    digits = characters.astype(np.int64) - ord("0")
+    digits_valid = np.all((digits[:, DIGIT_POSITIONS] >= 0) & (digits[:, DIGIT_POSITIONS] <= 9), axis=1)
+
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 3] * 10 + digits[:, 4]
+    year = digits[:, 6] * 1000 + digits[:, 7] * 100 + digits[:, 8] * 10 + digits[:, 9]
+    hour = digits[:, 11] * 10 + digits[:, 12]
+    minute = digits[:, 14] * 10 + digits[:, 15]
+    second = digits[:, 17] * 10 + digits[:, 18]
+
+    valid = (separators_valid & digits_valid & (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)
+             & (hour < 24) & (minute < 60) & (second < 60))
+    if not valid.all():
+        raise make_error(encoded[np.argmin(valid)].decode())
+
+    # Calculate the date using NumPy's datetime64, then check the day exists in the month
+    months = (year - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (month - 1)
+    days_in_month = ((months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")).astype(np.int64)
+    if not (day <= days_in_month).all():
+        raise make_error(encoded[np.argmax(day > days_in_month)].decode())
+
+    dates = months.astype("datetime64[D]") + (day - 1)
+    return dates.astype("datetime64[s]").astype(np.int64) + hour * 3600 + minute * 60 + second
+
+
+def convert_naive_to_epoch(naive_seconds: np.ndarray) -> np.ndarray:
+    """ Converts seconds since 01/01/1970 00:00:00 in local time into seconds since the epoch, like
+    datetime.timestamp() does. The local time offset is only calculated once for each distinct hour, since it can only
+    change on the hour (for time zones where that isn't true, this will be slightly inaccurate around the change). """
+    hours, inverse = np.unique(naive_seconds // 3600, return_inverse=True)
+    offsets = np.array([(datetime(1970, 1, 1) + timedelta(hours=hour)).timestamp() - hour * 3600
+                        for hour in hours.tolist()], dtype=np.float64)
+    return naive_seconds + offsets[inverse]
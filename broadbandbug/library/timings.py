@@ -0,0 +1,122 @@
+""" Contains the timing instrumentation, which measures how long each phase of taking and recording a reading takes, so
+a slow reading can be traced to the phase that was slow (waiting for the bandwidth lease, the download test, writing to
+the recording file, and so on).
+
+Phases are timed with time.perf_counter, which is monotonic, so changes to the system clock don't affect them. Each
+recorder's durations are kept in a Histogram for each phase, in a TimingRegistry. Histograms have fixed buckets
+(constants.TIMING_BUCKETS), so they use the same small amount of memory however long the recorder runs.
+BaseRecorder and AsyncBaseRecorder time the phases of their recording loops; recorders can time their own sub-phases
+with time_phase, e.g.:
+    with self.time_phase("download"):
+        ...
+Use BaseRecorder.get_timings().snapshot() to get the statistics of every phase from the running process.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from copy import copy
+from threading import Lock
+from time import perf_counter
+from typing import Iterator
+
+from . import constants
+
+
+class Histogram:
+    """ Counts durations (in seconds) in buckets, and keeps their count, total, minimum, maximum and the latest one.
+    Not thread-safe by itself; TimingRegistry locks around it. """
+    def __init__(self, bounds: tuple[float, ...] = constants.TIMING_BUCKETS):
+        """ :param bounds: the upper bound of each bucket, in seconds, in ascending order. Durations longer than the
+        last go in an extra bucket. """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, seconds: float):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """ Returns an estimate of the duration that the fraction provided (e.g. 0.9) of durations were at most: the
+        upper bound of the bucket it falls in, limited to the range of durations seen. Returns 0 if there are none. """
+        if self.count == 0:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count > 0:
+                bound = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(max(bound, self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """ Returns the statistics of the durations, in seconds, as a dictionary. """
+        return {"count": self.count, "total": self.total, "mean": self.total / self.count if self.count else 0.0,
+                "min": self.min if self.count else 0.0, "max": self.max, "last": self.last,
+                "p50": self.percentile(0.5), "p90": self.percentile(0.9), "p99": self.percentile(0.99)}
+
+
+class TimingRegistry:
+    """ Keeps a Histogram of the durations of each phase, for each recorder. Thread-safe. """
+    def __init__(self, bounds: tuple[float, ...] = constants.TIMING_BUCKETS):
+        """ :param bounds: the buckets of the histograms (see Histogram). """
+        self.bounds = bounds
+        self._histograms: dict[str, dict[str, Histogram]] = {}  # By recorder identifier, then phase
+        self._lock = Lock()
+
+    def record(self, recorder: str, phase: str, seconds: float):
+        """ Adds a duration, in seconds, to the histogram of the recorder and phase provided. """
+        with self._lock:
+            phases = self._histograms.setdefault(recorder, {})
+            if phase not in phases:
+                phases[phase] = Histogram(self.bounds)
+            phases[phase].add(seconds)
+
+    @contextmanager
+    def time(self, recorder: str, phase: str) -> Iterator[None]:
+        """ A context manager that records how long its block took, for the recorder and phase provided. The duration
+        is recorded even if the block raises an error. """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(recorder, phase, perf_counter() - start)
+
+    def snapshot(self) -> dict[str, dict[str, dict]]:
+        """ Returns the statistics (see Histogram.summary) of every phase, by recorder identifier then phase. """
+        with self._lock:
+            return {recorder: {phase: histogram.summary() for phase, histogram in phases.items()}
+                    for recorder, phases in self._histograms.items()}
+
+    def get_histograms(self) -> dict[str, dict[str, Histogram]]:
+        """ Returns copies of the histograms, by recorder identifier then phase, e.g. to export their buckets. """
+        with self._lock:
+            copies = {}
+            for recorder, phases in self._histograms.items():
+                copies[recorder] = {}
+                for phase, histogram in phases.items():
+                    copies[recorder][phase] = copy(histogram)
+                    copies[recorder][phase].counts = list(histogram.counts)  # So they don't share the list of counts
+            return copies
+
+    def reset(self, recorder: str | None = None):
+        """ Forgets the durations of the recorder provided, or of every recorder if it is None. """
+        with self._lock:
+            if recorder is None:
+                self._histograms.clear()
+            else:
+                self._histograms.pop(recorder, None)
+
+
+def format_phases(durations: dict[str, float]) -> str:
+    """ Returns durations in seconds, by phase, as text for logging, longest first. """
+    return ", ".join(f"{phase} {seconds:.2f}s"
+                     for phase, seconds in sorted(durations.items(), key=lambda item: item[1], reverse=True))
@@ -0,0 +1,29 @@
+""" Contains the recorders, one module for each recording method.
+Recorder modules import heavy dependencies (speedtest, selenium), so use get_recorder_type to get a method's recorder,
+which only imports its module when it is used. """
+import importlib
+
+from broadbandbug.library import constants
+
+# The module and class name of the recorder for each recording method that can be recorded with. The Broadband Speed
+# Checker recorder (see the bsc module) isn't included until its page locators have been checked against the live site,
+# since each test would otherwise time out and be recorded as a failed (0/0) reading.
+RECORDER_TYPES = {
+    constants.RecordingMethod.SPEEDTEST_CLI: ("broadbandbug.recorders.speedtestcli", "SpeedtestCLIRecorder"),
+    constants.RecordingMethod.WHICH_WEBSITE: ("broadbandbug.recorders.which_website", "WhichWebsiteRecorder"),
+    constants.RecordingMethod.LATENCY: ("broadbandbug.recorders.latency", "LatencyRecorder"),
+}
+
+
+def get_recorder_type(method: constants.RecordingMethod) -> type:
+    """ Imports and returns the recorder class for the recording method provided.
+        May raise ImportError if the recorder's dependencies aren't installed. """
+    module_name, class_name = RECORDER_TYPES[method]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_recorder_kwargs(method: constants.RecordingMethod, browser: constants.Browser) -> dict:
+    """ Returns the keyword arguments the recorder for the recording method provided needs, besides its identifier. """
+    if method in constants.METHODS_USING_BROWSER:
+        return {"browser": browser}
+    return {}
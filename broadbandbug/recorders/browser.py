@@ -0,0 +1,266 @@
+""" Contains what browser based recorders (constants.METHODS_USING_BROWSER) share: a pool of warm headless web drivers,
+waits with deadlines, and the BrowserRecorder base class.
+
+Starting a browser takes seconds, so drivers are kept open in a DriverPool and reused for each test, rather than set up
+again every time. Every browser recorder using the same browser shares one pool, which is closed once none of them are
+running.
+Waits use selenium's WebDriverWait, which sleeps between checks rather than spinning, so waiting for a test to finish
+doesn't use a CPU core that the test itself needs. Every wait has a deadline, and stops early if the recorder is told
+to stop.
+"""
+from datetime import datetime
+from queue import Empty, LifoQueue
+from threading import Event, Lock
+from typing import Callable
+from urllib.parse import urlsplit
+from weakref import WeakSet
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+
+from broadbandbug.library import constants
+from broadbandbug.library.classes import BaseRecorder, Reading
+
+
+class RecorderStopped(Exception):
+    """ Raised by wait_for when the recorder is told to stop while waiting. """
+
+
+def make_driver(browser: constants.Browser, headless: bool = constants.BROWSER_HEADLESS) -> webdriver.Remote:
+    """ Starts a web driver for the browser provided.
+        May raise WebDriverException if the browser can't be started.
+    :param browser: the browser to start.
+    :param headless: set to True to start the browser without a window.
+    """
+    match browser:
+        case constants.Browser.EDGE:
+            options, driver_type = webdriver.EdgeOptions(), webdriver.Edge
+        case constants.Browser.CHROME:
+            options, driver_type = webdriver.ChromeOptions(), webdriver.Chrome
+        case _:
+            raise ValueError(f"unsupported browser: {browser}")
+
+    if headless:
+        options.add_argument("--headless=new")
+    options.add_argument("--window-size=1280,1024")  # Headless windows are small, which some sites lay out differently
+    return driver_type(options=options)
+
+
+def wait_for(driver, condition: Callable, timeout: float, stop_event: Event | None = None):
+    """ Waits until condition(driver) returns something truthy, and returns it.
+        Raises TimeoutException if timeout passes first, or RecorderStopped if stop_event is set first.
+    :param driver: the web driver, passed to condition.
+    :param condition: a function taking the driver, such as one of selenium's expected_conditions.
+    :param timeout: the most time to wait, in seconds.
+    :param stop_event: an event that stops the wait early when set.
+    """
+    def condition_or_stopped(waiting_driver):
+        if stop_event is not None and stop_event.is_set():
+            return True
+        return condition(waiting_driver)
+
+    result = WebDriverWait(driver, timeout, poll_frequency=constants.BROWSER_POLL_INTERVAL).until(condition_or_stopped)
+    if stop_event is not None and stop_event.is_set():
+        raise RecorderStopped()
+    return result
+
+
+class DriverPool:
+    """ A pool of open web drivers, which are reused rather than started for each test. Thread-safe. """
+    def __init__(self, browser: constants.Browser, size: int = constants.DRIVER_POOL_SIZE,
+                 factory: Callable = make_driver):
+        """ :param browser: the browser the drivers use.
+        :param size: the most drivers open at once.
+        :param factory: starts a driver, given the browser.
+        """
+        self.browser = browser
+        self.size = size
+        self.factory = factory
+        self.closed = False
+
+        self._idle = LifoQueue()  # Most recently used first, so drivers that aren't needed stay idle
+        self._lock = Lock()
+        self._open = 0  # How many drivers are open, idle or not
+
+    def warm(self, count: int = 1):
+        """ Starts drivers until at least count are idle (or size are open), so the first tests don't wait for them.
+            May raise WebDriverException if a browser can't be started. """
+        while self._idle.qsize() < count:
+            with self._lock:
+                if self.closed or self._open >= self.size:
+                    return
+                self._open += 1
+            self._idle.put(self._start_driver())
+
+    def _start_driver(self):
+        try:
+            return self.factory(self.browser)
+        except BaseException:
+            with self._lock:
+                self._open -= 1
+            raise
+
+    def acquire(self, timeout: float | None = None):
+        """ Returns an idle driver, starting a new one if there are none and fewer than size are open, otherwise waiting
+        up to timeout seconds for one to be released. Release it with release once done with.
+            Raises TimeoutError if no driver is released in time, and may raise WebDriverException if a browser can't
+            be started. """
+        if self.closed:
+            raise RuntimeError("driver pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+
+        with self._lock:
+            start_new = self._open < self.size
+            if start_new:
+                self._open += 1
+        if start_new:
+            return self._start_driver()
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except Empty:
+            raise TimeoutError("no web driver was released in time") from None
+
+    def release(self, driver, broken: bool = False):
+        """ Returns a driver from acquire to the pool.
+        :param broken: set to True if the driver stopped working (e.g. the browser crashed), so it is closed rather than
+        reused.
+        """
+        if broken or self.closed:
+            self._quit(driver)
+        else:
+            self._idle.put(driver)
+
+    def _quit(self, driver):
+        with self._lock:
+            self._open -= 1
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass  # It is being closed anyway
+
+    def close(self):
+        """ Closes every idle driver. Drivers still in use are closed when they are released. """
+        self.closed = True
+        while True:
+            try:
+                self._quit(self._idle.get_nowait())
+            except Empty:
+                return
+
+    @property
+    def open_count(self) -> int:
+        return self._open
+
+
+class BrowserRecorder(BaseRecorder):
+    """ A base class for recorders that take readings with a speed test website, meant to be extended.
+    Subclasses set method and website_url, and override setup_driver and measure (rather than process).
+    """
+    method: constants.RecordingMethod
+    website_url: str  # The address of the speed test website
+
+    # The driver pools shared by every running browser recorder, by browser (see acquire_driver_pool)
+    _pools_lock = Lock()
+    _pools: dict[constants.Browser, DriverPool] = {}
+    _pool_users: dict[constants.Browser, int] = {}
+
+    def __init__(self, identifier: str = "recorder", browser: constants.Browser = constants.Browser.EDGE):
+        """ :param identifier: a string identifying the recorder.
+        :param browser: the browser used to take readings.
+        """
+        super().__init__(identifier)
+        self.browser = browser
+        self.driver_pool: DriverPool | None = None
+        # The drivers setup_driver has been used on. Drivers are held weakly, so a driver that another recorder broke
+        # (and the pool quit) drops out, rather than its replacement being mistaken for it.
+        self._set_up_drivers = WeakSet()
+
+    # Driver pool related functions
+    @staticmethod
+    def acquire_driver_pool(browser: constants.Browser) -> DriverPool:
+        """ Returns the driver pool for the browser provided, creating it if no recorder is using it. Call
+        release_driver_pool once it is no longer needed. """
+        with BrowserRecorder._pools_lock:
+            if BrowserRecorder._pool_users.get(browser, 0) == 0:
+                BrowserRecorder._pools[browser] = DriverPool(browser)
+                BrowserRecorder._pool_users[browser] = 0
+            BrowserRecorder._pool_users[browser] += 1
+            return BrowserRecorder._pools[browser]
+
+    @staticmethod
+    def release_driver_pool(browser: constants.Browser):
+        """ Indicates that a pool from acquire_driver_pool is no longer needed, closing it if no recorder needs it. """
+        with BrowserRecorder._pools_lock:
+            BrowserRecorder._pool_users[browser] -= 1
+            if BrowserRecorder._pool_users[browser] == 0:
+                BrowserRecorder._pools.pop(browser).close()
+    # End of driver pool related functions
+
+    def prepare(self):
+        self.driver_pool = BrowserRecorder.acquire_driver_pool(self.browser)
+        try:
+            self.driver_pool.warm()
+        except WebDriverException as e:
+            # Not fatal here, since process tries again (and records the failure) for each reading
+            BaseRecorder.get_logger().warning(f"Couldn't start {self.browser.value}: {e!r}")
+
+    def process(self) -> Reading | None:
+        try:
+            with self.time_phase("driver acquire"):
+                driver = self.driver_pool.acquire(constants.BROWSER_TEST_TIMEOUT)
+        except (TimeoutError, WebDriverException) as e:
+            # The browser couldn't be started, which has nothing to do with the connection, so no reading is taken
+            BaseRecorder.get_logger().warning(f"Couldn't get a {self.browser.value} driver: {e!r}")
+            self.stop_event.wait(constants.TIMEOUT)
+            return None
+
+        broken = False
+        try:
+            if driver not in self._set_up_drivers:
+                with self.time_phase("driver setup"):
+                    self.setup_driver(driver)
+                self._set_up_drivers.add(driver)
+            with self.time_phase("measure"):
+                download, upload = self.measure(driver)
+            return Reading(download, upload, datetime.now(), self.method)
+        except RecorderStopped:
+            return None
+        except (TimeoutException, WebDriverException, ValueError, IndexError) as e:  # Including unreadable results
+            broken = True  # The page may be left part way through a test, so start afresh next time
+            self._set_up_drivers.discard(driver)
+            return self.record_failure(e)
+        finally:
+            self.driver_pool.release(driver, broken)
+
+    def record_failure(self, error: Exception) -> Reading:
+        """ Logs a failed test, and returns a reading of 0, since the test most likely failed because the connection is
+        down. The recording loop then checks whether it is, waiting for it to come back if so. """
+        BaseRecorder.get_logger().warning(f"{self.method.value} test failed: {error!r}")
+        return Reading(0, 0, datetime.now(), self.method)
+
+    def get_probe_addresses(self) -> list[tuple[str, int]]:
+        """ Probes the speed test website first, since it is on the path being tested. """
+        website = urlsplit(self.website_url)
+        return [(website.hostname, website.port or 443)] + super().get_probe_addresses()
+
+    def cleanup(self):
+        BrowserRecorder.release_driver_pool(self.browser)
+        self.driver_pool = None
+        self._set_up_drivers.clear()
+
+    # Functions to override
+    def setup_driver(self, driver):
+        """ Called the first time the recorder uses a driver, e.g. to accept cookies. For overriding. """
+        pass
+
+    def measure(self, driver) -> tuple[float, float]:
+        """ Runs a speed test with the driver, returning the download and upload speeds. For overriding; use wait_for
+        with self.stop_event for every wait. This is for demonstration purposes only. """
+        BaseRecorder.get_logger().warning("USING BASE CLASS, WHICH IS FOR TESTING PURPOSES ONLY")
+        return 1, 2
+    # End of functions to override
@@ -0,0 +1,38 @@
+""" Contains the recorder for the Broadband Speed Checker website.
+If the site's layout changes, update the locators below; until then, each test fails with a logged TimeoutException.
+The locators haven't been checked against the live site yet, so this recorder can't be selected (see RECORDER_TYPES).
+"""
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
+
+from broadbandbug.library import constants
+from broadbandbug.recorders.browser import BrowserRecorder, wait_for
+
+WEBSITE_URL = "https://www.broadbandspeedchecker.co.uk"
+ACCEPT_COOKIES_BUTTON = (By.CSS_SELECTOR, "button.fc-cta-consent")
+START_BUTTON = (By.ID, "start-test")
+DOWNLOAD_RESULT = (By.ID, "download-speed")
+UPLOAD_RESULT = (By.ID, "upload-speed")
+TEST_FINISHED = (By.ID, "test-complete")
+
+
+class BSCRecorder(BrowserRecorder):
+    """ Takes readings with the Broadband Speed Checker website. """
+    website_url = WEBSITE_URL
+    method = constants.RecordingMethod.BSC
+
+    def setup_driver(self, driver):
+        """ Sets up the website by accepting cookies. """
+        driver.get(WEBSITE_URL)
+        wait_for(driver, expected_conditions.element_to_be_clickable(ACCEPT_COOKIES_BUTTON),
+                 constants.BROWSER_SETUP_TIMEOUT, self.stop_event).click()
+
+    def measure(self, driver) -> tuple[float, float]:
+        driver.get(WEBSITE_URL)
+        wait_for(driver, expected_conditions.element_to_be_clickable(START_BUTTON),
+                 constants.BROWSER_SETUP_TIMEOUT, self.stop_event).click()
+
+        # The results are only final once the test has finished
+        wait_for(driver, expected_conditions.visibility_of_element_located(TEST_FINISHED),
+                 constants.BROWSER_TEST_TIMEOUT, self.stop_event)
+        return float(driver.find_element(*DOWNLOAD_RESULT).text), float(driver.find_element(*UPLOAD_RESULT).text)
@@ -1,6 +1,4 @@
 """ Stores general functions to assist with recorders. """
-from selenium import webdriver
-
 """from selenium.webdriver.edge.service import Service as EdgeService
 from webdriver_manager.microsoft import EdgeChromiumDriverManager
 
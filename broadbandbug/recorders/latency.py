@@ -0,0 +1,89 @@
+""" Contains the latency recorder, which samples latency, jitter and packet loss every few seconds.
+
+Throughput tests take tens of seconds and use a lot of data, so they can only be run now and then. Between them, the
+latency recorder times TCP connects (the time for the handshake is one round trip), which send a handful of small
+packets, so it can run all the time without affecting the connection, or the throughput tests.
+Each sample times constants.LATENCY_PROBES connects, and records:
+    latency: the mean connect time of the probes that connected, in milliseconds (stored as the reading's download).
+    jitter: the mean difference between the connect times of consecutive probes, in milliseconds (stored as upload).
+    loss: the fraction of probes that failed to connect.
+"""
+import socket
+from datetime import datetime
+from time import perf_counter
+
+from broadbandbug.library import constants
+from broadbandbug.library.classes import BaseRecorder, Reading
+
+
+def time_connect(address: tuple[str, int], timeout: float = constants.OUTAGE_PROBE_TIMEOUT) -> float | None:
+    """ Returns how long a TCP connection to the address provided took to open, in milliseconds, or None if it
+    couldn't be opened within timeout seconds. """
+    start = perf_counter()
+    try:
+        with socket.create_connection(address, timeout):
+            return (perf_counter() - start) * 1000
+    except OSError:
+        return None
+
+
+def summarise_probes(times: list[float | None]) -> tuple[float, float, float]:
+    """ Returns the latency, jitter and loss of a sample, given the connect time of each probe in milliseconds (or None
+    for probes that failed). Latency and jitter are 0 if too few probes connected to calculate them. """
+    connected = [time for time in times if time is not None]
+    loss = 1 - len(connected) / len(times) if times else 1.0
+    latency = sum(connected) / len(connected) if connected else 0.0
+    differences = [abs(later - earlier) for earlier, later in zip(connected, connected[1:])]
+    jitter = sum(differences) / len(differences) if differences else 0.0
+    return latency, jitter, loss
+
+
+class LatencyRecorder(BaseRecorder):
+    """ Samples latency, jitter and packet loss (see the module documentation). """
+    def __init__(self, identifier: str = "recorder", targets: tuple[tuple[str, int], ...] = constants.LATENCY_TARGETS,
+                 interval: float = constants.LATENCY_INTERVAL, probes: int = constants.LATENCY_PROBES):
+        """ :param identifier: a string identifying the recorder.
+        :param targets: the (host, port) addresses to connect to. Probes take turns between them, so one slow or
+        unreachable address doesn't count as loss on its own.
+        :param interval: seconds between samples.
+        :param probes: connects timed for each sample.
+        """
+        super().__init__(identifier)
+        if probes < 1:
+            raise ValueError("probes must be at least 1")
+        self.targets = targets
+        self.interval = interval
+        self.probes = probes
+        self._next_sample = 0.0  # perf_counter() when the next sample is due
+
+    def take_reading(self) -> Reading | None:
+        # The probes use hardly any bandwidth, so don't wait for the bandwidth lease; latency measured during another
+        # recorder's speed test shows how the connection copes under load
+        with self.time_phase("process"):
+            return self.process()
+
+    def wait_for_next_reading(self):
+        # Wait until the next sample is due, stopping straight away if told to. Timed as a phase of its own, so the
+        # process and reading timings only include the probes.
+        with self.time_phase("interval wait"):
+            self.stop_event.wait(max(self._next_sample - perf_counter(), 0))
+
+    def process(self) -> Reading | None:
+        self._next_sample = perf_counter() + self.interval
+
+        times = []
+        with self.time_phase("probes"):
+            for i in range(self.probes):
+                if i > 0 and self.stop_event.wait(constants.LATENCY_PROBE_SPACING):
+                    return None
+                times.append(time_connect(self.targets[i % len(self.targets)]))
+
+        latency, jitter, loss = summarise_probes(times)
+        return Reading(latency, jitter, datetime.now(), constants.RecordingMethod.LATENCY, loss=loss)
+
+    def is_failed_reading(self, reading: Reading) -> bool:
+        # A jitter of 0 is a perfectly steady connection, not a failure; only losing every probe is
+        return reading.loss == 1
+
+    def get_probe_addresses(self) -> list[tuple[str, int]]:
+        return list(self.targets) + super().get_probe_addresses()
@@ -0,0 +1,123 @@
+""" Contains the speedtest server cache, which saves the speedtest.net servers ranked by latency to a file, so that
+speedtest cli recorders can start without downloading the server list and testing the latency of each server.
+
+Ranking is only redone once the cache is older than constants.SERVER_CACHE_TTL, and then in a background thread, while
+the old ranking is still used. When a recorder chooses a server, the servers are tried in order of latency, so if the
+best server stops responding, the next best is used.
+"""
+import json
+from pathlib import Path
+from threading import Lock, Thread
+from time import time
+
+import speedtest
+
+from broadbandbug.library import constants
+from broadbandbug.library.classes import BaseRecorder
+
+# speedtest-cli counts each failed latency test as an hour, so any server with a latency this high failed at least one
+UNREACHABLE_LATENCY_MS = 600_000
+
+
+class ServerCache:
+    """ The ranked speedtest servers saved in a cache file. Thread-safe. """
+    def __init__(self, path: Path | str = constants.SERVER_CACHE_PATH, ttl: float = constants.SERVER_CACHE_TTL):
+        """ :param path: path to the cache file, which is created if it doesn't exist.
+        :param ttl: how long a ranking is used before it is redone, in seconds.
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.servers: list[dict] = []  # In order of latency, lowest first
+        self.ranked_at: float | None = None  # time.time() when the servers were ranked
+
+        self._lock = Lock()
+        self._rank_thread: Thread | None = None
+        self.load()
+
+    def load(self):
+        """ Loads the servers from the cache file, if it exists. A file that can't be read is ignored. """
+        try:
+            with open(self.path, "r") as cache_file:
+                data = json.load(cache_file)
+            servers, ranked_at = data["servers"], float(data["ranked_at"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            self.servers, self.ranked_at = servers, ranked_at
+
+    def save(self):
+        """ Saves the servers to the cache file, replacing it in one step so that it is never partly written. """
+        with self._lock:
+            data = {"ranked_at": self.ranked_at, "servers": self.servers}
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary_path, "w") as cache_file:
+            json.dump(data, cache_file)
+        temporary_path.replace(self.path)
+
+    def is_stale(self) -> bool:
+        """ Returns True if the servers have never been ranked, or were ranked longer than ttl ago. """
+        return self.ranked_at is None or time() - self.ranked_at > self.ttl
+
+    def rank(self, speedtest_obj: speedtest.Speedtest, limit: int = constants.SERVER_CACHE_SIZE):
+        """ Downloads the server list, tests the latency of the closest servers, and saves them to the cache in order
+        of latency. This is slow, so is done in the background by choose_server when the cache is stale.
+        :param speedtest_obj: used to find and test the servers.
+        :param limit: how many of the closest servers are tested and saved.
+        """
+        ranked = []
+        speedtest_obj.closest.clear()  # Otherwise servers found before are included, and limit is ignored
+        for server in speedtest_obj.get_closest_servers(limit):
+            try:
+                ranked.append(dict(speedtest_obj.get_best_server([server])))
+            except speedtest.SpeedtestException:
+                continue
+        ranked.sort(key=lambda tested: tested["latency"])
+
+        with self._lock:
+            self.servers, self.ranked_at = ranked, time()
+        self.save()
+
+    def rank_in_background(self):
+        """ Ranks the servers in a background thread with its own Speedtest object, unless that is already happening. """
+        with self._lock:
+            if self._rank_thread is not None and self._rank_thread.is_alive():
+                return
+            self._rank_thread = Thread(target=self._rank_with_new_speedtest, name="speedtest server ranking",
+                                       daemon=True)
+            self._rank_thread.start()
+
+    def _rank_with_new_speedtest(self):
+        try:
+            self.rank(speedtest.Speedtest(secure=True))
+        except (speedtest.SpeedtestException, OSError) as e:
+            BaseRecorder.get_logger().warning(f"Ranking speedtest servers failed: {e!r}")
+
+    def choose_server(self, speedtest_obj: speedtest.Speedtest, exclude: dict | None = None) -> dict:
+        """ Sets the server speedtest_obj tests with to the best cached server that responds, and returns it. If none of
+        the cached servers respond (or there are none), the servers are ranked first. If the cache is stale, it is
+        ranked again in the background.
+            May raise speedtest.SpeedtestBestServerFailure if no server responds.
+        :param speedtest_obj: the Speedtest object to set the server of.
+        :param exclude: a server not to choose (e.g. one that just failed), unless no other server responds.
+        """
+        with self._lock:
+            servers = list(self.servers)
+        if self.is_stale() and servers:
+            self.rank_in_background()
+
+        # Try the cached servers in order of latency, leaving the excluded server until last
+        if exclude is not None:
+            servers.sort(key=lambda server: server["id"] == exclude["id"])
+        for server in servers:
+            try:
+                chosen = speedtest_obj.get_best_server([dict(server)])  # Copied, since it is changed
+            except speedtest.SpeedtestException:
+                continue
+            if chosen["latency"] < UNREACHABLE_LATENCY_MS:
+                return chosen
+
+        # No cached server responded, so there's nothing better to do than rank them again now
+        self.rank(speedtest_obj)
+        with self._lock:
+            servers = list(self.servers)
+        return speedtest_obj.get_best_server(servers)
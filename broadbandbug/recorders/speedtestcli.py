@@ -1,42 +1,102 @@
-from datetime import datetime, timedelta
-from time import sleep
+from datetime import datetime
+from typing import Callable
 
 import speedtest
 
 from broadbandbug.library.classes import Reading, BaseRecorder
-from broadbandbug.library.constants import RecordingMethod, TIMEOUT
+from broadbandbug.library.constants import (RecordingMethod, SPEEDTEST_STREAMS, SPEEDTEST_MAX_STREAMS,
+                                            SPEEDTEST_CALIBRATION_GAIN)
 from broadbandbug.recorders.common import convert_to_mbs
+from broadbandbug.recorders.speedtest_servers import ServerCache
+
+
+def choose_stream_count(measure: Callable[[int], float], max_streams: int = SPEEDTEST_MAX_STREAMS,
+                        min_gain: float = SPEEDTEST_CALIBRATION_GAIN) -> int:
+    """ Finds how many parallel streams are needed to saturate the connection: measures the speed with 1 stream, then
+    keeps doubling the streams until the speed stops improving by at least min_gain (a fraction, e.g. 0.1 for 10%).
+    :param measure: a function that measures the speed using the number of streams provided.
+    :param max_streams: the most streams to try.
+    :param min_gain: how much faster doubling the streams must be for the extra streams to be used.
+    :return: the number of streams that gave the best speed before it stopped improving.
+    """
+    streams = 1
+    best_speed = measure(streams)
+    while streams * 2 <= max_streams:
+        speed = measure(streams * 2)
+        if speed < best_speed * (1 + min_gain):
+            break
+        streams, best_speed = streams * 2, speed
+    return streams
 
 
 class SpeedtestCLIRecorder(BaseRecorder):
-    def __init__(self, identifier: str = "recorder"):
+    def __init__(self, identifier: str = "recorder", streams: int | None = SPEEDTEST_STREAMS,
+                 server_cache: ServerCache | None = None):
+        """ :param identifier: a string identifying the recorder.
+        :param streams: how many parallel streams to use for each test, or None to find the number of streams that
+        saturates the connection before the first test (see choose_stream_count). The number used is recorded with
+        each reading.
+        :param server_cache: the cache of ranked speedtest servers to choose a server from. Set to None to use the
+        default cache file.
+        """
         super().__init__(identifier)
+        if streams is not None and streams < 1:
+            raise ValueError("streams must be at least 1")
+        self.streams = streams
+        self.server_cache = server_cache or ServerCache()
         self.speedtest_obj = speedtest.Speedtest(secure=True)
-        self.speedtest_obj.get_best_server([])
+        # Uses the cached servers, so this is quick unless the cache is empty
+        self.server = self.server_cache.choose_server(self.speedtest_obj)
+
+    def calibrate(self) -> int:
+        """ Finds and returns the number of streams that saturates the connection, using download tests. """
+        self.get_logger().info("Calibrating number of streams...")
+        streams = choose_stream_count(lambda streams: self.speedtest_obj.download(threads=streams))
+        self.get_logger().info(f"Using {streams} streams.")
+        return streams
 
     def process(self):
-        # Perform speed test
-        self.speedtest_obj.download(threads=1)  # Using None for threads breaks stuff. It works like this.
+        # Keep the server ranking up to date, without delaying the reading
+        if self.server_cache.is_stale():
+            self.server_cache.rank_in_background()
+
+        # Calibrate here rather than in prepare, so other recorders can't interfere (see BaseRecorder.take_reading)
+        if self.streams is None:
+            with self.time_phase("calibrate"):
+                self.streams = self.calibrate()
+            if self.stop_event.is_set(): return
+
+        # Perform speed test. The number of streams must always be given, since leaving it as None uses the number in
+        # the speedtest server's configuration, which isn't always usable.
+        with self.time_phase("download"):
+            self.speedtest_obj.download(threads=self.streams)
         if self.stop_event.is_set(): return  # Causes the speedtest to stop where possible, in a controlled way
-        self.speedtest_obj.upload(threads=1)
+        with self.time_phase("upload"):
+            self.speedtest_obj.upload(threads=self.streams)
 
         # Make reading
         results = self.speedtest_obj.results
         reading = Reading(convert_to_mbs(results.download), convert_to_mbs(results.upload), datetime.now(),
-                          RecordingMethod.SPEEDTEST_CLI)
+                          RecordingMethod.SPEEDTEST_CLI, self.streams)
 
-        # If the connection dies, wait for some time (otherwise will spam with zeroes)
+        # If the test failed, the server may have stopped working, so try another next time. If the connection is down
+        # instead, the recording loop waits until it comes back (see BaseRecorder.wait_out_outage).
         if results.download == 0 or results.upload == 0:
-            self.get_logger().warning("Connection may be down. Timing out.")
-            # Rather than using sleep(30), use while loop that repeatedly compares current time to when the loop started,
-            # that breaks when the recorder is told to stop
-            t1 = datetime.now()
-            while datetime.now() - t1 < timedelta(seconds=TIMEOUT):
-                sleep(1)
-
-                # Stop timeout if told to stop
-                if self.stop_event.is_set():
-                    self.get_logger().info("Interrupting timeout.")
-                    break
+            self.get_logger().warning("Connection may be down.")
+            with self.time_phase("change server"):
+                self.change_server()
 
         return reading
+
+    def get_probe_addresses(self) -> list[tuple[str, int]]:
+        """ Probes the speedtest server first, since it is on the path being tested. """
+        host, _, port = self.server["host"].rpartition(":")
+        return [(host, int(port))] + super().get_probe_addresses()
+
+    def change_server(self):
+        """ Switches to the next best server that responds, in case the current one has stopped working. Keeps the
+        current server if no other server responds (e.g. because the connection is down). """
+        try:
+            self.server = self.server_cache.choose_server(self.speedtest_obj, exclude=self.server)
+        except speedtest.SpeedtestException:
+            self.get_logger().warning("No speedtest server responded.")
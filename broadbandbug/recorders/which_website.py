@@ -1,68 +1,49 @@
-from datetime import datetime
-from time import sleep
-
-from broadbandbug.library.classes import Reading
-from broadbandbug.library.constants import TIME_FORMAT, RecordingMethod
-METHOD_WHICHWEBSITE = RecordingMethod.WHICH_WEBSITE
-
+""" Contains the recorder for the Which? broadband speed test website. """
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.support import expected_conditions
 
+from broadbandbug.library import constants
+from broadbandbug.recorders.browser import BrowserRecorder, wait_for
 
-def setupWebsite(driver):
-    """ Sets up the website for performSpeedTest by accepting cookies """
-    driver.get("https://broadbandtest.which.co.uk")
+WEBSITE_URL = "https://broadbandtest.which.co.uk"
 
-    # Accept cookies
-    accept_cookies_btn = driver.find_element(By.ID, "onetrust-accept-btn-handler")
-    while not accept_cookies_btn.is_displayed():
-        pass
-    accept_cookies_btn.click()
 
+class WhichWebsiteRecorder(BrowserRecorder):
+    """ Takes readings with the Which? broadband speed test website. """
+    website_url = WEBSITE_URL
+    method = constants.RecordingMethod.WHICH_WEBSITE
 
-def performSpeedTest(driver):
-    """ Uses a webdriver with a setup window for the Which? broadband speedtest website to get a result """
-    download = 0
-    upload = 0
-    try:
-        driver.get("https://broadbandtest.which.co.uk")
+    def setup_driver(self, driver):
+        """ Sets up the website by accepting cookies. """
+        driver.get(WEBSITE_URL)
+        accept_cookies_btn = wait_for(driver, expected_conditions.element_to_be_clickable(
+            (By.ID, "onetrust-accept-btn-handler")), constants.BROWSER_SETUP_TIMEOUT, self.stop_event)
+        accept_cookies_btn.click()
 
-        # Find start button
-        start_btn = driver.find_element(By.NAME, "start")
-
-        # Find the "Find a better broadband deal" button
-        find_btn = driver.find_element(By.NAME, "find")
+    def measure(self, driver) -> tuple[float, float]:
+        driver.get(WEBSITE_URL)
 
         # Wait for start button to appear and click it
-        while not start_btn.is_displayed():
-            pass
+        start_btn = wait_for(driver, expected_conditions.element_to_be_clickable((By.NAME, "start")),
+                             constants.BROWSER_SETUP_TIMEOUT, self.stop_event)
         start_btn.click()
 
         # Wait for website to complete speedtest, by waiting for the "Find a better broadband deal" button to appear
-        while not find_btn.is_displayed():
-            pass
+        wait_for(driver, expected_conditions.visibility_of_element_located((By.NAME, "find")),
+                 constants.BROWSER_TEST_TIMEOUT, self.stop_event)
 
         # Get the results from the speedtest
         values = driver.find_elements(By.NAME, "value")
-
-        download = values[1].text
-        upload = values[2].text
-
-    except WebDriverException:
-        download = 0
-        upload = 0
-        # Delay next check
-        sleep(30)
-
-    finally:
-        timestamp = datetime.now().strftime(TIME_FORMAT)
-        return Reading(download, upload, timestamp, METHOD_WHICHWEBSITE)
+        return float(values[1].text), float(values[2].text)
 
 
 if __name__ == "__main__":
-    from broadbandbug.recorders.common import makeChromeWebDriver
-
-    wd = makeChromeWebDriver()
-    setupWebsite(wd)
-    while True:
-        print(performSpeedTest(wd))
+    from time import sleep
+    from threading import Thread
+
+    recorder = WhichWebsiteRecorder("Which? test")
+    subscription = recorder.get_readings_bus().subscribe()
+    Thread(target=recorder.recording_loop).start()
+    sleep(300)
+    recorder.send_stop_signal()
+    print(subscription.get_many())
@@ -0,0 +1,177 @@
+""" Contains all testing functions for the browser recorders. No browser is started; fake drivers are used instead. """
+from threading import Event, Thread
+from time import monotonic, sleep
+
+from pytest import raises
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+
+from ..library import classes
+from ..library import constants
+from ..recorders import browser
+from ..recorders.which_website import WhichWebsiteRecorder
+
+
+class FakeElement:
+    def __init__(self, text="", displayed=True):
+        self.text = text
+        self.displayed = displayed
+        self.clicks = 0
+
+    def is_displayed(self):
+        return self.displayed
+
+    def is_enabled(self):
+        return True
+
+    def click(self):
+        self.clicks += 1
+
+
+class FakeDriver:
+    """ Stands in for a web driver showing the Which? website, where the test finishes after finish_after checks. """
+    def __init__(self, browser_used=None, finish_after=3):
+        self.elements = {"onetrust-accept-btn-handler": FakeElement(), "start": FakeElement(),
+                         "find": FakeElement(displayed=False)}
+        self.values = [FakeElement("0"), FakeElement("72.5"), FakeElement("18.25")]
+        self.finish_after = finish_after
+        self.quit_count = 0
+        self.pages = []
+
+    def get(self, url):
+        self.pages.append(url)
+
+    def find_element(self, by, value):
+        if value == "find":
+            self.finish_after -= 1
+            self.elements["find"].displayed = self.finish_after <= 0
+        return self.elements[value]
+
+    def find_elements(self, by, value):
+        assert by == By.NAME and value == "value"
+        return self.values
+
+    def quit(self):
+        self.quit_count += 1
+
+
+def test_wait_for(monkeypatch):
+    monkeypatch.setattr(constants, "BROWSER_POLL_INTERVAL", 0.01)
+    checks = []
+
+    def ready_on_third_check(driver):
+        checks.append(monotonic())
+        return len(checks) >= 3 and "ready"
+
+    assert browser.wait_for(FakeDriver(), ready_on_third_check, 5) == "ready"
+    assert checks[-1] - checks[0] >= 0.02  # It slept between checks, rather than spinning
+
+    with raises(TimeoutException):
+        browser.wait_for(FakeDriver(), lambda driver: False, 0.05)
+
+    stop_event = Event()
+    Thread(target=lambda: (sleep(0.05), stop_event.set())).start()
+    start = monotonic()
+    with raises(browser.RecorderStopped):
+        browser.wait_for(FakeDriver(), lambda driver: False, 60, stop_event)
+    assert monotonic() - start < 5
+
+
+def test_driver_pool():
+    pool = browser.DriverPool(constants.Browser.EDGE, size=2, factory=FakeDriver)
+    pool.warm()
+    assert pool.open_count == 1
+
+    first = pool.acquire()
+    second = pool.acquire()  # Started, since there is space in the pool
+    assert first is not second and pool.open_count == 2
+    with raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+
+    pool.release(first)
+    assert pool.acquire() is first  # Reused, rather than started again
+
+    pool.release(second, broken=True)
+    assert second.quit_count == 1 and pool.open_count == 1
+
+    pool.close()
+    pool.release(first)  # Closed on release, since the pool is closed
+    assert first.quit_count == 1 and pool.open_count == 0
+    with raises(RuntimeError):
+        pool.acquire()
+
+
+def test_driver_pool_start_failure():
+    def failing_factory(browser_used):
+        raise WebDriverException("no browser")
+
+    pool = browser.DriverPool(constants.Browser.EDGE, factory=failing_factory)
+    with raises(WebDriverException):
+        pool.acquire()
+    assert pool.open_count == 0
+
+
+def use_fake_driver_pool(monkeypatch) -> list[FakeDriver]:
+    """ Makes browser recorders use a pool of fake drivers, returning the list of drivers it starts. """
+    drivers = []
+
+    def start_driver(browser_used):
+        drivers.append(FakeDriver(browser_used))
+        return drivers[-1]
+
+    pool = browser.DriverPool(constants.Browser.EDGE, factory=start_driver)
+    monkeypatch.setattr(browser.BrowserRecorder, "acquire_driver_pool", staticmethod(lambda browser_used: pool))
+    monkeypatch.setattr(browser.BrowserRecorder, "release_driver_pool", staticmethod(lambda browser_used: pool.close()))
+    return drivers
+
+
+def test_which_website_recorder(monkeypatch):
+    monkeypatch.setattr(constants, "BROWSER_POLL_INTERVAL", 0.01)
+    drivers = use_fake_driver_pool(monkeypatch)
+
+    recorder = WhichWebsiteRecorder("which")
+    recorder.prepare()
+    first = recorder.process()
+    second = recorder.process()
+    recorder.cleanup()
+
+    assert (first.download, first.upload) == (72.5, 18.25)
+    assert first.method is constants.RecordingMethod.WHICH_WEBSITE
+    assert isinstance(second, classes.Reading)
+
+    # One driver was reused for both tests, cookies were only accepted once, and the pool was closed after
+    assert len(drivers) == 1
+    assert drivers[0].elements["onetrust-accept-btn-handler"].clicks == 1
+    assert drivers[0].elements["start"].clicks == 2
+    assert drivers[0].quit_count == 1
+
+
+def test_broken_driver_replaced(monkeypatch):
+    monkeypatch.setattr(constants, "BROWSER_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(constants, "TIMEOUT", 0)
+    drivers = use_fake_driver_pool(monkeypatch)
+
+    recorder = WhichWebsiteRecorder("which")
+    recorder.prepare()
+    drivers[0].values = []  # The results are missing, so the test fails
+    failed = recorder.process()
+    assert (failed.download, failed.upload) == (0, 0)
+    assert drivers[0].quit_count == 1
+
+    assert recorder.process().download == 72.5  # With a new driver, which is set up again
+    assert len(drivers) == 2 and drivers[1].elements["onetrust-accept-btn-handler"].clicks == 1
+    # Only the drivers still in use are remembered as set up, so a replacement can't be mistaken for a broken driver
+    drivers.pop(0)
+    assert list(recorder._set_up_drivers) == drivers
+    recorder.cleanup()
+
+
+def test_shared_driver_pool():
+    first = browser.BrowserRecorder.acquire_driver_pool(constants.Browser.CHROME)
+    assert browser.BrowserRecorder.acquire_driver_pool(constants.Browser.CHROME) is first
+    browser.BrowserRecorder.release_driver_pool(constants.Browser.CHROME)
+    assert not first.closed
+    browser.BrowserRecorder.release_driver_pool(constants.Browser.CHROME)
+    assert first.closed
+    assert browser.BrowserRecorder.acquire_driver_pool(constants.Browser.CHROME) is not first
+    browser.BrowserRecorder.release_driver_pool(constants.Browser.CHROME)
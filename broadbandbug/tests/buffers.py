@@ -0,0 +1,40 @@
+""" Contains all testing functions for the buffers module. """
+import numpy as np
+
+from ..library import buffers
+
+
+def test_extend_and_grow():
+    buffer = buffers.GrowableArray(capacity=4)
+    buffer.extend([1, 2, 3])
+    buffer.append(4)
+    assert buffer.capacity == 4
+
+    buffer.extend(range(5, 11))
+    assert buffer.view.tolist() == list(range(1, 11))
+    assert len(buffer) == 10 and buffer.capacity >= 10
+    assert buffer[-1] == 10
+
+
+def test_truncate_and_drop_front():
+    buffer = buffers.GrowableArray(dtype=np.int64, capacity=8)
+    buffer.extend(range(8))
+    buffer.truncate(6)
+    buffer.drop_front(2)
+    assert buffer.view.tolist() == [2, 3, 4, 5]
+
+    buffer[0] = 20
+    assert buffer[0] == 20
+
+    buffer.drop_front(100)
+    assert len(buffer) == 0
+
+
+def test_sliding_window_stops_growing():
+    buffer = buffers.GrowableArray(capacity=4)
+    for i in range(1000):
+        buffer.append(i)
+        buffer.drop_front(len(buffer) - 50)  # Keep the last 50 items
+    assert buffer.view.tolist() == list(range(950, 1000))
+    # Space at the front is reused, so the buffer only needs to be a bit over twice the window size
+    assert buffer.capacity <= 256
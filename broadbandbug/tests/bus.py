@@ -0,0 +1,70 @@
+""" Contains all testing functions for the bus module. """
+from datetime import datetime
+from threading import Timer
+
+from pytest import raises
+
+from ..library import bus
+from ..library import classes
+from ..library import constants
+
+
+def make_reading(download: float, method=constants.RecordingMethod.SPEEDTEST_CLI) -> classes.Reading:
+    return classes.Reading(download, 0, datetime(2023, 6, 23), method)
+
+
+def test_every_subscriber_gets_every_reading():
+    readings_bus = bus.ReadingsBus()
+    first, second = readings_bus.subscribe(), readings_bus.subscribe()
+    readings = [make_reading(i) for i in range(5)]
+    for reading in readings:
+        readings_bus.publish(reading)
+
+    assert first.get_many() == readings
+    assert second.get_many(max_count=2) == readings[:2]
+    assert second.get_many() == readings[2:]
+    assert first.get_many() == []
+
+    # Closed subscriptions stop receiving readings, without affecting others
+    first.close()
+    readings_bus.publish(readings[0])
+    assert first.empty() and second.get_many() == readings[:1]
+    assert readings_bus.subscriber_count == 1
+
+
+def test_drop_oldest():
+    readings_bus = bus.ReadingsBus()
+    subscription = readings_bus.subscribe(maxsize=3)
+    for i in range(5):
+        readings_bus.publish(make_reading(i))
+    assert [reading.download for reading in subscription.get_many()] == [2, 3, 4]
+    assert subscription.dropped == 2
+
+
+def test_coalesce():
+    readings_bus = bus.ReadingsBus()
+    subscription = readings_bus.subscribe(maxsize=2, overflow=constants.OverflowPolicy.COALESCE)
+    readings_bus.publish(make_reading(0, constants.RecordingMethod.SPEEDTEST_CLI))
+    readings_bus.publish(make_reading(1, constants.RecordingMethod.BSC))
+    readings_bus.publish(make_reading(2, constants.RecordingMethod.SPEEDTEST_CLI))
+    readings_bus.publish(make_reading(3, constants.RecordingMethod.SPEEDTEST_CLI))
+    # The latest reading of each method is kept; a method with nothing queued drops the oldest reading instead
+    assert [reading.download for reading in subscription.get_many()] == [3, 1]
+    readings_bus.publish(make_reading(4, constants.RecordingMethod.BSC))
+    readings_bus.publish(make_reading(5, constants.RecordingMethod.BSC))
+    readings_bus.publish(make_reading(6, constants.RecordingMethod.WHICH_WEBSITE))
+    assert [reading.download for reading in subscription.get_many()] == [5, 6]
+
+
+def test_get_many_waits():
+    readings_bus = bus.ReadingsBus()
+    subscription = readings_bus.subscribe()
+    assert subscription.get_many(timeout=0.01) == []
+
+    Timer(0.05, readings_bus.publish, (make_reading(1),)).start()
+    assert len(subscription.get_many(timeout=5)) == 1
+
+
+def test_invalid_maxsize():
+    with raises(ValueError):
+        bus.ReadingsBus().subscribe(maxsize=0)
@@ -1,9 +1,11 @@
 """ Contains all testing functions for the classes module. """
 from datetime import datetime
 
+import numpy as np
 from pytest import raises
 
 from ..library import classes
+from ..library import constants
 
 
 # Reading instantiation is too simple to test, plus tested in manual tests
@@ -36,4 +38,69 @@ def test_invalid_cstdt():
     with raises(ValueError):
         classes.Reading.convert_string_to_datetime("10/12/2013 05:57:60")
 
+
+def make_readings() -> list[classes.Reading]:
+    return [classes.Reading(30, 10, datetime(2023, 6, 25), constants.RecordingMethod.SPEEDTEST_CLI),
+            classes.Reading(10, 5, datetime(2023, 6, 23), constants.RecordingMethod.WHICH_WEBSITE),
+            classes.Reading(20, 10, datetime(2023, 6, 24), constants.RecordingMethod.SPEEDTEST_CLI, 8)]
+
+
+def test_reading_batch_round_trip():
+    batch = classes.ReadingBatch.from_readings(make_readings())
+    assert len(batch) == 3
+    assert list(batch) == make_readings()
+    assert batch[1] == make_readings()[1]
+    assert batch.downloads.tolist() == [30, 10, 20]
+    assert batch.streams.tolist() == [0, 0, 8]  # 0 for unknown
+
+    # Readings use slots, so don't have a __dict__
+    assert not hasattr(batch[0], "__dict__")
+
+
+def test_reading_batch_indexing():
+    batch = classes.ReadingBatch.from_readings(make_readings())
+    assert list(batch[1:]) == make_readings()[1:]
+    assert list(batch[np.array([True, False, True])]) == [make_readings()[0], make_readings()[2]]
+
+
+def test_reading_batch_sort_and_filter():
+    batch = classes.ReadingBatch.from_readings(make_readings())
+    batch.sort_by_timestamp()
+    assert batch.downloads.tolist() == [10, 20, 30]
+
+    filtered = batch.filter_by_time((datetime(2023, 6, 24), datetime(2023, 6, 25)))
+    assert filtered.downloads.tolist() == [20, 30]
+    assert batch.filter_by_time(None) is batch
+
+
+def test_reading_batch_group_by_method():
+    groups = classes.ReadingBatch.from_readings(make_readings()).group_by_method()
+    assert list(groups.keys()) == [constants.RecordingMethod.SPEEDTEST_CLI, constants.RecordingMethod.WHICH_WEBSITE]
+    assert groups[constants.RecordingMethod.SPEEDTEST_CLI].downloads.tolist() == [30, 20]
+    assert len(classes.ReadingBatch.empty().group_by_method()) == 0
+
+
+def test_reading_batch_concatenate():
+    batch = classes.ReadingBatch.from_readings(make_readings())
+    assert list(classes.ReadingBatch.concatenate([batch, batch])) == make_readings() * 2
+    assert len(classes.ReadingBatch.concatenate([])) == 0
+
+
+def test_reading_batch_loss():
+    readings = make_readings() + [classes.Reading(15, 2, datetime(2023, 6, 24, 0, 0, 5, 500000),
+                                                  constants.RecordingMethod.LATENCY, loss=0.2)]
+    batch = classes.ReadingBatch.from_readings(readings)
+    assert np.isnan(batch.losses[:3]).all() and batch.losses[3] == 0.2  # NaN for not measured
+    assert list(batch) == readings
+    assert batch[3] == readings[3] and batch[0].loss is None
+
+    batch.sort_by_timestamp()
+    assert batch.losses[2] == 0.2
+    assert list(classes.ReadingBatch.concatenate([batch[:2], batch[2:]])) == list(batch)
+
+    row = readings[3].format_for_csv()
+    assert row["timestamp"] == "24/06/2023 00:00:05.500" and row["loss"] == 0.2
+    assert classes.Reading.from_csv_row({key: str(value) for key, value in row.items()}) == readings[3]
+
+
 # logging and BaseRecorder is tested through GUI manual tests
@@ -0,0 +1,46 @@
+""" Contains all testing functions for the daemon module. """
+import subprocess
+import sys
+
+from .. import daemon
+from .. import recorders
+from ..benchmarks import startup
+from ..library import classes
+from ..library import constants
+from ..library import storage
+
+
+def test_no_heavy_imports():
+    # Run in a new process, since other tests have already imported everything
+    _, heavy = startup.time_import("import broadbandbug.daemon")
+    assert heavy == []
+
+
+def test_make_recorders():
+    made = daemon.make_recorders([constants.RecordingMethod.LATENCY, constants.RecordingMethod.LATENCY],
+                                 constants.Browser.EDGE)
+    assert [recorder.identifier for recorder in made] == ["Latency probe 1", "Latency probe 2"]
+    latency_recorder = recorders.get_recorder_type(constants.RecordingMethod.LATENCY)
+    assert all(isinstance(recorder, latency_recorder) for recorder in made)
+    assert recorders.get_recorder_kwargs(constants.RecordingMethod.BSC, constants.Browser.CHROME) == {
+        "browser": constants.Browser.CHROME}
+
+
+def test_check_startup(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", classes.BaseRecorder.csv_path)  # Put back after the test
+    recording_path = tmp_path / "recording.bbr"
+    assert daemon.main(["--method", constants.RecordingMethod.LATENCY.value, "--recording", str(recording_path),
+                        "--check-startup"]) == 0
+    assert capsys.readouterr().out.startswith("Startup time: ")
+    assert isinstance(storage.open_storage(recording_path), storage.BinaryStorage)  # The recording file was created
+
+
+def test_invalid_method():
+    result = subprocess.run([sys.executable, "-m", "broadbandbug.daemon", "--method", "not a method"],
+                            capture_output=True, text=True)
+    assert result.returncode == 2 and "invalid RecordingMethod value" in result.stderr
+
+    # Methods without a recorder (see recorders.RECORDER_TYPES) are rejected in the same way
+    result = subprocess.run([sys.executable, "-m", "broadbandbug.daemon", "--method", "Broadband Speed Checker"],
+                            capture_output=True, text=True)
+    assert result.returncode == 2 and "can't be recorded with yet" in result.stderr
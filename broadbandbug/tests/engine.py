@@ -0,0 +1,94 @@
+""" Contains all testing functions for the engine module. """
+import asyncio
+from datetime import datetime
+from threading import get_ident
+from time import monotonic, sleep
+
+from ..library import classes
+from ..library import constants
+from ..library import engine
+from ..library import scheduler
+from ..library import storage
+
+
+class ProbeRecorder(engine.AsyncBaseRecorder):
+    """ A lightweight recorder that takes a reading every 10ms, recording which thread it ran on. """
+    threads = set()
+
+    async def process(self) -> classes.Reading | None:
+        ProbeRecorder.threads.add(get_ident())
+        if await self.wait_for_stop(0.01):
+            return None
+        return classes.Reading(5, 1, datetime.now(), constants.RecordingMethod.SPEEDTEST_CLI)
+
+
+class BlockingRecorder(classes.BaseRecorder):
+    """ A blocking recorder, which would hold up the event loop if it wasn't run in the executor. """
+    def process(self) -> classes.Reading:
+        sleep(0.02)
+        return classes.Reading(10, 2, datetime.now(), constants.RecordingMethod.SPEEDTEST_CLI)
+
+
+def test_runner(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+    ProbeRecorder.threads = set()
+    subscription = classes.BaseRecorder.get_readings_bus().subscribe(maxsize=100_000)
+
+    probes = [ProbeRecorder(f"probe {i}") for i in range(50)]
+    with engine.RecorderRunner(probes) as runner:
+        blocking = runner.add(BlockingRecorder("blocking"))
+        assert isinstance(blocking, engine.ExecutorRecorder)
+        sleep(0.3)
+        assert all(probe.recorder_running for probe in probes)
+    assert runner.errors() == {}
+    assert not any(recorder.recorder_running for recorder in runner.recorders)
+    assert blocking.recorder.stop_event.is_set()
+
+    # Every probe ran on the one event loop thread
+    assert len(ProbeRecorder.threads) == 1 and get_ident() not in ProbeRecorder.threads
+
+    readings = subscription.get_many()
+    subscription.close()
+    downloads = [reading.download for reading in readings]
+    assert downloads.count(5) > 50 * 5  # Probes weren't held up by the blocking recorder...
+    assert downloads.count(10) > 3  # ...which still took readings
+    assert len(list(storage.open_storage(tmp_path / "recording.csv").iter_readings())) == len(readings)
+
+
+def test_stop_is_immediate(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+
+    class SlowProbe(engine.AsyncBaseRecorder):
+        async def process(self):
+            await self.wait_for_stop(60)
+            return None
+
+    runner = engine.RecorderRunner([SlowProbe("slow")])
+    runner.start()
+    sleep(0.1)
+    start = monotonic()
+    runner.stop()
+    assert monotonic() - start < 5
+    assert runner.errors() == {}
+
+
+def test_bandwidth_lease(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+    lease = scheduler.BandwidthLease(gap=0)
+    with engine.RecorderRunner([ProbeRecorder("probe"), BlockingRecorder("blocking")], bandwidth_lease=lease):
+        sleep(0.3)
+    assert lease.stats["probe"].readings > 0 and lease.stats["blocking"].readings > 0
+    assert not lease.held
+
+
+def test_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+
+    class FailingProbe(engine.AsyncBaseRecorder):
+        async def process(self):
+            await asyncio.sleep(0)
+            raise ValueError("probe failed")
+
+    with engine.RecorderRunner([FailingProbe("failing")]) as runner:
+        sleep(0.1)
+    assert isinstance(runner.errors()["failing"], ValueError)
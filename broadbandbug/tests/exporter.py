@@ -0,0 +1,82 @@
+""" Contains all testing functions for the exporter module. """
+import json
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from pytest import approx, raises
+
+from ..library import classes
+from ..library import constants
+from ..library import exporter
+
+
+def test_metrics_state():
+    state = exporter.MetricsState(timedelta(minutes=10))
+    start = datetime(2024, 1, 1, 12)
+    state.add(classes.Reading(10, 2, start, constants.RecordingMethod.SPEEDTEST_CLI))
+    state.add(classes.Reading(20, 4, start + timedelta(minutes=5), constants.RecordingMethod.SPEEDTEST_CLI))
+    state.add(classes.Reading(30, 3, start + timedelta(minutes=1), constants.RecordingMethod.LATENCY, loss=0.2))
+
+    snapshot = state.snapshot()
+    speedtest = snapshot[constants.RecordingMethod.SPEEDTEST_CLI]
+    assert speedtest["latest"].download == 20 and speedtest["total"] == 2
+    assert speedtest["averages"] == {"count": 2, "download": 15, "upload": 3, "loss": None}
+    assert snapshot[constants.RecordingMethod.LATENCY]["averages"]["loss"] == approx(0.2)
+
+    # Readings leave the window once they are older than it, relative to the latest reading
+    state.add(classes.Reading(30, 6, start + timedelta(minutes=12), constants.RecordingMethod.SPEEDTEST_CLI))
+    speedtest = state.snapshot()[constants.RecordingMethod.SPEEDTEST_CLI]
+    assert speedtest["averages"] == {"count": 2, "download": 25, "upload": 5, "loss": None}
+    assert speedtest["total"] == 3
+
+    # Readings arriving out of order don't replace the latest one
+    state.add(classes.Reading(1, 1, start + timedelta(minutes=11), constants.RecordingMethod.SPEEDTEST_CLI))
+    assert state.snapshot()[constants.RecordingMethod.SPEEDTEST_CLI]["latest"].download == 30
+
+
+class FakeRecorder:
+    def __init__(self, identifier: str, recorder_running: bool):
+        self.identifier = identifier
+        self.recorder_running = recorder_running
+
+
+def fetch(address: tuple[str, int], path: str) -> str:
+    with urlopen(f"http://{address[0]}:{address[1]}{path}", timeout=5) as response:
+        return response.read().decode("utf-8")
+
+
+def test_exporter():
+    recorders = [FakeRecorder("speedtest", True), FakeRecorder("latency", False)]
+    classes.BaseRecorder.get_timings().record("speedtest", "download", 0.5)
+
+    with exporter.MetricsExporter("127.0.0.1", 0, get_recorders=lambda: recorders) as metrics_exporter:
+        classes.BaseRecorder.publish_reading(classes.Reading(50, 10, datetime.now(),
+                                                             constants.RecordingMethod.SPEEDTEST_CLI, 4))
+        classes.BaseRecorder.publish_reading(classes.Reading(12.5, 1.5, datetime.now(),
+                                                             constants.RecordingMethod.LATENCY, loss=0.2))
+        deadline = monotonic() + 5
+        while len(metrics_exporter.state.snapshot()) < 2 and monotonic() < deadline:
+            sleep(0.01)
+
+        readings = json.loads(fetch(metrics_exporter.address, "/readings"))
+        assert readings["methods"]["Speedtest CLI"]["latest"]["download"] == 50
+        assert readings["methods"]["Speedtest CLI"]["latest"]["streams"] == 4
+        assert readings["methods"]["Latency probe"]["averages"]["loss"] == approx(0.2)
+        assert readings["recorders"] == {"speedtest": True, "latency": False}
+        assert readings["timings"]["speedtest"]["download"]["count"] >= 1
+
+        metrics = fetch(metrics_exporter.address, "/metrics")
+        assert 'broadbandbug_latest_download{method="Speedtest CLI"} 50.0' in metrics
+        assert 'broadbandbug_latest_latency_milliseconds{method="Latency probe"} 12.5' in metrics
+        assert 'broadbandbug_average_loss_ratio{method="Latency probe"} 0.2' in metrics
+        assert 'broadbandbug_recorder_running{recorder="latency"} 0.0' in metrics
+        assert 'broadbandbug_phase_duration_seconds_bucket{recorder="speedtest",phase="download",le="+Inf"}' in metrics
+        assert "# TYPE broadbandbug_phase_duration_seconds histogram" in metrics
+
+        with raises(HTTPError):
+            fetch(metrics_exporter.address, "/missing")
+
+    # Stopped exporters don't keep receiving readings
+    assert classes.BaseRecorder.get_readings_bus().subscriber_count == 0
@@ -1,9 +1,18 @@
+from datetime import datetime, timedelta
 from pathlib import Path
-from threading import Thread
+from queue import Queue
+from threading import Event, Thread
 from time import sleep
 
+import numpy as np
+
+from ..benchmarks import read_plot
 from ..library import classes
+from ..library import constants
 from ..library import files
+from ..library import mapped
+from ..library import rollups
+from ..library import storage
 
 
 test_path = Path("./broadbandbug/tests/resources").absolute()
@@ -60,6 +69,42 @@ def test_efe_dir_doesnt_exist():
 # read_results is tested by plotting tests, which is tested manually.
 
 
+def test_iter_results_filters():
+    artificial = test_path / "artificial.csv"
+    time_constraints = (datetime(2023, 6, 24), datetime(2023, 6, 26))
+
+    results = list(files.iter_results(artificial, time_constraints, [constants.RecordingMethod.WHICH_WEBSITE]))
+    assert [reading.download for reading in results] == [50, 30, 70]
+    assert len(list(files.iter_results(artificial))) == 15
+
+    # Results are yielded in the order they are stored, and are only read as needed
+    iterator = files.iter_results(artificial, methods=[constants.RecordingMethod.SPEEDTEST_CLI])
+    assert next(iterator).timestamp == datetime(2023, 6, 23)
+
+
+def test_read_results_matches_iter_results():
+    artificial = test_path / "artificial.csv"
+    merged = files.read_results(artificial, None, True)
+    assert sorted(files.iter_results(artificial), key=lambda reading: reading.timestamp) == merged
+
+    unmerged = files.read_results(artificial, None, False)
+    assert set(unmerged.keys()) == {constants.RecordingMethod.SPEEDTEST_CLI, constants.RecordingMethod.WHICH_WEBSITE}
+    assert sum(len(group) for group in unmerged.values()) == len(merged)
+
+
+def test_read_results_as_batch():
+    artificial = test_path / "artificial.csv"
+    time_constraints = (datetime(2023, 6, 24), datetime(2023, 6, 29))
+
+    merged = files.read_results(artificial, time_constraints, True, as_batch=True)
+    assert isinstance(merged, classes.ReadingBatch)
+    assert list(merged) == files.read_results(artificial, time_constraints, True)
+
+    unmerged = files.read_results(artificial, time_constraints, False, as_batch=True)
+    expected = files.read_results(artificial, time_constraints, False)
+    assert {method: list(batch) for method, batch in unmerged.items()} == expected
+
+
 # Manual test - expect results_writer_test_file.csv to have stuff in resources dir
 def test_results_writer():
     results_writer_test_file = test_path / "results_writer_test_file.csv"
@@ -75,3 +120,89 @@ def test_results_writer():
 
     # Stop everything
     base_rec.send_stop_signal()
+
+
+def make_readings(count: int) -> list[classes.Reading]:
+    return [classes.Reading(i, i, datetime(2023, 6, 23) + timedelta(minutes=i), constants.RecordingMethod.BSC)
+            for i in range(count)]
+
+
+def test_results_writer_group_commit(tmp_path):
+    path = tmp_path / "recording.csv"
+    writer = files.ResultsWriter(path, batch_size=10, flush_interval_ms=60_000)
+    readings = make_readings(25)
+    for reading in readings[:5]:
+        writer.write(reading)
+    assert not writer.is_flush_due()
+    assert list(storage.open_storage(path).iter_readings()) == []  # Not flushed yet
+
+    for reading in readings[5:]:
+        writer.write(reading)
+    assert writer.is_flush_due()
+    writer.flush()
+    assert list(storage.open_storage(path).iter_readings()) == readings
+
+    # Closing flushes what is left
+    writer.write(readings[0])
+    writer.close()
+    assert list(storage.open_storage(path).iter_readings()) == readings + readings[:1]
+    assert list(files.iter_results(path, (readings[3].timestamp, readings[4].timestamp))) == readings[3:5]
+
+
+def test_results_writer_upgrades(tmp_path):
+    # Files made before streams and loss were recorded are upgraded when opened, so they aren't dropped
+    path = tmp_path / "recording.csv"
+    readings = make_readings(20)
+    path.write_text("download,upload,timestamp,method\r\n" + "".join(
+        f"{reading.download},{reading.upload},{reading.get_timestamp_as_str()},{reading.method.value}\r\n"
+        for reading in readings[:10]))
+    rollups.build_rollups(path)
+    new_readings = [classes.Reading(reading.download, reading.upload, reading.timestamp, reading.method, 4, 0.5)
+                    for reading in readings[10:]]
+
+    writer = files.ResultsWriter(path, shard_period=None)
+    for reading in new_readings:
+        writer.write(reading)
+    writer.close()
+
+    assert list(storage.open_storage(path).iter_readings()) == readings[:10] + new_readings
+    assert list(files.iter_results(path, (readings[12].timestamp, readings[14].timestamp))) == new_readings[2:5]
+    assert sum(bucket.count for bucket in rollups.read_rollups(path, constants.RollupResolution.HOUR)) == 20
+
+
+def test_results_writer_drains_on_close(tmp_path):
+    path = tmp_path / "recording.bbr"
+    results_queue = Queue()
+    close_event = Event()
+    readings = make_readings(200)
+    for reading in readings[:100]:
+        results_queue.put(reading)
+
+    thread = Thread(target=files.results_writer, args=(path, results_queue, close_event),
+                    kwargs={"batch_size": 16, "flush_interval_ms": 10})
+    thread.start()
+    for reading in readings[100:]:
+        results_queue.put(reading)
+    close_event.set()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert list(storage.open_storage(path).iter_readings()) == readings
+
+
+def test_iter_result_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapped, "CSV_CHUNK_SIZE", 1000)  # So the file is read in many parts
+    for suffix in (".csv", constants.BINARY_RECORDING_SUFFIX):
+        path = tmp_path / ("recording" + suffix)
+        read_plot.write_recording(path, read_plot.make_records(500))  # Mostly, but not entirely, in timestamp order
+        chunks = list(files.iter_result_batches(path, None, chunk_size=50))
+
+        # The chunks are yielded as the file is read, rather than once it has all been read
+        loaded = [loaded for _, loaded in chunks]
+        assert len(set(loaded)) > 5 and loaded == sorted(loaded) and loaded[-1] == 1
+        assert all(len(chunk) <= 50 for chunk, _ in chunks)
+        # Each chunk is after the one before, apart from the last, which has the readings stored late
+        timestamps = np.concatenate([chunk.timestamps for chunk, _ in chunks[:-1]])
+        assert (np.diff(timestamps) >= 0).all() and len(chunks[-1][0]) and chunks[-1][0].timestamps[0] < timestamps[-1]
+        expected = files.read_results(path, None, True, as_batch=True)
+        assert sorted(np.concatenate([timestamps, chunks[-1][0].timestamps])) == list(expected.timestamps)
@@ -0,0 +1,91 @@
+""" Contains all testing functions for the index module. """
+from datetime import datetime, timedelta
+
+from ..library import classes
+from ..library import constants
+from ..library import files
+from ..library import index
+from ..library import storage
+
+
+def make_recording(path, count: int, block_size: int) -> storage.BaseStorage:
+    """ Records count readings, an hour apart, while keeping the index up to date like a recorder would. """
+    recording = storage.open_storage(path)
+    with recording.open_appender() as appender, index.IndexUpdater(recording, block_size) as updater:
+        for i in range(count):
+            reading = classes.Reading(i, i, datetime(2023, 6, 23) + timedelta(hours=i),
+                                      constants.RecordingMethod.SPEEDTEST_CLI)
+            start = appender.tell()
+            appender.append(reading)
+            appender.flush()
+            updater.add(reading, start, appender.tell())
+    return recording
+
+
+def check_range_query(recording: storage.BaseStorage):
+    time_constraints = (datetime(2023, 6, 25), datetime(2023, 6, 26))
+
+    timestamp_index = index.TimestampIndex(recording)
+    assert timestamp_index.load()
+    yielded = list(timestamp_index.iter_readings(time_constraints))
+
+    # Only blocks around the time constraints, and the readings that aren't indexed, should be read
+    assert len(yielded) < 60
+    # Results should be the same as without the index
+    expected = [reading for reading in recording.iter_readings()
+                if files.check_reading_in_constraints(reading, time_constraints)]
+    assert [reading for reading in yielded if files.check_reading_in_constraints(reading, time_constraints)] == expected
+    assert len(expected) == 25
+
+
+def test_csv_range_query(tmp_path):
+    recording = make_recording(tmp_path / "recording.csv", 200, 10)
+    assert len(index.TimestampIndex(recording).entries) == 0  # Not loaded yet
+    check_range_query(recording)
+
+
+def test_binary_range_query(tmp_path):
+    check_range_query(make_recording(tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX), 200, 10))
+
+
+def test_entries_written_per_block(tmp_path):
+    recording = make_recording(tmp_path / "recording.csv", 25, 10)
+    timestamp_index = index.TimestampIndex(recording)
+    timestamp_index.load()
+    assert [entry.count for entry in timestamp_index.entries] == [10, 10]
+    assert timestamp_index.entries[0].end == timestamp_index.entries[1].start
+
+    # The last 5 readings are not indexed
+    assert len(list(recording.iter_readings(timestamp_index.indexed_end))) == 5
+
+
+def test_build_index_for_existing_file(tmp_path):
+    # Make a recording without an index
+    recording = make_recording(tmp_path / "recording.csv", 200, 10)
+    timestamp_index = index.TimestampIndex(recording)
+    timestamp_index.path.unlink()
+
+    index.build_index(recording.path, 10)
+    check_range_query(recording)
+
+
+def test_stale_index_rewritten(tmp_path):
+    recording = make_recording(tmp_path / "recording.csv", 200, 10)
+
+    # Replace the recording with a smaller one, keeping the old index
+    recording.path.unlink()
+    with recording.open_appender() as appender:
+        appender.append(classes.Reading(1, 1, datetime(2023, 6, 23), constants.RecordingMethod.SPEEDTEST_CLI))
+    assert not index.TimestampIndex(recording).load()
+
+    index.build_index(recording.path, 10)
+    timestamp_index = index.TimestampIndex(recording)
+    assert timestamp_index.load()
+    assert timestamp_index.entries == []
+
+
+def test_read_results_uses_index(tmp_path):
+    recording = make_recording(tmp_path / "recording.csv", 200, 10)
+    time_constraints = (datetime(2023, 6, 25), datetime(2023, 6, 26))
+    readings = files.read_results(recording.path, time_constraints, True)
+    assert [reading.download for reading in readings] == list(range(48, 73))
@@ -0,0 +1,102 @@
+""" Contains all testing functions for the lod module. """
+import numpy as np
+from pytest import raises
+
+from ..library import lod
+
+
+def make_pyramid(count: int, factor: int = 4) -> lod.LODPyramid:
+    timestamps = np.arange(count, dtype=np.float64)
+    return lod.LODPyramid(timestamps, np.sin(timestamps) * 100, factor)
+
+
+def test_levels():
+    pyramid = make_pyramid(100)
+    assert [len(level) for level in pyramid.levels] == [25, 7, 2, 1]
+
+    level = pyramid.levels[0]
+    assert level.mins[0] == pyramid.values[:4].min()
+    assert level.maxs[0] == pyramid.values[:4].max()
+    assert level.means[-1] == pyramid.values[96:].mean()
+    assert all(level.counts.sum() == 100 for level in pyramid.levels)
+    assert pyramid.levels[-1].maxs[0] == pyramid.values.max()
+
+    with raises(ValueError):
+        make_pyramid(10, 1)
+
+
+def test_extend_matches_building_at_once():
+    pyramid = make_pyramid(0)
+    for start, end in [(0, 1), (1, 37), (37, 38), (38, 100)]:
+        timestamps = np.arange(start, end, dtype=np.float64)
+        pyramid.extend(timestamps, np.sin(timestamps) * 100)
+
+    expected = make_pyramid(100)
+    assert len(pyramid.levels) == len(expected.levels)
+    for level, expected_level in zip(pyramid.levels, expected.levels):
+        for column, expected_column in zip(level, expected_level):
+            assert np.allclose(column, expected_column)
+
+
+def test_select_full_detail_when_zoomed_in():
+    pyramid = make_pyramid(10_000)
+    timestamps, values, level = pyramid.select(100, 200, 1000)
+    assert level == 0
+    assert timestamps[0] == 99 and timestamps[-1] == 201  # One point either side of the range
+    assert np.array_equal(values, pyramid.values[99:202])
+
+
+def test_select_downsamples_when_zoomed_out():
+    pyramid = make_pyramid(100_000)
+    timestamps, values, level = pyramid.select(0, 100_000, 500)
+    assert level > 0
+    assert len(timestamps) <= 500 * 2 * 2  # Allowing for the extra points either side
+    # The minimums and maximums should be kept
+    assert values.min() == pyramid.values.min() and values.max() == pyramid.values.max()
+    # Each bucket is a vertical line, covering the whole range
+    assert np.array_equal(timestamps[::2], timestamps[1::2]) and (np.diff(timestamps[::2]) > 0).all()
+    assert 0 < timestamps[0] < timestamps[-1] < 99_999
+
+    timestamps, values, _ = pyramid.select(0, 100_000, 500, use_means=True)
+    assert len(timestamps) == len(values) <= 1000
+
+
+def test_choose_level():
+    pyramid = make_pyramid(100_000, 10)
+    assert pyramid.choose_level(0, 100_000, 50_000) == 0
+    # 1000 pixels allows 2000 points, so 100 points per bucket (each drawn as 2 points) is needed
+    assert pyramid.choose_level(0, 100_000, 1000) == 2
+    assert pyramid.choose_level(0, 100_000, 999) == 3
+
+
+def check_buckets(pyramid: lod.LODPyramid):
+    """ Checks every bucket of every level summarises the points it should. """
+    first_point = pyramid._first_positions[0]
+    for level_number, level in enumerate(pyramid.levels, start=1):
+        bucket_size = pyramid.factor ** level_number
+        for i in range(len(level)):
+            position = pyramid._first_positions[level_number] + i
+            start = max(position * bucket_size - first_point, 0)
+            end = (position + 1) * bucket_size - first_point
+            assert level.mins[i] == pyramid.values[start:end].min()
+            assert level.maxs[i] == pyramid.values[start:end].max()
+            assert level.counts[i] == len(pyramid.values[start:end])
+            assert level.starts[i] == pyramid.timestamps[start]
+            assert level.ends[i] == pyramid.timestamps[start:end][-1]
+        assert level.counts.sum() == len(pyramid)
+
+
+def test_drop_before():
+    pyramid = make_pyramid(0, 3)
+    for start in range(0, 500, 7):
+        timestamps = np.arange(start, start + 7, dtype=np.float64)
+        pyramid.extend(timestamps, np.sin(timestamps) * 100)
+        # Keep a sliding window of the last 100 points
+        pyramid.drop_before(start + 7 - 100)
+        check_buckets(pyramid)
+
+    assert len(pyramid) == 100
+    assert pyramid.full_range() == (404, 503)
+
+    pyramid.drop_before(1000)
+    assert len(pyramid) == 0 and pyramid.levels == []
@@ -0,0 +1,94 @@
+""" Contains all testing functions for the mapped module. """
+from pathlib import Path
+
+import numpy as np
+from pytest import raises
+
+from ..benchmarks import read_plot
+from ..library import constants
+from ..library import mapped
+from ..library import storage
+
+test_path = Path("./broadbandbug/tests/resources").absolute()
+
+
+def check_same_as_storage(recording: storage.BaseStorage, offset: int | None = None, count: int | None = None):
+    expected = recording.read_arrays(offset, count)
+    # CSV files are read directly, so they can't be read with CSVStorage instead without it being noticed
+    records = mapped.read_csv_arrays(recording, offset, count) if isinstance(recording, storage.CSVStorage) \
+        else mapped.read_arrays(recording, offset, count)
+    assert records.dtype == storage.RECORD_DTYPE
+    # Compared as bytes, since NaN isn't equal to itself
+    assert records.tobytes() == expected.tobytes()
+
+
+def test_resources():
+    for name in ("artificial.csv", "actual.csv"):
+        check_same_as_storage(storage.CSVStorage(test_path / name))
+
+
+def test_synthetic(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapped, "CSV_CHUNK_SIZE", 1000)  # So rows are parsed over many chunks
+    records = read_plot.make_records(500)
+    for suffix in (".csv", constants.BINARY_RECORDING_SUFFIX):
+        path = tmp_path / ("recording" + suffix)
+        read_plot.write_recording(path, records)
+        recording = storage.open_storage(path)
+        check_same_as_storage(recording)
+
+        # Reading part of the file, from the offset of a reading, as the timestamp index does
+        offsets = [start for start, _, _ in recording.iter_readings_with_offsets()]
+        check_same_as_storage(recording, offsets[123], 100)
+        check_same_as_storage(recording, offsets[-5], 100)
+        check_same_as_storage(recording, offsets[400])
+
+        # Reading a part at a time gives the same readings, and the offset after each part
+        parts = list(mapped.iter_arrays(recording, offsets[123]))
+        assert len(parts) > 1 and parts[-1][1] == path.stat().st_size
+        assert np.concatenate([part for part, _ in parts]).tobytes() == recording.read_arrays(offsets[123]).tobytes()
+        counts = np.cumsum([len(part) for part, _ in parts])
+        assert [end for _, end in parts[:-1]] == [offsets[123 + count] for count in counts[:-1]]
+
+
+def test_binary_view(tmp_path):
+    path = tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX)
+    read_plot.write_recording(path, read_plot.make_records(100))
+    with open(path, "ab") as file:
+        file.write(b"\0" * 5)  # A partly written record, which should be ignored
+
+    records = mapped.read_arrays(storage.BinaryStorage(path))
+    assert len(records) == 100
+    # The records, and each column, are read-only views of the mapped file rather than copies
+    assert not records.flags.owndata and not records.flags.writeable
+    assert np.shares_memory(records["timestamp"], records)
+
+    with raises(storage.BinaryFormatError):
+        mapped.read_arrays(storage.BinaryStorage(test_path / "artificial.csv"))
+
+
+def test_csv_fallback(tmp_path):
+    # Blank lines, rows without a newline at the end and empty optional fields are parsed as bytes...
+    path = tmp_path / "recording.csv"
+    path.write_bytes(b"download,upload,timestamp,method,streams,loss\r\n10,5,23/06/2023 00:00:00,Speedtest CLI,4,\r\n"
+                     b"\r\n\n12.5,1.5,1/7/2023 8:00:00.250,Latency probe,,0.25")
+    check_same_as_storage(storage.CSVStorage(path))
+    check_same_as_storage(storage.CSVStorage(path), count=1)
+
+    # ...while quoted fields, and rows with the wrong number of fields, are read with CSVStorage instead
+    path.write_bytes(b'download,upload,timestamp,method\r\n10,5,23/06/2023 00:00:00,"Speedtest CLI"\r\n')
+    with raises(mapped.UnsupportedLayoutError):
+        mapped.read_csv_arrays(storage.CSVStorage(path))
+    assert mapped.read_arrays(storage.CSVStorage(path)).tobytes() == storage.CSVStorage(path).read_arrays().tobytes()
+    # Only the rows being read are checked for quotes, so the rows before a quoted field can still be parsed as bytes
+    path.write_bytes(b'download,upload,timestamp,method\r\n10,5,23/06/2023 00:00:00,Speedtest CLI\r\n'
+                     b'10,5,23/06/2023 00:00:00,"Speedtest CLI"\r\n')
+    check_same_as_storage(storage.CSVStorage(path), count=1)
+    for contents in (b"download,upload,timestamp,method\r\n10,5,23/06/2023 00:00:00,Speedtest CLI,4\r\n",
+                     b"download,upload,timestamp,method\r\n10,5,23/06/2023 00:00:00,Speedtest\rCLI\r\n"):
+        path.write_bytes(contents)
+        with raises(mapped.UnsupportedLayoutError):
+            mapped.read_csv_arrays(storage.CSVStorage(path))
+
+    path.write_bytes(b"download,upload,timestamp,method\r\n10,5,23/06/2023 00:00:00,Not a method\r\n")
+    with raises(ValueError, match="'Not a method' is not a valid RecordingMethod"):
+        mapped.read_arrays(storage.CSVStorage(path))
@@ -0,0 +1,111 @@
+""" Contains all testing functions for the outages module. """
+import socket
+from datetime import datetime
+from threading import Event, Thread
+from time import monotonic, sleep
+
+from ..library import classes
+from ..library import constants
+from ..library import outages
+
+
+def test_tcp_probe():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        address = listener.getsockname()
+        assert outages.tcp_probe([address], timeout=1)
+
+        # The first address doesn't respond, but the second does
+        with socket.socket() as closed:
+            closed.bind(("127.0.0.1", 0))
+            closed_address = closed.getsockname()
+        assert outages.tcp_probe([closed_address, address], timeout=1)
+
+    # Nothing is listening any more
+    assert not outages.tcp_probe([address], timeout=1)
+
+
+def test_detector_backoff():
+    probe_times = []
+
+    def probe():
+        probe_times.append(monotonic())
+        return len(probe_times) == 5  # The connection comes back on the fifth probe
+
+    detector = outages.OutageDetector(probe, initial_backoff=0.01, max_backoff=0.04)
+    assert detector.wait_for_connection()
+    gaps = [later - earlier for earlier, later in zip(probe_times, probe_times[1:])]
+    assert len(gaps) == 4
+    assert gaps[1] > gaps[0] * 1.5  # Doubled...
+    assert gaps[3] < 0.04 * 1.9  # ...up to the maximum
+
+
+def test_detector_stops_immediately():
+    stop_event = Event()
+    detector = outages.OutageDetector(lambda: False, stop_event, initial_backoff=60)
+    Thread(target=lambda: (sleep(0.05), stop_event.set())).start()
+    start = monotonic()
+    assert not detector.wait_for_connection()
+    assert monotonic() - start < 5
+
+
+def test_outage_log(tmp_path):
+    recording_path = tmp_path / "recording.csv"
+    assert outages.read_outages(recording_path) == []
+
+    outages.record_event(recording_path, outages.START_EVENT, "first", datetime(2023, 6, 1, 12))
+    outages.record_event(recording_path, outages.START_EVENT, "second", datetime(2023, 6, 1, 12, 1))
+    outages.record_event(recording_path, outages.END_EVENT, "first", datetime(2023, 6, 1, 12, 5))
+    outages.record_event(recording_path, outages.START_EVENT, "first", datetime(2023, 6, 2))
+
+    assert outages.read_outages(recording_path) == [
+        outages.Outage(datetime(2023, 6, 1, 12), datetime(2023, 6, 1, 12, 5), "first"),
+        outages.Outage(datetime(2023, 6, 1, 12, 1), None, "second"),  # Still going on
+        outages.Outage(datetime(2023, 6, 2), None, "first"),
+    ]
+    in_range = outages.read_outages(recording_path, (datetime(2023, 6, 1, 12, 6), datetime(2023, 6, 1, 13)))
+    assert [outage.recorder for outage in in_range] == ["second"]
+
+
+class FailingRecorder(classes.BaseRecorder):
+    """ A recorder whose first test fails because the connection is down, which comes back shortly after. """
+    def __init__(self, identifier, probe_address):
+        super().__init__(identifier)
+        self.readings = 0
+        self.probe_address = probe_address
+        self.listener = None
+
+    def get_probe_addresses(self):
+        return [self.probe_address]
+
+    def come_back_up(self):
+        sleep(0.2)
+        self.listener = socket.socket()
+        self.listener.bind(self.probe_address)
+        self.listener.listen()
+
+    def process(self):
+        self.readings += 1
+        if self.readings == 1:
+            Thread(target=self.come_back_up).start()
+            return classes.Reading(0, 0, datetime.now(), constants.RecordingMethod.SPEEDTEST_CLI)
+        self.send_stop_signal()
+        return classes.Reading(10, 1, datetime.now(), constants.RecordingMethod.SPEEDTEST_CLI)
+
+
+def test_recorder_waits_out_outage(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+    with socket.socket() as closed:
+        closed.bind(("127.0.0.1", 0))
+        probe_address = closed.getsockname()  # Nothing is listening here until the connection comes back
+
+    recorder = FailingRecorder("failing", probe_address)
+    start = monotonic()
+    recorder.recording_loop()
+    recorder.listener.close()
+    assert recorder.readings == 2
+    assert monotonic() - start < constants.OUTAGE_INITIAL_BACKOFF * 4
+
+    [outage] = outages.read_outages(tmp_path / "recording.csv")
+    assert outage.recorder == "failing" and outage.end is not None
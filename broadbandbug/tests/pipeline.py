@@ -0,0 +1,51 @@
+""" Contains all testing functions for the pipeline module. """
+from datetime import datetime, timedelta
+from itertools import count, islice
+from pathlib import Path
+from statistics import mean
+
+from pytest import raises
+
+from ..library import classes
+from ..library import constants
+from ..library import files
+from ..library import pipeline
+
+
+test_path = Path("./broadbandbug/tests/resources").absolute()
+
+
+def test_filter_and_map():
+    stream = pipeline.run_pipeline(range(10), pipeline.filter_stage(lambda x: x % 2 == 0),
+                                   pipeline.map_stage(lambda x: x * 10))
+    assert list(stream) == [0, 20, 40, 60, 80]
+
+
+def test_batch():
+    assert list(pipeline.run_pipeline(range(7), pipeline.batch_stage(3))) == [[0, 1, 2], [3, 4, 5], [6]]
+    with raises(ValueError):
+        pipeline.batch_stage(0)
+
+
+def test_stages_are_lazy():
+    # An infinite source should work, as long as only some of the output is used
+    stream = pipeline.run_pipeline(count(), pipeline.batch_stage(2), pipeline.map_stage(sum))
+    assert list(islice(stream, 3)) == [1, 5, 9]
+
+
+def test_window():
+    readings = [classes.Reading(i, i, datetime(2023, 6, 23, hour, minute), constants.RecordingMethod.SPEEDTEST_CLI)
+                for i, (hour, minute) in enumerate([(0, 0), (0, 59), (1, 30), (3, 0), (3, 15)])]
+    windows = list(pipeline.run_pipeline(readings, pipeline.window_stage(timedelta(hours=1))))
+
+    assert [start for start, _ in windows] == [datetime(2023, 6, 23, 0), datetime(2023, 6, 23, 1),
+                                               datetime(2023, 6, 23, 3)]
+    assert [[reading.download for reading in window] for _, window in windows] == [[0, 1], [2], [3, 4]]
+
+
+def test_daily_means_from_file():
+    daily_means = pipeline.run_pipeline(
+        files.iter_results(test_path / "artificial.csv", methods=[constants.RecordingMethod.WHICH_WEBSITE]),
+        pipeline.window_stage(timedelta(days=1)),
+        pipeline.map_stage(lambda window: (window[0].day, mean(reading.download for reading in window[1]))))
+    assert list(daily_means) == [(23, 40), (24, 50), (25, 30), (26, 70), (29, 30), (30, 20)]
@@ -1,19 +1,138 @@
-from time import sleep
+import socket
+from time import monotonic, sleep, time
 
-from broadbandbug.recorders.speedtestcli import SpeedtestCLIRecorder
+import speedtest
+from pytest import approx, raises
+
+from broadbandbug.library import constants
+from broadbandbug.recorders.latency import LatencyRecorder, summarise_probes, time_connect
+from broadbandbug.recorders.speedtestcli import SpeedtestCLIRecorder, choose_stream_count
+from broadbandbug.recorders.speedtest_servers import ServerCache, UNREACHABLE_LATENCY_MS
 import threading
 
 
 # Manual test
 def speedtest_cli():
     rec = SpeedtestCLIRecorder("Speedtest CLI test")
+    subscription = rec.get_readings_bus().subscribe()
     threading.Thread(target=rec.recording_loop).start()
     sleep(120)
     rec.send_stop_signal()
 
-    results = rec.get_new_readings_queue()
-    while not results.empty():
-        print(results.get())
+    for reading in subscription.get_many():
+        print(reading)
+
+
+def test_choose_stream_count():
+    # A connection that 3 streams can saturate
+    def measure(streams):
+        measured.append(streams)
+        return min(streams, 3) * 100
+
+    measured = []
+    assert choose_stream_count(measure, max_streams=16, min_gain=0.1) == 4
+    assert measured == [1, 2, 4, 8]
+
+    measured = []
+    assert choose_stream_count(measure, max_streams=2) == 2
+    assert measured == [1, 2]
+
+
+class FakeSpeedtest:
+    """ Stands in for speedtest.Speedtest, with servers whose latencies are known. Servers with no latency are down. """
+    def __init__(self, latencies: dict[int, float | None]):
+        self.latencies = latencies
+        self.closest = []
+        self.tested = []
+
+    def get_closest_servers(self, limit=5):
+        self.closest.extend({"id": server_id, "url": f"http://{server_id}/upload.php"}
+                            for server_id in list(self.latencies)[:limit])
+        return self.closest
+
+    def get_best_server(self, servers):
+        server = servers[0]
+        self.tested.append(server["id"])
+        latency = self.latencies[server["id"]]
+        if latency is None:
+            latency = UNREACHABLE_LATENCY_MS * 3
+        server["latency"] = latency
+        return server
+
+
+def test_server_cache(tmp_path):
+    cache = ServerCache(tmp_path / "servers.json", ttl=60)
+    assert cache.is_stale()
+    speedtest_obj = FakeSpeedtest({1: 30, 2: 10, 3: 20})
+    assert cache.choose_server(speedtest_obj)["id"] == 2  # Ranked first, since the cache is empty
+
+    # The ranking is saved, so another cache can use it without ranking
+    cache = ServerCache(tmp_path / "servers.json", ttl=60)
+    assert not cache.is_stale()
+    assert [server["id"] for server in cache.servers] == [2, 3, 1]
+    speedtest_obj = FakeSpeedtest({1: 30, 2: 10, 3: 20})
+    assert cache.choose_server(speedtest_obj)["id"] == 2
+    assert speedtest_obj.tested == [2]
+
+    # The next best server is used if the best one is down, or excluded
+    speedtest_obj = FakeSpeedtest({1: 30, 2: None, 3: 20})
+    assert cache.choose_server(speedtest_obj)["id"] == 3
+    assert cache.choose_server(speedtest_obj, exclude={"id": 3})["id"] == 1
+
+    # If every server is down, the last resort is ranking again
+    with raises(speedtest.SpeedtestBestServerFailure):
+        cache.choose_server(FakeSpeedtestWithoutServers())
+
+
+class FakeSpeedtestWithoutServers(FakeSpeedtest):
+    def __init__(self):
+        super().__init__({})
+
+    def get_best_server(self, servers):
+        raise speedtest.SpeedtestBestServerFailure()
+
+
+def test_server_cache_ignores_invalid_file(tmp_path):
+    (tmp_path / "servers.json").write_text("{not json")
+    cache = ServerCache(tmp_path / "servers.json")
+    assert cache.servers == [] and cache.is_stale()
+
+    (tmp_path / "servers.json").write_text('{"ranked_at": %f, "servers": []}' % (time() - 120))
+    assert ServerCache(tmp_path / "servers.json", ttl=60).is_stale()
+
+
+
+def test_summarise_probes():
+    assert summarise_probes([10, 14, 12, 16]) == (13, approx(10 / 3), 0)
+    assert summarise_probes([10, None, 20, None]) == (15, 10, 0.5)  # Jitter between the probes that connected
+    assert summarise_probes([30, None]) == (30, 0, 0.5)
+    assert summarise_probes([None, None]) == (0, 0, 1)
+
+
+def test_latency_recorder(monkeypatch):
+    monkeypatch.setattr(constants, "LATENCY_PROBE_SPACING", 0.01)
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(16)
+        address = listener.getsockname()
+        assert time_connect(address) is not None
+
+        recorder = LatencyRecorder("latency", targets=(address,), interval=0.1, probes=3)
+        start = monotonic()
+        first = recorder.process()
+        recorder.wait_for_next_reading()
+        second = recorder.process()
+        assert monotonic() - start >= 0.1  # The second sample waited for the interval, which isn't part of process
+
+    assert first.method is constants.RecordingMethod.LATENCY
+    assert first.loss == 0 and first.download > 0
+    assert second.timestamp > first.timestamp
+    assert not recorder.is_failed_reading(first)
+
+    # Nothing is listening any more, so every probe is lost
+    assert time_connect(address) is None
+    lost = recorder.process()
+    assert lost.loss == 1 and recorder.is_failed_reading(lost)
 
 
 if __name__ == '__main__':
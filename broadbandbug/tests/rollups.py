@@ -0,0 +1,104 @@
+""" Contains all testing functions for the rollups module. """
+from datetime import datetime, timedelta
+
+import numpy as np
+from pytest import approx
+
+from ..library import classes
+from ..library import constants
+from ..library import files
+from ..library import rollups
+from ..library import storage
+
+
+def make_readings(count: int, start: datetime = datetime(2023, 6, 1),
+                  spacing: timedelta = timedelta(minutes=10)) -> list[classes.Reading]:
+    """ Makes count readings spacing apart (10 minutes by default), alternating between two recording methods. """
+    methods = (constants.RecordingMethod.SPEEDTEST_CLI, constants.RecordingMethod.BSC)
+    return [classes.Reading(10 + i % 7, 1 + i % 3, start + spacing * i, methods[i % 2]) for i in range(count)]
+
+
+def record(path, readings: list[classes.Reading]):
+    """ Records readings while keeping the rollups up to date like a recorder would. """
+    recording = storage.open_storage(path)
+    with recording.open_appender() as appender, rollups.RollupUpdater(recording) as updater:
+        for reading in readings:
+            appender.append(reading)
+            appender.flush()
+            updater.add(reading, appender.tell())
+            updater.flush()
+
+
+def test_aggregate_percentiles():
+    aggregate = rollups.Aggregate()
+    values = np.linspace(1, 100, 1000)
+    for value in values:
+        aggregate.add(value)
+
+    assert aggregate.count == 1000 and aggregate.mean == approx(values.mean())
+    assert aggregate.minimum == 1 and aggregate.maximum == 100
+    assert aggregate.percentile(0) == 1 and aggregate.percentile(100) == 100
+    for percent in (10, 50, 90, 99):
+        # Estimates should be within a bin of the actual percentile
+        assert aggregate.percentile(percent) == approx(np.percentile(values, percent), rel=0.11)
+
+
+def test_buckets_match_readings(tmp_path):
+    readings = make_readings(500)
+    record(tmp_path / "recording.csv", readings)
+
+    for resolution in constants.RollupResolution:
+        buckets = rollups.read_rollups(tmp_path / "recording.csv", resolution)
+        assert sum(bucket.count for bucket in buckets) == len(readings)
+        assert [bucket.start for bucket in buckets] == sorted(bucket.start for bucket in buckets)
+
+        for bucket in buckets:
+            in_bucket = [reading for reading in readings if reading.method is bucket.method
+                         and rollups.get_bucket_start(reading.timestamp, resolution) == bucket.start]
+            assert bucket.count == len(in_bucket)
+            assert bucket.download.mean == approx(sum(reading.download for reading in in_bucket) / len(in_bucket))
+            assert bucket.upload.maximum == max(reading.upload for reading in in_bucket)
+
+
+def test_backfill_matches_recorded(tmp_path):
+    # Record half the readings without rollups, then the rest with them
+    readings = make_readings(300)
+    with storage.open_storage(tmp_path / "recording.bbr").open_appender() as appender:
+        for reading in readings[:150]:
+            appender.append(reading)
+    record(tmp_path / "recording.bbr", readings[150:])
+    record(tmp_path / "expected.bbr", readings)
+
+    for resolution in constants.RollupResolution:
+        caught_up = rollups.read_rollups(tmp_path / "recording.bbr", resolution)
+        expected = rollups.read_rollups(tmp_path / "expected.bbr", resolution)
+        assert [(bucket.start, bucket.method, bucket.count, bucket.download.total) for bucket in caught_up] == \
+            [(bucket.start, bucket.method, bucket.count, bucket.download.total) for bucket in expected]
+
+    # Building again shouldn't add anything
+    rollups.build_rollups(tmp_path / "recording.bbr")
+    buckets = rollups.read_rollups(tmp_path / "recording.bbr", constants.RollupResolution.DAY)
+    assert sum(bucket.count for bucket in buckets) == 300
+
+
+def test_read_results_uses_rollups(tmp_path):
+    path = tmp_path / "recording.csv"
+    readings = make_readings(3000)  # 500 hours, about 21 days
+    with storage.open_storage(path).open_appender() as appender:
+        for reading in readings:
+            appender.append(reading)
+
+    # Without rollups, every reading is returned
+    assert len(files.read_results(path, None, True, use_rollups=True)) == 3000
+
+    rollups.build_rollups(path)
+    merged = files.read_results(path, None, True, as_batch=True, use_rollups=True)
+    assert len(merged) == 500 * 2  # One per hour for each method
+
+    unmerged = files.read_results(path, None, False, use_rollups=True)
+    assert list(unmerged.keys()) == [constants.RecordingMethod.SPEEDTEST_CLI, constants.RecordingMethod.BSC]
+    assert unmerged[constants.RecordingMethod.BSC][0].timestamp == datetime(2023, 6, 1)
+
+    # Short time ranges still use the readings
+    time_constraints = (datetime(2023, 6, 2), datetime(2023, 6, 3))
+    assert len(files.read_results(path, time_constraints, True, use_rollups=True)) == 145
@@ -0,0 +1,77 @@
+""" Contains all testing functions for the scheduler module. """
+from datetime import datetime
+from threading import Event, Lock, Thread
+from time import monotonic, sleep
+
+from pytest import raises
+
+from ..library import classes
+from ..library import constants
+from ..library import scheduler
+from ..library import storage
+
+
+class IntervalRecorder(classes.BaseRecorder):
+    """ A recorder whose readings take a short time, recording when each one started and finished. """
+    intervals = []
+    intervals_lock = Lock()
+
+    def process(self) -> classes.Reading:
+        start = monotonic()
+        sleep(0.02)
+        with IntervalRecorder.intervals_lock:
+            IntervalRecorder.intervals.append((start, monotonic()))
+        return classes.Reading(10, 1, datetime.now(), constants.RecordingMethod.SPEEDTEST_CLI)
+
+
+def test_readings_never_overlap(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+    IntervalRecorder.intervals = []
+    recorders = [IntervalRecorder(f"recorder {i}") for i in range(3)]
+
+    with scheduler.RecorderScheduler(recorders, bandwidth_lease=scheduler.BandwidthLease(gap=0.005)) as running:
+        sleep(0.5)
+    assert not any(recorder.recorder_running for recorder in recorders)
+    assert running.errors() == {}
+
+    intervals = sorted(IntervalRecorder.intervals)
+    assert len(intervals) > 6
+    for (_, end), (next_start, _) in zip(intervals, intervals[1:]):
+        assert end <= next_start
+
+    stats = running.stats()
+    assert set(stats.keys()) == {recorder.identifier for recorder in recorders}
+    assert sum(recorder_stats.readings for recorder_stats in stats.values()) == len(intervals)
+    for recorder_stats in stats.values():
+        # Turns are taken in order, so each recorder gets a similar share
+        assert recorder_stats.readings >= len(intervals) // 3 - 1
+        assert recorder_stats.mean_wait > 0 and recorder_stats.mean_download == 10
+        assert recorder_stats.readings_per_hour > 0
+
+    # Every reading is written to the file
+    assert len(list(storage.open_storage(tmp_path / "recording.csv").iter_readings())) == len(intervals)
+
+
+def test_stop_while_waiting():
+    lease = scheduler.BandwidthLease(gap=0)
+    held = lease.acquire("first")
+    stop_event = Event()
+    results = []
+    thread = Thread(target=lambda: results.append(lease.acquire("second", stop_event)))
+    thread.start()
+
+    sleep(0.05)
+    stop_event.set()
+    thread.join(5)
+    assert results == [None]
+
+    held.release()
+    assert not lease.held
+    assert lease.stats["first"].leases == 1 and lease.stats["second"].leases == 0
+
+
+def test_max_recorders():
+    running = scheduler.RecorderScheduler(max_recorders=1)
+    running.add(classes.BaseRecorder())
+    with raises(ValueError):
+        running.add(classes.BaseRecorder())
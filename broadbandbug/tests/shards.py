@@ -0,0 +1,145 @@
+""" Contains all testing functions for the shards module. """
+from datetime import datetime, timedelta
+
+from ..library import classes
+from ..library import constants
+from ..library import files
+from ..library import index
+from ..library import rollups
+from ..library import shards
+from ..library import storage
+from .rollups import make_readings, record
+
+
+READING_SPACING = timedelta(hours=3)  # 8 readings a day, so they span several shards
+
+
+def test_roll(tmp_path):
+    path = tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX)
+    readings = make_readings(100, spacing=READING_SPACING)  # From June 1st to June 13th, 8 a day
+    record(path, readings)
+    expected = files.read_results(path, None, True, as_batch=True)
+
+    assert shards.roll(path, constants.ShardPeriod.DAY, now=datetime(2023, 6, 10, 12)) == 72
+    manifest = shards.Manifest.load(path)
+    assert len(manifest.shards) == 9  # A shard for each day up to June 9th
+    assert all(shard.count == 8 and shard.earliest >= shard.start and shard.latest < shard.start + 24 * 60 * 60
+               for shard in manifest.shards.values())
+    assert len(storage.open_storage(path).read_arrays()) == 28  # Only the current day and later are left
+    assert shards.roll(path, constants.ShardPeriod.DAY, now=datetime(2023, 6, 10, 12)) == 0
+
+    # Reading everything gives the same readings, in order
+    batch = files.read_results(path, None, True, as_batch=True)
+    assert (batch.timestamps == expected.timestamps).all() and (batch.downloads == expected.downloads).all()
+    assert [reading.timestamp for reading in files.read_results(path, None, True)] == \
+           [reading.timestamp for reading in readings]
+    # The rollups still include the readings that were moved
+    assert sum(bucket.count for bucket in rollups.read_rollups(path, constants.RollupResolution.DAY)) == 100
+
+
+def test_read_range(tmp_path, monkeypatch):
+    path = tmp_path / "recording.csv"
+    readings = make_readings(100, spacing=READING_SPACING)
+    record(path, readings)
+    shards.roll(path, constants.ShardPeriod.DAY, now=datetime(2023, 6, 10, 12))
+
+    # Only the shards overlapping the time constraints, and the recording file, should be read
+    read_paths = []
+    read_arrays = index.read_arrays_in_range
+    monkeypatch.setattr(index, "read_arrays_in_range", lambda path, *args: read_paths.append(path) or
+                        read_arrays(path, *args))
+    time_constraints = (datetime(2023, 6, 3, 12), datetime(2023, 6, 5, 12))
+    groups = files.read_results(path, time_constraints, False, as_batch=True)
+    assert [path.name for path in read_paths] == ["recording.2023-06-03.csv", "recording.2023-06-04.csv",
+                                                  "recording.2023-06-05.csv", "recording.csv"]
+
+    expected = [reading for reading in readings if files.check_reading_in_constraints(reading, time_constraints)]
+    assert sorted(groups.keys(), key=lambda method: method.value) == \
+           sorted({reading.method for reading in expected}, key=lambda method: method.value)
+    for method, batch in groups.items():
+        assert list(batch) == [reading for reading in expected if reading.method == method]
+    assert files.read_results(path, time_constraints, True) == expected
+
+
+def test_late_readings(tmp_path):
+    path = tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX)
+    readings = make_readings(20, spacing=READING_SPACING)
+    record(path, readings)
+    assert shards.roll(path, constants.ShardPeriod.MONTH, now=datetime(2023, 7, 1)) == 20
+
+    # A reading for June arriving in July, and one copied by an interrupted roll, are added to June's shard once
+    late = classes.Reading(1, 1, datetime(2023, 6, 1, 1), constants.RecordingMethod.SPEEDTEST_CLI)
+    record(path, [late, readings[0]])
+    assert shards.roll(path, constants.ShardPeriod.MONTH, now=datetime(2023, 7, 1)) == 2
+    manifest = shards.Manifest.load(path)
+    assert list(manifest.shards) == ["recording.2023-06.bbr"]
+    assert manifest.shards["recording.2023-06.bbr"].count == 21
+    assert files.read_results(path, None, True) == sorted(readings + [late], key=lambda reading: reading.timestamp)
+
+
+def test_writer_rollover(tmp_path):
+    path = tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX)
+    tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+    # Timestamps in the future, so the writer's current day ends during them
+    readings = make_readings(20, tomorrow, READING_SPACING)
+    writer = files.ResultsWriter(path, shard_period=constants.ShardPeriod.DAY)
+    for reading in readings:
+        writer.write(reading)
+    writer.close()
+
+    # A shard is made for each day once the next day's first reading is written, so the last day is left
+    assert [shard.count for shard in shards.Manifest.load(path).get_shards()] == [8, 8]
+    assert len(storage.open_storage(path).read_arrays()) == 4
+    assert files.read_results(path, None, True) == readings
+
+
+def test_compact(tmp_path):
+    path = tmp_path / "recording.csv"
+    readings = make_readings(100, spacing=READING_SPACING)
+    record(path, readings)
+    shards.roll(path, constants.ShardPeriod.DAY, now=datetime(2023, 6, 10, 12))
+    uncompressed_size = sum(file.stat().st_size for file in shards.get_shards_dir(path).glob("*.csv"))
+
+    # Only shards whose day ended at least 2 days ago are compressed
+    assert shards.compact(path, timedelta(days=2), constants.Compression.GZIP, now=datetime(2023, 6, 10, 12)) == 7
+    manifest = shards.Manifest.load(path)
+    assert [shard.compression for shard in manifest.get_shards()] == [".gz"] * 7 + [None] * 2
+    assert len(list(shards.get_shards_dir(path).glob("*.csv"))) == 2  # The compressed shards replaced the others
+    compressed_size = sum(file.stat().st_size for file in shards.get_shards_dir(path).glob("*.gz"))
+    assert compressed_size < uncompressed_size * 7 / 9
+    assert files.read_results(path, None, True) == readings
+    time_constraints = (datetime(2023, 6, 3, 12), datetime(2023, 6, 5, 12))
+    assert list(files.read_results(path, time_constraints, True, as_batch=True)) == \
+           [reading for reading in readings if files.check_reading_in_constraints(reading, time_constraints)]
+
+    # A late reading for a compressed shard's day is added to it, leaving it uncompressed until the next compaction
+    late = classes.Reading(1, 1, datetime(2023, 6, 1, 1), constants.RecordingMethod.SPEEDTEST_CLI)
+    record(path, [late])
+    shards.roll(path, constants.ShardPeriod.DAY, now=datetime(2023, 6, 10, 12))
+    assert shards.Manifest.load(path).get_shards()[0].compression is None
+    assert not (shards.get_shards_dir(path) / "recording.2023-06-01.csv.gz").exists()
+    assert files.read_results(path, None, True) == sorted(readings + [late], key=lambda reading: reading.timestamp)
+    assert shards.compact(path, timedelta(days=2), constants.Compression.GZIP, now=datetime(2023, 6, 10, 12)) == 1
+
+
+def test_iter_batches(tmp_path):
+    path = tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX)
+    readings = make_readings(100, spacing=READING_SPACING)
+    record(path, readings)
+    shards.roll(path, constants.ShardPeriod.DAY, now=datetime(2023, 6, 10, 12))
+    late = classes.Reading(1, 1, datetime(2023, 6, 2, 1), constants.RecordingMethod.SPEEDTEST_CLI)
+    record(path, [late])
+
+    # A batch for each shard (with the late reading in June 2nd's), then the recording file, in order
+    batches = list(shards.iter_batches(path, None))
+    assert [len(batch) for batch, _ in batches] == [8, 9] + [8] * 7 + [28]
+    assert [loaded for _, loaded in batches] == [number / 10 for number in range(1, 11)]
+    expected = sorted(readings + [late], key=lambda reading: reading.timestamp)
+    assert [reading for batch, _ in batches for reading in batch] == expected
+
+    # The chunks of iter_result_batches join up to the same readings as read_results
+    time_constraints = (datetime(2023, 6, 3, 12), datetime(2023, 6, 11, 12))
+    chunks = list(files.iter_result_batches(path, time_constraints, chunk_size=5))
+    assert all(len(chunk) <= 5 for chunk, _ in chunks) and chunks[-1][1] == 1
+    assert [loaded for _, loaded in chunks] == sorted(loaded for _, loaded in chunks)
+    assert [reading for chunk, _ in chunks for reading in chunk] == files.read_results(path, time_constraints, True)
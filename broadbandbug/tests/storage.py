@@ -0,0 +1,202 @@
+""" Contains all testing functions for the storage module. """
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from pytest import raises
+
+from ..library import classes
+from ..library import constants
+from ..library import files
+from ..library import storage
+
+
+test_path = Path("./broadbandbug/tests/resources").absolute()
+
+
+def make_readings() -> list[classes.Reading]:
+    return [classes.Reading(10.5, 5.25, datetime(2023, 6, 23, 0, 0, 0), constants.RecordingMethod.SPEEDTEST_CLI),
+            classes.Reading(20, 10, datetime(2023, 6, 24, 12, 30, 15), constants.RecordingMethod.BSC, 4),
+            classes.Reading(0, 0, datetime(2023, 6, 25, 23, 59, 59), constants.RecordingMethod.WHICH_WEBSITE),
+            classes.Reading(12.5, 1.5, datetime(2023, 6, 26, 8, 0, 0, 250000), constants.RecordingMethod.LATENCY,
+                            loss=0.25)]
+
+
+def test_open_storage_chooses_by_suffix():
+    assert isinstance(storage.open_storage("RECORDING.csv"), storage.CSVStorage)
+    assert isinstance(storage.open_storage("RECORDING" + constants.BINARY_RECORDING_SUFFIX), storage.BinaryStorage)
+
+
+def test_csv_round_trip(tmp_path):
+    csv_storage = storage.CSVStorage(tmp_path / "recording.csv")
+    # Append over two sessions, to check the header is only written once
+    with csv_storage.open_appender() as appender:
+        appender.append(make_readings()[0])
+    with csv_storage.open_appender() as appender:
+        for reading in make_readings()[1:]:
+            appender.append(reading)
+
+    assert list(csv_storage.iter_readings()) == make_readings()
+
+
+def test_binary_round_trip(tmp_path):
+    binary_storage = storage.BinaryStorage(tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX))
+    with binary_storage.open_appender() as appender:
+        appender.append(make_readings()[0])
+    with binary_storage.open_appender() as appender:
+        for reading in make_readings()[1:]:
+            appender.append(reading)
+
+    # Values used are exactly representable as float32, so they should be unchanged
+    assert list(binary_storage.iter_readings()) == make_readings()
+
+    records = binary_storage.read_arrays()
+    assert records["download"].tolist() == [10.5, 20, 0, 12.5]
+    assert records["method"].tolist() == [0, 1, 2, 3]
+    assert np.isnan(records["loss"][:3]).all() and records["loss"][3] == 0.25
+
+
+def test_binary_partial_record_discarded(tmp_path):
+    binary_storage = storage.BinaryStorage(tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX))
+    with binary_storage.open_appender() as appender:
+        appender.append(make_readings()[0])
+
+    # Simulate the program stopping partway through writing a record
+    with open(binary_storage.path, "ab") as file:
+        file.write(b"\x00" * 5)
+    assert binary_storage.count_records() == 1
+
+    with binary_storage.open_appender() as appender:
+        appender.append(make_readings()[1])
+    assert list(binary_storage.iter_readings()) == make_readings()[:2]
+
+
+def test_binary_invalid_file():
+    with raises(storage.BinaryFormatError):
+        storage.BinaryStorage(test_path / "artificial.csv").read_arrays()
+
+
+def test_convert_csv_to_binary(tmp_path):
+    binary_path = tmp_path / ("artificial" + constants.BINARY_RECORDING_SUFFIX)
+    assert storage.convert_csv_to_binary(test_path / "artificial.csv", binary_path) == 15
+
+    # Both formats should give the same results when read
+    assert (files.read_results(binary_path, None, False)
+            == files.read_results(test_path / "artificial.csv", None, False))
+
+
+def test_csv_read_arrays():
+    csv_storage = storage.CSVStorage(test_path / "artificial.csv")
+    records = csv_storage.read_arrays()
+    readings = list(csv_storage.iter_readings())
+
+    assert records["timestamp"].tolist() == [reading.timestamp.timestamp() for reading in readings]
+    assert records["download"].tolist() == [reading.download for reading in readings]
+    assert records["method"].tolist() == [constants.METHOD_CODES[reading.method] for reading in readings]
+
+
+def test_binary_iter_readings_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "BINARY_CHUNK_SIZE", 2)
+    binary_path = tmp_path / ("artificial" + constants.BINARY_RECORDING_SUFFIX)
+    storage.convert_csv_to_binary(test_path / "artificial.csv", binary_path)
+    binary_storage = storage.BinaryStorage(binary_path)
+    expected = list(storage.CSVStorage(test_path / "artificial.csv").iter_readings())
+
+    assert list(binary_storage.iter_readings()) == expected
+    offset = binary_storage.data_offset() + 3 * storage.RECORD_STRUCT.size
+    assert list(binary_storage.iter_readings(offset, 5)) == expected[3:8]
+
+
+def test_compressed(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "BINARY_CHUNK_SIZE", 3)  # So reading takes more than one chunk
+    for suffix in (".csv", constants.BINARY_RECORDING_SUFFIX):
+        path = tmp_path / ("recording" + suffix)
+        with storage.open_storage(path).open_appender() as appender:
+            for reading in make_readings() * 2:
+                appender.append(reading)
+
+        for compression in constants.Compression:
+            compressed_path = path.with_name(path.name + compression.value)
+            with open(path, "rb") as file, storage.COMPRESSED_OPENERS[compression](compressed_path, "wb") as output:
+                output.write(file.read())
+            compressed = storage.open_storage(compressed_path)
+            assert type(compressed) is type(storage.open_storage(path)) and compressed.compression is compression
+
+            assert list(compressed.iter_readings()) == make_readings() * 2
+            assert compressed.read_arrays().tobytes() == storage.open_storage(path).read_arrays().tobytes()
+            offsets = list(storage.open_storage(path).iter_readings_with_offsets())
+            assert list(compressed.iter_readings_with_offsets()) == offsets
+            assert list(compressed.iter_readings(offsets[5][0], 2)) == make_readings()[1:3]
+            with raises(ValueError):
+                compressed.open_appender()
+
+
+def test_csv_without_streams_column(tmp_path):
+    # Files made before streams were recorded should still be appended to in their own format
+    path = tmp_path / "recording.csv"
+    path.write_text("download,upload,timestamp,method\r\n")
+    with storage.CSVStorage(path).open_appender() as appender:
+        appender.append(make_readings()[1])
+
+    assert path.read_text().splitlines()[1] == "20,10,24/06/2023 12:30:15,Broadband Speed Checker"
+    assert list(storage.CSVStorage(path).iter_readings()) == [classes.Reading(20, 10, datetime(2023, 6, 24, 12, 30, 15),
+                                                                              constants.RecordingMethod.BSC)]
+
+
+def test_binary_version_1(tmp_path):
+    # Version 1 files have no streams, but should still be readable and appendable
+    binary_storage = storage.BinaryStorage(tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX))
+    with open(binary_storage.path, "wb") as file:
+        file.write(storage.HEADER_STRUCT.pack(storage.BINARY_MAGIC, 1, storage.RECORD_DTYPES[1].itemsize))
+    with binary_storage.open_appender() as appender:
+        for reading in make_readings():
+            appender.append(reading)
+
+    assert binary_storage.count_records() == 4
+    expected = [classes.Reading(reading.download, reading.upload, reading.timestamp, reading.method)
+                for reading in make_readings()]
+    assert list(binary_storage.iter_readings()) == expected
+    assert binary_storage.read_arrays()["streams"].tolist() == [0, 0, 0, 0]
+    assert np.isnan(binary_storage.read_arrays()["loss"]).all()
+
+
+def test_upgrade(tmp_path):
+    csv_storage = storage.CSVStorage(tmp_path / "recording.csv")
+    csv_storage.path.write_text("download,upload,timestamp,method\r\n"
+                                "20.1,10,24/06/2023 12:30:15,Broadband Speed Checker\r\n\r\n"
+                                "0,0,25/06/2023 23:59:59,Which? Website\r\n12.5,1.5,26/06/20")
+    assert csv_storage.is_outdated()
+    csv_storage.upgrade()
+    assert not csv_storage.is_outdated()
+    # Values are kept as they were written, and the partly written row is dropped
+    assert csv_storage.path.read_text().splitlines() == [
+        "download,upload,timestamp,method,streams,loss", "20.1,10,24/06/2023 12:30:15,Broadband Speed Checker,,",
+        "0,0,25/06/2023 23:59:59,Which? Website,,"]
+
+    binary_storage = storage.BinaryStorage(tmp_path / ("recording" + constants.BINARY_RECORDING_SUFFIX))
+    with open(binary_storage.path, "wb") as file:
+        file.write(storage.HEADER_STRUCT.pack(storage.BINARY_MAGIC, 1, storage.RECORD_DTYPES[1].itemsize))
+    with binary_storage.open_appender() as appender:
+        appender.append_records(csv_storage.read_arrays())
+    assert binary_storage.is_outdated()
+    binary_storage.upgrade()
+    assert not binary_storage.is_outdated()
+    assert binary_storage.read_arrays().tobytes() == csv_storage.read_arrays().tobytes()  # NaN isn't equal to itself
+
+    # Readings appended after upgrading keep every field
+    for upgraded in (csv_storage, binary_storage):
+        with upgraded.open_appender() as appender:
+            appender.append(make_readings()[3])
+        assert list(upgraded.iter_readings())[-1] == make_readings()[3]
+
+
+def test_csv_sub_second_timestamps(tmp_path):
+    csv_storage = storage.CSVStorage(tmp_path / "recording.csv")
+    with csv_storage.open_appender() as appender:
+        for reading in make_readings():
+            appender.append(reading)
+
+    assert csv_storage.path.read_text().splitlines()[4] == "12.5,1.5,26/06/2023 08:00:00.250,Latency probe,,0.25"
+    records = csv_storage.read_arrays()
+    assert records["timestamp"][3] == datetime(2023, 6, 26, 8, 0, 0, 250000).timestamp()
+    assert records["loss"][3] == 0.25 and np.isnan(records["loss"][:3]).all()
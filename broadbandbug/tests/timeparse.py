@@ -0,0 +1,65 @@
+""" Contains all testing functions for the timeparse module. Behaviour shared with Reading.convert_string_to_datetime
+is tested in the classes tests. """
+from datetime import datetime
+
+from pytest import raises
+
+from ..library import constants
+from ..library import timeparse
+
+
+valid_timestamps = ["10/12/2013 05:57:30", "1/1/0001 0:0:0", "27/06/2023 00:00:5", "29/02/2024 23:59:59",
+                    "31/12/1999 12:00:00"]
+invalid_timestamps = ["", "10:12/2013 05:57:30", "10/12/201305:57:30", "10/13/2013 05:57:30", "10/12/2013 05:57:60",
+                      "29/02/2023 00:00:00", "00/12/2013 05:57:30", "10/12/13 05:57:30", "+1/12/2013 05:57:30",
+                      "1_/12/2013 05:57:30", "10/12/2013 24:00:00", "10/12/2013 05:57:30 "]
+
+
+def test_parse_timestamp_matches_strptime():
+    for string in valid_timestamps:
+        assert timeparse.parse_timestamp(string) == datetime.strptime(string, constants.TIME_FORMAT)
+
+
+def test_parse_timestamp_invalid():
+    for string in invalid_timestamps:
+        with raises(ValueError):
+            datetime.strptime(string, constants.TIME_FORMAT)  # Check the test itself is correct
+        with raises(ValueError):
+            timeparse.parse_timestamp(string)
+
+
+def test_parse_timestamps_matches_scalar():
+    strings = valid_timestamps[2:] * 3  # Years before 1970 are avoided, as local time is unreliable for them
+    expected = [timeparse.parse_timestamp(string).timestamp() for string in strings]
+    assert timeparse.parse_timestamps(strings).tolist() == expected
+    assert timeparse.parse_timestamps([]).tolist() == []
+
+
+def test_parse_timestamps_invalid():
+    for string in invalid_timestamps:
+        with raises(ValueError):
+            timeparse.parse_timestamps(["10/12/2013 05:57:30", string])
+
+
+def test_milliseconds():
+    timestamp = datetime(2023, 7, 5, 9, 3, 2, 250000)
+    assert timeparse.format_timestamp(timestamp, milliseconds=True) == "05/07/2023 09:03:02.250"
+    assert timeparse.format_timestamp(datetime(2023, 7, 5, 9, 3, 2), milliseconds=True) == "05/07/2023 09:03:02"
+    # Without milliseconds, timestamps are written as before, so strptime can still parse them
+    assert timeparse.format_timestamp(timestamp) == "05/07/2023 09:03:02"
+    assert datetime.strptime(timeparse.format_timestamp(timestamp), constants.TIME_FORMAT) == \
+           timestamp.replace(microsecond=0)
+    assert timeparse.parse_timestamp("05/07/2023 09:03:02.250") == timestamp
+    assert timeparse.parse_timestamp("5/7/2023 9:3:2.25") == timestamp
+
+    # Padded timestamps with milliseconds are parsed together, others individually
+    strings = ["05/07/2023 09:03:02.250", "05/07/2023 09:03:02", "5/7/2023 09:03:02.5", "05/07/2023 09:03:02.123456"]
+    expected = [timeparse.parse_timestamp(string).timestamp() for string in strings]
+    assert timeparse.parse_timestamps(strings).tolist() == expected
+
+    for string in ["05/07/2023 09:03:02.", "05/07/2023 09:03:02.25x", "05/07/2023 09:03:02,250",
+                   "05/07/2023 09:03:02.1234567"]:
+        with raises(ValueError):
+            timeparse.parse_timestamp(string)
+        with raises(ValueError):
+            timeparse.parse_timestamps([string])
@@ -0,0 +1,125 @@
+""" Contains all testing functions for the timings module. """
+from datetime import datetime
+from threading import Thread
+from time import sleep
+
+from pytest import approx, raises
+
+from ..library import classes
+from ..library import constants
+from ..library import engine
+from ..library import files
+from ..library import timings
+
+
+def test_histogram():
+    histogram = timings.Histogram((0.01, 0.1, 1))
+    assert histogram.summary()["p50"] == 0 and histogram.summary()["min"] == 0
+
+    for seconds in [0.005] * 6 + [0.05] * 3 + [5]:
+        histogram.add(seconds)
+    assert histogram.counts == [6, 3, 0, 1]
+    assert histogram.count == 10 and histogram.total == approx(5.18)
+    assert histogram.min == 0.005 and histogram.max == 5 and histogram.last == 5
+
+    # Percentiles are the upper bound of their bucket, limited to the durations seen
+    assert histogram.percentile(0.5) == 0.01
+    assert histogram.percentile(0.9) == 0.1
+    assert histogram.percentile(0.99) == 5
+    assert histogram.percentile(0) == 0.01
+
+
+def test_registry():
+    registry = timings.TimingRegistry((0.01, 0.1, 1))
+    with registry.time("recorder", "phase"):
+        sleep(0.02)
+    with raises(ValueError):
+        with registry.time("recorder", "failing phase"):
+            raise ValueError()
+    registry.record("other", "phase", 0.5)
+
+    snapshot = registry.snapshot()
+    assert set(snapshot) == {"recorder", "other"}
+    assert set(snapshot["recorder"]) == {"phase", "failing phase"}  # Recorded even though it raised an error
+    assert snapshot["recorder"]["phase"]["count"] == 1 and 0.02 <= snapshot["recorder"]["phase"]["max"] < 1
+    assert snapshot["other"]["phase"]["mean"] == 0.5
+
+    # Copies don't change when the registry does
+    histograms = registry.get_histograms()
+    registry.record("other", "phase", 0.5)
+    assert histograms["other"]["phase"].counts == [0, 0, 1, 0] and histograms["other"]["phase"].count == 1
+
+    registry.reset("other")
+    assert set(registry.snapshot()) == {"recorder"}
+    registry.reset()
+    assert registry.snapshot() == {}
+
+
+class PhasedRecorder(classes.BaseRecorder):
+    """ Takes readings with two sub-phases, timed with time_phase. """
+    def process(self) -> classes.Reading:
+        with self.time_phase("download"):
+            sleep(0.01)
+        with self.time_phase("upload"):
+            sleep(0.01)
+        return classes.Reading(10, 2, datetime.now(), constants.RecordingMethod.SPEEDTEST_CLI)
+
+
+class WaitingRecorder(PhasedRecorder):
+    """ Waits between readings, like the latency recorder does until its next sample is due. """
+    def wait_for_next_reading(self):
+        with self.time_phase("interval wait"):
+            self.stop_event.wait(0.05)
+
+
+def test_recording_loop_phases(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+    monkeypatch.setattr(constants, "SLOW_READING_THRESHOLD", 0)  # So every reading is logged
+    logged = []
+    monkeypatch.setattr(classes.BaseRecorder.get_logger(), "warning", logged.append)
+    classes.BaseRecorder.get_timings().reset()
+
+    recorder = PhasedRecorder("phased")
+    thread = Thread(target=recorder.recording_loop)
+    thread.start()
+    sleep(0.2)
+    recorder.send_stop_signal()
+    thread.join()
+
+    snapshot = classes.BaseRecorder.get_timings().snapshot()
+    phases = snapshot["phased"]
+    assert {"prepare", "process", "download", "upload", "publish", "queue put", "reading", "cleanup"} <= set(phases)
+    assert phases["download"]["count"] == phases["upload"]["count"] >= phases["reading"]["count"] > 0
+    assert phases["process"]["min"] >= phases["download"]["min"] + phases["upload"]["min"]
+    assert snapshot[files.WRITER_TIMINGS_NAME]["write"]["count"] == phases["reading"]["count"]
+
+    # Slow readings are logged with their phases, longest first
+    assert logged and logged[0].startswith("Reading by 'phased' took") and "download" in logged[0]
+
+
+def test_executor_recorder_phases(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+    classes.BaseRecorder.get_timings().reset()
+    with engine.RecorderRunner([PhasedRecorder("phased")]):
+        sleep(0.2)
+    phases = classes.BaseRecorder.get_timings().snapshot()["phased"]
+    assert {"prepare", "process", "download", "upload", "publish", "queue put", "reading", "cleanup"} <= set(phases)
+
+
+def test_interval_wait_not_timed_as_reading(tmp_path, monkeypatch):
+    monkeypatch.setattr(classes.BaseRecorder, "csv_path", tmp_path / "recording.csv")
+    classes.BaseRecorder.get_timings().reset()
+    recorder = WaitingRecorder("waiting")
+    thread = Thread(target=recorder.recording_loop)
+    thread.start()
+    sleep(0.3)
+    recorder.send_stop_signal()
+    thread.join()
+    with engine.RecorderRunner([WaitingRecorder("waiting executor")]):
+        sleep(0.3)
+
+    snapshot = classes.BaseRecorder.get_timings().snapshot()
+    for phases in (snapshot["waiting"], snapshot["waiting executor"]):
+        # The wait is a phase of its own, which isn't part of the process or reading phases
+        assert phases["interval wait"]["count"] >= phases["reading"]["count"] > 0
+        assert phases["process"]["min"] < 0.05 and phases["reading"]["min"] < 0.05